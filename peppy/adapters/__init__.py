@@ -1,4 +1,5 @@
 from __future__ import annotations
 
 from .ip2location import Ip2LocationApi
+from .ip2location_database import Ip2LocationDatabase
 from .performance_service import PerformanceServiceApi
@@ -28,10 +28,12 @@ class Ip2LocationApi:
         *,
         api_root_url: str = IP2LOCATION_BASE_API,
         silent_fail: bool = False,
+        timeout: float = 2,
     ) -> None:
         self.root_url = api_root_url
         self.api_key = api_key
         self.silent_fail = silent_fail
+        self.timeout = timeout
 
     def query_ip(self, ip_address: str) -> IPQueryResult | None:
         response = requests.get(
@@ -40,6 +42,7 @@ class Ip2LocationApi:
                 "key": self.api_key,
                 "ip": ip_address,
             },
+            timeout=self.timeout,
         )
 
         response.raise_for_status()
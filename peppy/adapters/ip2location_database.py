@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import bisect
+import csv
+import ipaddress
+from array import array
+from functools import lru_cache
+from typing import Optional
+
+from .ip2location import Ip2LocationApi
+from .ip2location import IPQueryResult
+
+_MAX_IPV4 = 2**32 - 1
+
+
+class Ip2LocationDatabase:
+    """Answers geolocation queries from a local IP2Location IPv4 CSV database
+    (DB5 layout or wider: ip_from, ip_to, country_code, country_name,
+    region_name, city_name, latitude, longitude, ...).
+
+    Ranges are kept in sorted arrays and looked up by binary search. IPs the
+    database doesn't cover (eg. IPv6) are passed to `fallback`, if given.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        fallback: Optional[Ip2LocationApi] = None,
+        cache_size: int = 4096,
+    ) -> None:
+        self.fallback = fallback
+
+        self._range_starts = array("L")
+        self._range_ends = array("L")
+        self._range_locations: list[tuple[str, str, str, float, float]] = []
+        self._load(path)
+
+        # Only the database lookups are cached. Fallback answers (and failures)
+        # would otherwise stick around until evicted.
+        self._cached_lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def __len__(self) -> int:
+        return len(self._range_starts)
+
+    def _load(self, path: str) -> None:
+        # Many ranges share a location, store each one only once.
+        locations: dict[tuple[str, str, str, float, float], int] = {}
+        rows = []
+
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                ip_from, ip_to = int(row[0]), int(row[1])
+                if ip_to > _MAX_IPV4:
+                    continue
+
+                location = (row[2], row[3], row[4], float(row[6]), float(row[7]))
+                location_id = locations.setdefault(location, len(locations))
+                rows.append((ip_from, ip_to, location_id))
+
+        location_list = list(locations)
+        rows.sort()
+        for ip_from, ip_to, location_id in rows:
+            self._range_starts.append(ip_from)
+            self._range_ends.append(ip_to)
+            self._range_locations.append(location_list[location_id])
+
+    def _lookup(self, ip_address: str) -> Optional[IPQueryResult]:
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+
+        if ip.version != 4:
+            return None
+
+        ip_int = int(ip)
+        index = bisect.bisect_right(self._range_starts, ip_int) - 1
+        if index < 0 or ip_int > self._range_ends[index]:
+            return None
+
+        (
+            country_code,
+            country_name,
+            region_name,
+            latitude,
+            longitude,
+        ) = self._range_locations[index]
+        return IPQueryResult(
+            ip=ip_address,
+            country_code=country_code,
+            country_name=country_name,
+            region_name=region_name,
+            latitude=latitude,
+            longitude=longitude,
+            is_proxy=False,
+        )
+
+    def query_ip(self, ip_address: str) -> IPQueryResult | None:
+        result = self._cached_lookup(ip_address)
+        if result is None and self.fallback is not None:
+            return self.fallback.query_ip(ip_address)
+        return result
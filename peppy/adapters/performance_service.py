@@ -1,10 +1,18 @@
 from __future__ import annotations
 
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from dataclasses import dataclass
+from dataclasses import field
 from typing import Any
+from typing import Callable
 from typing import Optional
 
 import requests
+from logger import log
 
 
 @dataclass
@@ -16,7 +24,7 @@ class PerformanceResult:
     max_combo: int
 
 
-@dataclass
+@dataclass(frozen=True)
 class PerformanceRequest:
     beatmap_id: int
     mode: int
@@ -27,21 +35,54 @@ class PerformanceRequest:
     passed_objects: Optional[int]
 
 
+PerformanceCallback = Callable[[PerformanceResult], None]
+
+
+@dataclass
+class _PendingCalculation:
+    future: Future[PerformanceResult] = field(default_factory=Future)
+    callbacks: list[PerformanceCallback] = field(default_factory=list)
+
+
 class PerformanceServiceApi:
+    """Client for the performance service.
+
+    Calculations are memoised, identical in-flight calculations are shared and
+    concurrent ones are sent together to the list endpoint by a dispatcher thread.
+    """
+
     def __init__(
         self,
         base_url: str,
         *,
         timeout: int = 1,
+        result_timeout: float = 5.0,
+        batch_window: float = 0.005,
+        max_batch_size: int = 128,
+        cache_size: int = 4096,
     ) -> None:
         self._base_url = base_url
         self._timeout = timeout
+        self._result_timeout = result_timeout
+        self._batch_window = batch_window
+        self._max_batch_size = max_batch_size
+        self._cache_size = cache_size
+
+        self._session = requests.Session()
+
+        # Everything below is guarded by `_lock`.
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[PerformanceRequest, PerformanceResult] = OrderedDict()
+        self._in_flight: dict[PerformanceRequest, _PendingCalculation] = {}
+        self._dispatcher: Optional[threading.Thread] = None
+
+        self._queue: queue.SimpleQueue[PerformanceRequest] = queue.SimpleQueue()
 
     def __make_performance_request(
         self,
         calculation_requests: list[PerformanceRequest],
     ) -> list[dict[str, Any]]:
-        respone = requests.post(
+        respone = self._session.post(
             self._base_url + "/api/v1/calculate",
             json=[
                 {
@@ -60,6 +101,107 @@ class PerformanceServiceApi:
         respone.raise_for_status()
         return respone.json()
 
+    def __dispatch_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._batch_window
+            while len(batch) < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self.__send_batch(batch)
+            except Exception as e:
+                # Never leave the callers waiting, nor let the thread die
+                log.error(f"Performance service dispatcher failed: {e!r}")
+                self.__fail_batch(batch, e)
+
+    def __fail_batch(self, batch: list[PerformanceRequest], exc: Exception) -> None:
+        with self._lock:
+            pending = [self._in_flight.pop(req, None) for req in batch]
+        for calculation in pending:
+            if calculation is not None and not calculation.future.done():
+                calculation.future.set_exception(exc)
+
+    def __send_batch(self, batch: list[PerformanceRequest]) -> None:
+        try:
+            responses = self.__make_performance_request(batch)
+            if len(responses) != len(batch):
+                raise ValueError(
+                    f"Expected {len(batch)} results, got {len(responses)}",
+                )
+
+            results = [
+                PerformanceResult(
+                    stars=response["stars"],
+                    pp=response["pp"],
+                    ar=response["ar"],
+                    od=response["od"],
+                    max_combo=response["max_combo"],
+                )
+                for response in responses
+            ]
+        except Exception as e:
+            log.error(
+                f"Performance service request of {len(batch)} calculations failed: {e!r}",
+            )
+            self.__fail_batch(batch, e)
+            return
+
+        completed = []
+        with self._lock:
+            for req, result in zip(batch, results):
+                self._cache[req] = result
+                completed.append((self._in_flight.pop(req), result))
+
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        for calculation, result in completed:
+            calculation.future.set_result(result)
+            for callback in calculation.callbacks:
+                try:
+                    callback(result)
+                except Exception as e:
+                    log.error(f"Performance service callback failed: {e!r}")
+
+    def __submit(
+        self,
+        request: PerformanceRequest,
+        callback: Optional[PerformanceCallback] = None,
+    ) -> PerformanceResult | Future[PerformanceResult]:
+        """Returns the memoised result of `request`, or a future of it. If
+        given, `callback` is only ever called by the dispatcher thread."""
+
+        with self._lock:
+            result = self._cache.get(request)
+            if result is not None:
+                self._cache.move_to_end(request)
+                return result
+
+            calculation = self._in_flight.get(request)
+            if calculation is None:
+                calculation = self._in_flight[request] = _PendingCalculation()
+                self._queue.put(request)
+
+            if callback is not None:
+                calculation.callbacks.append(callback)
+
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(
+                    target=self.__dispatch_loop,
+                    name="PerformanceServiceDispatcher",
+                    daemon=True,
+                )
+                self._dispatcher.start()
+
+            return calculation.future
+
     def calculate_performance_single(
         self,
         beatmap_id: int,
@@ -79,11 +221,38 @@ class PerformanceServiceApi:
             miss_count=miss_count,
             passed_objects=passed_objects,
         )
-        response = self.__make_performance_request([request])[0]
-        return PerformanceResult(
-            stars=response["stars"],
-            pp=response["pp"],
-            ar=response["ar"],
-            od=response["od"],
-            max_combo=response["max_combo"],
+        result = self.__submit(request)
+        if isinstance(result, Future):
+            return result.result(timeout=self._result_timeout)
+        return result
+
+    def calculate_performance_deferred(
+        self,
+        beatmap_id: int,
+        mode: int,
+        mods: int,
+        max_combo: int,
+        accuracy: float,
+        miss_count: int,
+        callback: PerformanceCallback,
+        passed_objects: Optional[int] = None,
+    ) -> Optional[PerformanceResult]:
+        """Non-blocking variant of `calculate_performance_single`.
+
+        Returns the result straight away if it is memoised. Otherwise returns None
+        and calls `callback` from the dispatcher thread once the result arrives
+        (it is not called if the calculation fails).
+        """
+        request = PerformanceRequest(
+            beatmap_id=beatmap_id,
+            mode=mode,
+            mods=mods,
+            max_combo=max_combo,
+            accuracy=accuracy,
+            miss_count=miss_count,
+            passed_objects=passed_objects,
         )
+        result = self.__submit(request, callback)
+        if isinstance(result, Future):
+            return None
+        return result
@@ -12,13 +12,15 @@ class ChannelList:
     def __init__(self):
         self.channels: dict[str, Channel] = {}
 
-    def loadChannels(self):
+    def loadChannels(self, channels: Optional[list[dict]] = None):
         """
         Load chat channels from db and add them to channels list
+        :param channels: `bancho_channels` rows, if already fetched
         :return:
         """
         # Get channels from DB
-        channels = glob.db.fetchAll("SELECT * FROM bancho_channels")
+        if channels is None:
+            channels = glob.db.fetchAll("SELECT * FROM bancho_channels")
 
         # Add each channel if needed
         for i in channels:
@@ -105,13 +107,12 @@ class ChannelList:
         # glob.streams.broadcast("chat/{}".format(name), serverPackets.channel_kicked(name))
         stream = glob.streams.getStream(f"chat/{name}")
         if stream is not None:
-            for token in stream.clients:
-                if token in glob.tokens.tokens:
-                    chat.partChannel(
-                        channel=name,
-                        token=glob.tokens.tokens[token],
-                        kick=True,
-                    )
+            for token in tuple(stream.clients.values()):
+                chat.partChannel(
+                    channel=name,
+                    token=token,
+                    kick=True,
+                )
         glob.streams.dispose(f"chat/{name}")
         glob.streams.remove(f"chat/{name}")
         self.channels.pop(name)
@@ -2,7 +2,9 @@ from __future__ import annotations
 
 import threading
 import time
+from typing import Optional
 
+from constants import packetIDs
 from constants import serverPackets
 from constants.exceptions import periodicLoopException
 from logger import log
@@ -16,6 +18,12 @@ class MatchList:
         self.matches: dict[int, Match] = {}
         self.lastID = 1
 
+        # Censored new match packets of every match, sent to users joining the lobby.
+        # Rebuilt from the matches' own packet caches after any of them changes.
+        self._lobbySnapshot: Optional[bytes] = None
+        self._lobbyVersion = 0
+        self._lobbyLock = threading.Lock()
+
     def createMatch(
         self,
         matchName: str,
@@ -53,6 +61,7 @@ class MatchList:
             hostUserID,
             isTourney,
         )
+        self.invalidateLobbySnapshot()
         return matchID
 
     def match_dispose(self, matchID: int) -> None:
@@ -92,44 +101,71 @@ class MatchList:
         # Send match dispose packet to everyone in lobby
         glob.streams.broadcast("lobby", serverPackets.match_dispose(matchID))
         del self.matches[matchID]
+        self.invalidateLobbySnapshot()
         log.info(f"MPROOM{matchID}: Room disposed manually")
 
-    def cleanupLoop(self) -> None:
+    def getLobbySnapshot(self) -> bytes:
+        """
+        Get the packets describing every match to someone joining the lobby
+
+        :return: concatenated censored `server_newMatch` packets
+        """
+        snapshot = self._lobbySnapshot
+        if snapshot is not None:
+            return snapshot
+
+        version = self._lobbyVersion
+        snapshot = b"".join(
+            m.getMatchDataPacket(packetIDs.server_newMatch, censored=True)
+            for m in tuple(self.matches.values())
+        )
+
+        # Don't keep it if a match changed while we were building it
+        with self._lobbyLock:
+            if self._lobbyVersion == version:
+                self._lobbySnapshot = snapshot
+        return snapshot
+
+    def invalidateLobbySnapshot(self) -> None:
         """
-        Start match cleanup loop.
-        Empty matches that have been created more than 60 seconds ago will get deleted.
+        Drop the lobby snapshot. Called when a match is created, changed or disposed.
+
+        :return:
+        """
+        with self._lobbyLock:
+            self._lobbyVersion += 1
+            self._lobbySnapshot = None
+
+    def cleanupEmptyMatches(self) -> None:
+        """
+        Empty matches that have been created more than 120 seconds ago will get deleted.
         Useful when people create useless lobbies with `!mp make`.
-        The check is done every 30 seconds.
-        This method starts an infinite loop, call it only once!
+        Scheduled every 30 seconds.
         :return:
         """
-        try:
-            log.debug("Checking empty matches")
-            t = int(time.time())
-            emptyMatches = []
-            exceptions = []
-
-            # Collect all empty matches
-            for m in self.matches.values():
-                if [x for x in m.slots if x.user is not None]:
-                    continue
-                if t - m.createTime >= 120:
-                    log.debug(f"Match #{m.matchID} marked for cleanup")
-                    emptyMatches.append(m.matchID)
-
-            # Dispose all empty matches
-            for matchID in emptyMatches:
-                try:
-                    self.match_dispose(matchID)
-                except Exception as e:
-                    exceptions.append(e)
-                    log.error(
-                        "Something wrong happened while disposing a timed out match.",
-                    )
-
-            # Re-raise exception if needed
-            if exceptions:
-                raise periodicLoopException(exceptions)
-        finally:
-            # Schedule a new check (endless loop)
-            threading.Timer(30, self.cleanupLoop).start()
+        log.debug("Checking empty matches")
+        t = int(time.time())
+        emptyMatches = []
+        exceptions = []
+
+        # Collect all empty matches
+        for m in tuple(self.matches.values()):
+            if [x for x in m.slots if x.user is not None]:
+                continue
+            if t - m.createTime >= 120:
+                log.debug(f"Match #{m.matchID} marked for cleanup")
+                emptyMatches.append(m.matchID)
+
+        # Dispose all empty matches
+        for matchID in emptyMatches:
+            try:
+                self.match_dispose(matchID)
+            except Exception as e:
+                exceptions.append(e)
+                log.error(
+                    "Something wrong happened while disposing a timed out match.",
+                )
+
+        # Re-raise exception if needed
+        if exceptions:
+            raise periodicLoopException(exceptions)
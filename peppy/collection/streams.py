@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from collections.abc import Iterable
 from typing import Optional
 from typing import TYPE_CHECKING
 
@@ -32,9 +33,8 @@ class StreamList:
         :return: Whether a stream actually got nuked
         """
         if name in self.streams:
-            for i in self.streams[name].clients:
-                if t := glob.tokens.tokens.get(i):
-                    t.leaveStream(name)
+            for t in tuple(self.streams[name].clients.values()):
+                t.leaveStream(name)
             self.streams.pop(name)
             return True
 
@@ -80,16 +80,25 @@ class StreamList:
         self,
         streamName: str,
         data: bytes,
-        but: Optional[list[str]] = None,
+        but: Optional[Iterable[str]] = None,
+        local: bool = False,
     ) -> None:
         """
-        Send some data to all clients in a stream
+        Send some data to all clients in a stream, including the clients
+        of the other worker processes if the stream is shared between them
 
         :param streamName: stream name
         :param data: data to send
-        :param but: array of tokens to ignore. Default: None (send to everyone)
+        :param but: tokens to ignore. Default: None (send to everyone)
+        :param local: if True, only send it to the clients of this worker.
+                        Default: False
         :return:
         """
+        if but:
+            but = tuple(but)
+        if not local and glob.worker_bus is not None:
+            glob.worker_bus.broadcast(streamName, data, but)
+
         if streamName not in self.streams:
             return
         self.streams[streamName].broadcast(data, but)
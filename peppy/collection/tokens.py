@@ -2,25 +2,46 @@ from __future__ import annotations
 
 import threading
 import time
+from typing import Any
 from typing import Optional
+from typing import Union
 
-import redis
 import settings
+from common.redis import redisBatch
 from common.ripple import userUtils
 from constants import serverPackets
-from constants.exceptions import periodicLoopException
 from events import logoutEvent
+from helpers.scheduler import ScheduledJob
 from helpers.user_helper import username_safe
 from logger import log
 from objects import glob
 from objects.osuToken import UserToken
+from objects.remoteToken import RemoteToken
+
+# Seconds without requests after which a client is disconnected
+TOKEN_TIMEOUT = 100
+
+# Keys deleted per UNLINK (and hinted per SCAN) when clearing old sessions
+SESSION_CLEANUP_BATCH_SIZE = 1000
 
 
 class TokenList:
     def __init__(self):
-        self.tokens: dict[str, UserToken] = {}
+        # Copies of the tokens of the other worker processes are kept
+        # here too, see `RemoteToken`
+        self.tokens: dict[str, Union[UserToken, RemoteToken]] = {}
         self._lock = threading.Lock()
 
+        # Secondary indexes, only changed under `_lock`.
+        # Values are replaced rather than mutated so lookups don't need the lock.
+        self._userIDIndex: dict[int, tuple[Union[UserToken, RemoteToken], ...]] = {}
+        self._usernameIndex: dict[str, Union[UserToken, RemoteToken]] = {}
+
+        # Pending timeout check of each token, only changed under `_lock`.
+        # Checks are only due once the token could have timed out, so
+        # timeouts cost nothing until then.
+        self._timeoutJobs: dict[str, ScheduledJob] = {}
+
     def __enter__(self):
         self._lock.acquire()
 
@@ -34,6 +55,7 @@ class TokenList:
         irc=False,
         timeOffset: int = 0,
         tournament: bool = False,
+        userData: Optional[dict[str, Any]] = None,
     ) -> UserToken:
         """
         Add a token object to tokens list
@@ -43,6 +65,7 @@ class TokenList:
         :param irc: if True, set this token as IRC client
         :param timeOffset: the time offset from UTC for this user. Default: 0.
         :param tournament: if True, flag this client as a tournement client. Default: True.
+        :param userData: already fetched user row, see `UserToken`. Default: None.
         :return: token object
         """
         newToken = UserToken(
@@ -51,26 +74,139 @@ class TokenList:
             irc=irc,
             timeOffset=timeOffset,
             tournament=tournament,
+            userData=userData,
         )
-        self.tokens[newToken.token] = newToken
-        glob.redis.set("ripple:online_users", len(self.tokens))
+        with self._lock:
+            self._insert(newToken)
+        self._scheduleFirstTimeout(newToken)
+
+        redisBatch.incrementCounter("ripple:online_users")
+        newToken.shareState()
         return newToken
 
-    def deleteToken(self, token: UserToken) -> None:
+    def adoptToken(self, token: str, state: dict[str, Any]) -> UserToken:
         """
-        Delete a token from token list if it exists
+        Add a token moved here by another worker process, replacing its copy.
+        It's still counted and has its bancho session from its first worker.
+
+        :param token: token string
+        :param state: the token's fields, see `UserToken.getState`
+        :return: token object
+        """
+        newToken = UserToken.fromState(token, state)
+        with self._lock:
+            self._remove(token)
+            self._insert(newToken)
+        self._scheduleFirstTimeout(newToken)
+        return newToken
+
+    def releaseToken(self, token: UserToken, owner: int) -> RemoteToken:
+        """
+        Replace a token moved to another worker process by a copy of it.
+        Unlike `deleteToken`, the user is still online.
+
+        :param token: token object
+        :param owner: ID of the worker the token has moved to
+        :return: the copy
+        """
+        remoteToken = RemoteToken(token.token, owner, token.getSharedState())
+        with self._lock:
+            self._remove(token.token)
+            self._insert(remoteToken)
+        token.leaveAllStreams()
+        return remoteToken
+
+    def addRemoteToken(self, token: str, owner: int, state: dict[str, Any]) -> None:
+        """
+        Add or update the copy of another worker process' token
 
         :param token: token string
+        :param owner: ID of the worker that owns the token
+        :param state: the token's shared fields, see `UserToken.getSharedState`
         :return:
         """
-        if token in self.tokens:
-            if self.tokens[token].ip:
-                userUtils.deleteBanchoSessions(
-                    self.tokens[token].userID,
-                    self.tokens[token].ip,
-                )
-            t = self.tokens.pop(token)
-            glob.redis.set("ripple:online_users", len(glob.tokens.tokens))
+        with self._lock:
+            current = self.tokens.get(token)
+            if current is None:
+                self._insert(RemoteToken(token, owner, state))
+            elif current.remote:
+                current.update(owner, state)
+
+    def deleteRemoteToken(self, token: str) -> None:
+        """
+        Delete the copy of another worker process' token if it exists
+
+        :param token: token string
+        :return:
+        """
+        with self._lock:
+            current = self.tokens.get(token)
+            if current is not None and current.remote:
+                self._remove(token)
+
+    def deleteRemoteTokens(self, owner: int) -> None:
+        """
+        Delete the copies of every token of a worker process, eg. when it restarted
+
+        :param owner: ID of the worker
+        :return:
+        """
+        with self._lock:
+            for token in tuple(self.tokens.values()):
+                if token.remote and token.owner == owner:
+                    self._remove(token.token)
+
+    def _insert(self, token: Union[UserToken, RemoteToken]) -> None:
+        # Must be called with `_lock` held
+        self.tokens[token.token] = token
+
+        userTokens = self._userIDIndex.get(token.userID, ())
+        self._userIDIndex[token.userID] = userTokens + (token,)
+        if not userTokens:
+            self._usernameIndex[token.safeUsername] = token
+
+    def _remove(self, token: str) -> Optional[Union[UserToken, RemoteToken]]:
+        # Must be called with `_lock` held
+        t = self.tokens.pop(token, None)
+        if t is None:
+            return None
+
+        timeoutJob = self._timeoutJobs.pop(token, None)
+        if timeoutJob is not None:
+            timeoutJob.cancel()
+
+        userTokens = tuple(i for i in self._userIDIndex.get(t.userID, ()) if i is not t)
+        if userTokens:
+            self._userIDIndex[t.userID] = userTokens
+            self._usernameIndex[t.safeUsername] = userTokens[0]
+        else:
+            self._userIDIndex.pop(t.userID, None)
+            self._usernameIndex.pop(t.safeUsername, None)
+        return t
+
+    def deleteToken(self, token: Union[str, UserToken]) -> None:
+        """
+        Delete a token from token list if it exists
+
+        :param token: token string or object
+        :return:
+        """
+        if isinstance(token, (UserToken, RemoteToken)):
+            token = token.token
+
+        with self._lock:
+            t = self._remove(token)
+            if t is None or t.remote:
+                # Copies are deleted by their owner
+                return
+
+        # Tokens can be deleted without a logout (kicks, failed logins...)
+        t.leaveAllStreams()
+        if t.ip:
+            userUtils.deleteBanchoSessions(t.userID, t.ip)
+        redisBatch.incrementCounter("ripple:online_users", -1)
+        if glob.worker_bus is not None:
+            glob.worker_bus.tokenDeleted(t)
 
     def getUserIDFromToken(self, token: str) -> Optional[int]:
         """
@@ -90,10 +226,19 @@ class TokenList:
         :param userID: user ID to find
         :return: None if not found, token object if found
         """
-        userID = int(userID)
-        for value in self.tokens.values():
-            if value.userID == userID:
-                return value
+        userTokens = self._userIDIndex.get(int(userID))
+        if userTokens:
+            return userTokens[0]
+        return None
+
+    def getTokensFromUserID(self, userID: int) -> tuple[UserToken, ...]:
+        """
+        Get all the tokens of a user ID (tournament clients may have many)
+
+        :param userID: user ID to find
+        :return: tuple of token objects, empty if not found
+        """
+        return self._userIDIndex.get(int(userID), ())
 
     def getTokenFromUsername(
         self,
@@ -112,9 +257,7 @@ class TokenList:
         if not safe:
             username = username_safe(username)
 
-        for user in self.tokens.values():
-            if user.safeUsername == username:
-                return user
+        return self._usernameIndex.get(username)
 
     def deleteOldTokens(self, userID: int) -> None:
         """
@@ -124,11 +267,9 @@ class TokenList:
         :return:
         """
         # Delete older tokens
-        for key, value in list(self.tokens.items()):
-            if value.userID == userID:
-                # Delete this token from the dictionary
-                # self.tokens[key].kick("You have logged in from somewhere else. You can't connect to Bancho/IRC from more than one device at the same time.", "kicked, multiple clients")
-                logoutEvent.handle(self.tokens[key])
+        for value in self.getTokensFromUserID(userID):
+            # self.tokens[key].kick("You have logged in from somewhere else. You can't connect to Bancho/IRC from more than one device at the same time.", "kicked, multiple clients")
+            logoutEvent.handle(value)
 
     def multipleEnqueue(self, packet: bytes, who: list[int], but: bool = False) -> None:
         """
@@ -139,8 +280,15 @@ class TokenList:
         :param but: if True, enqueue to everyone but users in `who` array
         :return:
         """
-        for value in self.tokens.values():
-            if (value.userID in who and not but) or (value.userID not in who and but):
+        if not but:
+            for userID in who:
+                for value in self.getTokensFromUserID(userID):
+                    value.enqueue(packet)
+            return
+
+        who = set(who)
+        for value in list(self.tokens.values()):
+            if value.userID not in who:
                 value.enqueue(packet)
 
     def enqueueAll(self, packet: bytes) -> None:
@@ -153,77 +301,92 @@ class TokenList:
         for value in self.tokens.values():
             value.enqueue(packet)
 
-    def usersTimeoutCheckLoop(self) -> None:
+    def _checkTimeout(self, token: UserToken) -> None:
         """
-        Start timed out users disconnect loop.
-        This function will be called every `checkTime` seconds and so on, forever.
-        CALL THIS FUNCTION ONLY ONCE!
+        Disconnect `token` if it hasn't sent a request in the last `TOKEN_TIMEOUT` seconds.
+        Otherwise, check again when it would time out.
+
+        :param token: token to check
         :return:
         """
-        try:
-            log.debug("Checking timed out clients")
-            exceptions = []
-            timeoutLimit = int(time.time()) - 100
-            for key, value in self.tokens.items():
-                # Check timeout (fokabot is ignored)
-                if (
-                    value.pingTime < timeoutLimit
-                    and value.userID != settings.PS_BOT_USER_ID
-                    and not value.irc
-                    and not value.tournament
-                ):
-                    # That user has timed out, add to disconnected tokens
-                    # We can't delete it while iterating or items() throws an error
-                    log.debug(f"{value.username} timed out!!")
-                    value.enqueue(
-                        serverPackets.notification(
-                            "Your connection to the server timed out.",
-                        ),
-                    )
-                    try:
-                        logoutEvent.handle(value)
-                    except Exception as e:
-                        exceptions.append(e)
-                        log.error(
-                            "Something wrong happened while disconnecting a timed out client.",
-                        )
-
-            # Re-raise exceptions if needed
-            if exceptions:
-                raise periodicLoopException(exceptions)
-        finally:
-            # Schedule a new check (endless loop)
-            threading.Timer(100, self.usersTimeoutCheckLoop).start()
-
-    def spamProtectionResetLoop(self) -> None:
-        """
-        Start spam protection reset loop.
-        Called every 10 seconds.
-        CALL THIS FUNCTION ONLY ONCE!
+        if self.tokens.get(token.token) is not token:
+            return
+
+        remaining = token.pingTime + TOKEN_TIMEOUT - time.time()
+        if remaining > 0:
+            self._scheduleTimeout(token, remaining)
+            return
+
+        log.debug(f"{token.username} timed out!!")
+        token.enqueue(
+            serverPackets.notification(
+                "Your connection to the server timed out.",
+            ),
+        )
+        logoutEvent.handle(token)
+
+    def _scheduleFirstTimeout(self, token: UserToken) -> None:
+        # The bot, IRC and tournament clients never time out
+        if not (
+            token.userID == settings.PS_BOT_USER_ID or token.irc or token.tournament
+        ):
+            self._scheduleTimeout(token, TOKEN_TIMEOUT)
+
+    def _scheduleTimeout(self, token: UserToken, delay: float) -> None:
+        with self._lock:
+            if self.tokens.get(token.token) is not token:
+                return
+            self._timeoutJobs[token.token] = glob.scheduler.schedule(
+                delay,
+                self._checkTimeout,
+                token,
+                name="token timeout",
+            )
+
+    def resetSpamProtection(self) -> None:
+        """
+        Reset spamRate for every token.
+        Scheduled every 10 seconds.
 
         :return:
         """
-        try:
-            # Reset spamRate for every token
-            for value in self.tokens.values():
-                value.spamRate = 0
-        finally:
-            # Schedule a new check (endless loop)
-            threading.Timer(10, self.spamProtectionResetLoop).start()
+        for value in tuple(self.tokens.values()):
+            value.spamRate = 0
 
-    def deleteBanchoSessions(self) -> None:
+    def deleteBanchoSessions(self) -> int:
         """
         Remove all `peppy:sessions:*` redis keys.
         Call at bancho startup to delete old cached sessions
 
-        :return:
+        The keys are found through the sessions index set. If there is no index
+        (sessions saved by an older version), the keyspace is scanned instead.
+        Both run in small batches, so redis is never blocked for long.
+
+        :return: number of deleted keys
         """
-        try:
-            # TODO: Make function or some redis meme
-            glob.redis.eval(
-                "return redis.call('del', unpack(redis.call('keys', ARGV[1])))",
-                0,
-                "peppy:sessions:*",
+        if glob.redis.exists(userUtils.SESSIONS_INDEX_KEY):
+            keys = (
+                f"peppy:sessions:{int(userID)}"
+                for userID in glob.redis.sscan_iter(
+                    userUtils.SESSIONS_INDEX_KEY,
+                    count=SESSION_CLEANUP_BATCH_SIZE,
+                )
+            )
+        else:
+            keys = glob.redis.scan_iter(
+                match="peppy:sessions:*",
+                count=SESSION_CLEANUP_BATCH_SIZE,
             )
-        except redis.RedisError:
-            pass
+
+        deleted = 0
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= SESSION_CLEANUP_BATCH_SIZE:
+                deleted += glob.redis.unlink(*batch)
+                batch.clear()
+        if batch:
+            deleted += glob.redis.unlink(*batch)
+
+        glob.redis.unlink(userUtils.SESSIONS_INDEX_KEY)
+        return deleted
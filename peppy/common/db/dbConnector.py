@@ -1,15 +1,33 @@
 from __future__ import annotations
 
 import queue
+import threading
 import time
 from typing import Any
+from typing import Callable
 from typing import Optional
 
 import MySQLdb
+from constants import exceptions
 from logger import log
 from MySQLdb.connections import Connection
 
 
+# Connections idle for longer than this (in seconds) are pinged before being used
+HEALTH_CHECK_INTERVAL = 30
+# How long (in seconds) a query waits for a free connection before giving up
+WAIT_TIMEOUT = 10
+# Delay (in seconds) between reconnection attempts when MySQL is unreachable
+RECONNECT_DELAY = 1
+# Client error codes meaning the connection itself is gone: server has gone away,
+# lost connection during query and lost connection (extended). Other operational
+# errors, like deadlocks (1213) or lock wait timeouts (1205), leave it usable.
+CONNECTION_LOST_ERRORS = frozenset((2006, 2013, 2055))
+# Most deferred writes waiting for the write-behind thread. Past this,
+# writes run right away on the caller's thread.
+MAX_DEFERRED_WRITES = 10_000
+
+
 class Worker:
     """
     A single MySQL worker
@@ -17,30 +35,55 @@ class Worker:
 
     __slots__ = (
         "connection",
-        "temporary",
+        "lastUsed",
     )
 
-    def __init__(self, connection: Connection, temporary: bool = False) -> None:
+    def __init__(self, connection: Connection) -> None:
         """
         Initialize a MySQL worker
 
         :param connection: database connection object
-        :param temporary: if True, this worker will be flagged as temporary
         """
         self.connection = connection
-        self.temporary = temporary
-        log.debug(f"Created MySQL worker. Temporary: {self.temporary}")
+        self.lastUsed = time.monotonic()
+        log.debug("Created MySQL worker.")
+
+    def isHealthy(self) -> bool:
+        """
+        Check whether the connection is still usable.
+        Recently used connections are trusted, idle ones are pinged.
+
+        :return: True if the connection can be used
+        """
+        if time.monotonic() - self.lastUsed < HEALTH_CHECK_INTERVAL:
+            return True
+
+        try:
+            self.connection.ping()
+        except MySQLdb.Error:
+            return False
+        return True
 
-    def __del__(self) -> None:
+    def close(self) -> None:
         """
-        Close connection to the server
+        Close connection to the server, ignoring errors from dead connections
 
         :return:
         """
-        self.connection.close()
+        try:
+            self.connection.close()
+        except MySQLdb.Error:
+            pass
 
 
 class ConnectionPool:
+    """
+    A fixed size pool of MySQL connections.
+    When every connection is busy, callers wait (up to `waitTimeout` seconds)
+    for one to be released. Dead connections are dropped and replaced
+    by a background thread, so requests never reconnect themselves.
+    """
+
     def __init__(
         self,
         host: str,
@@ -49,6 +92,7 @@ class ConnectionPool:
         password: str,
         database: str,
         size: int = 128,
+        waitTimeout: float = WAIT_TIMEOUT,
     ) -> None:
         self.host = host
         self.port = port
@@ -57,15 +101,24 @@ class ConnectionPool:
         self.database = database
 
         self.maxSize = size
-        self.pool = queue.Queue(self.maxSize)
-        self.consecutiveEmptyPool = 0
+        self.waitTimeout = waitTimeout
+        # LIFO so the most recently used (least likely stale) connection is reused first
+        self.pool: queue.LifoQueue[Worker] = queue.LifoQueue(self.maxSize)
         self.fillPool()
 
-    def newWorker(self, temporary: bool = False) -> Worker:
+        self.missingWorkers = 0
+        self._missingLock = threading.Lock()
+        self._reconnectEvent = threading.Event()
+        threading.Thread(
+            target=self._reconnectLoop,
+            name="mysql-reconnect",
+            daemon=True,
+        ).start()
+
+    def newWorker(self) -> Worker:
         """
         Create a new worker.
 
-        :param temporary: if True, flag the worker as temporary
         :return: instance of worker class
         """
         db = MySQLdb.connect(
@@ -78,88 +131,92 @@ class ConnectionPool:
             charset="utf8",
             use_unicode=True,
         )
-        conn = Worker(db, temporary)
-        return conn
+        return Worker(db)
 
-    def fillPool(self, newConnections: int = 0) -> None:
+    def fillPool(self) -> None:
         """
         Fill the queue with workers
 
-        :param newConnections:    number of new connections. If 0, the pool will be filled entirely.
         :return:
         """
-        # If newConnections = 0, fill the whole pool
-        if newConnections == 0:
-            newConnections = self.maxSize
-
-        # Fill the pool
-        for _ in range(0, newConnections):
-            if not self.pool.full():
-                self.pool.put_nowait(self.newWorker())
+        while not self.pool.full():
+            self.pool.put_nowait(self.newWorker())
 
     def getWorker(self) -> Worker:
         """
-        Get a MySQL connection worker from the pool.
-        If the pool is empty, a new temporary worker is created.
+        Get a MySQL connection worker from the pool,
+        waiting for one to be released if they are all busy.
 
-        :param level: number of failed connection attempts. If > 50, return None
+        :raises databasePoolTimeoutException: if no worker is released in time
         :return: instance of worker class
         """
-
-        try:
-            if self.pool.empty():
-                # The pool is empty. Spawn a new temporary worker
-                log.warning("MySQL connections pool is empty. Using temporary worker.")
-                worker = self.newWorker(temporary=True)
-
-                # Increment saturation
-                self.consecutiveEmptyPool += 1
-
-                # If the pool is usually empty, expand it
-                if self.consecutiveEmptyPool >= 10:
-                    log.warning(
-                        "MySQL connections pool is empty. Filling connections pool.",
-                    )
-                    self.fillPool()
-            else:
-                # The pool is not empty. Get worker from the pool
-                # and reset saturation counter
-                worker = self.pool.get()
-                self.consecutiveEmptyPool = 0
-        except MySQLdb.OperationalError:
-            # Connection to server lost
-            # Wait 1 second and try again
-            log.warning("Can't connect to MySQL database. Retrying in 1 second...")
-            time.sleep(1)
-            return self.getWorker()
-
-        # Return the connection
-        return worker
-
-    def putWorker(self, worker: Worker):
+        deadline = time.monotonic() + self.waitTimeout
+        while True:
+            try:
+                worker = self.pool.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                log.warning(
+                    f"Timed out waiting for a MySQL connection ({self.missingWorkers} reconnecting).",
+                )
+                raise exceptions.databasePoolTimeoutException()
+
+            if worker.isHealthy():
+                return worker
+
+            log.warning("Dropping dead MySQL connection.")
+            self.discardWorker(worker)
+
+    def putWorker(self, worker: Worker) -> None:
         """
         Put the worker back in the pool.
-        If the worker is temporary, close the connection
-        and destroy the object
 
         :param worker: worker object
         :return:
         """
-        if worker.temporary or self.pool.full():
-            # Kill the worker if it's temporary or the queue
-            # is full and we can't  put anything in it
-            del worker
-        else:
-            # Put the connection in the queue if there's space
-            self.pool.put_nowait(worker)
+        worker.lastUsed = time.monotonic()
+        self.pool.put_nowait(worker)
+
+    def discardWorker(self, worker: Worker) -> None:
+        """
+        Close a broken worker and schedule its replacement.
+
+        :param worker: worker object
+        :return:
+        """
+        worker.close()
+        with self._missingLock:
+            self.missingWorkers += 1
+            self._reconnectEvent.set()
+
+    def _reconnectLoop(self) -> None:
+        while True:
+            self._reconnectEvent.wait()
+            try:
+                worker = self.newWorker()
+            except MySQLdb.OperationalError:
+                log.warning("Can't connect to MySQL database. Retrying in 1 second...")
+                time.sleep(RECONNECT_DELAY)
+                continue
+            except Exception as e:
+                # Keep the thread alive, or the pool never refills
+                log.error(f"Unexpected error while reconnecting to MySQL: {e!r}")
+                time.sleep(RECONNECT_DELAY)
+                continue
+
+            with self._missingLock:
+                self.missingWorkers -= 1
+                if not self.missingWorkers:
+                    self._reconnectEvent.clear()
+            self.putWorker(worker)
 
 
 class DatabasePool:
     """
-    A MySQL helper with multiple workers
+    A MySQL helper with multiple workers.
+    Writes nobody waits for can be deferred to a background write-behind thread.
     """
 
-    __slots__ = ("pool",)
+    __slots__ = ("pool", "_deferredQueue", "_deferredThread", "_closing")
 
     def __init__(
         self,
@@ -179,30 +236,95 @@ class DatabasePool:
             initialSize,
         )
 
-    def execute(self, query: str, params: object = ()) -> int:
+        self._deferredQueue: queue.Queue[Callable[[], Any]] = queue.Queue(
+            MAX_DEFERRED_WRITES,
+        )
+        self._closing = threading.Event()
+        self._deferredThread = threading.Thread(
+            target=self._deferredLoop,
+            name="mysql-write-behind",
+            daemon=True,
+        )
+        self._deferredThread.start()
+
+    def close(self, timeout: float = 10) -> None:
         """
-        Executes a query
+        Run every queued deferred write and stop the write-behind thread.
+        Called on shutdown.
 
-        :param query: query to execute. You can bind parameters with %s
-        :param params: parameters list. First element replaces first %s and so on
+        :param timeout: seconds to wait for the queue to be drained
+        :return:
         """
+        self._closing.set()
+        if self._deferredThread.is_alive():
+            self._deferredThread.join(timeout)
+
+        if not self._deferredQueue.empty():
+            log.warning(
+                f"{self._deferredQueue.qsize()} deferred database writes were not run.",
+            )
+
+    def _deferredLoop(self) -> None:
+        while not self._closing.is_set() or not self._deferredQueue.empty():
+            try:
+                job = self._deferredQueue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            self._runJob(job)
+
+    def _runJob(self, job: Callable[[], Any]) -> None:
+        try:
+            job()
+        except Exception as e:
+            log.error(f"Deferred database write failed: {e!r}")
+
+    def _defer(self, job: Callable[[], Any]) -> None:
+        try:
+            self._deferredQueue.put_nowait(job)
+        except queue.Full:
+            # Don't lose the write, nor let the queue grow without limit
+            log.warning("Deferred database write queue is full, writing right away.")
+            self._runJob(job)
+
+    def _query(self, query: str, params: object, fetch: Optional[str]) -> Any:
         cursor = None
+        broken = False
         worker = self.pool.getWorker()
-        if worker is None:
-            return 0
         try:
-            # Create cursor, execute query and commit
+            # Create cursor, execute the query and fetch the result(s) if needed
             cursor = worker.connection.cursor(MySQLdb.cursors.DictCursor)
             cursor.execute(query, params)
             log.debug(query)
-            return cursor.lastrowid
+            if fetch is None:
+                return cursor.lastrowid
+            return getattr(cursor, fetch)()
+        except MySQLdb.OperationalError as e:
+            # Don't hand out a connection that is gone
+            broken = e.args[0] in CONNECTION_LOST_ERRORS
+            raise
+        except MySQLdb.InterfaceError:
+            # The connection was closed under us
+            broken = True
+            raise
         finally:
-            # Close the cursor and release worker's lock
+            # Close the cursor and release the worker
             if cursor is not None:
                 cursor.close()
-            if worker is not None:
+            if broken:
+                self.pool.discardWorker(worker)
+            else:
                 self.pool.putWorker(worker)
 
+    def execute(self, query: str, params: object = ()) -> int:
+        """
+        Executes a query
+
+        :param query: query to execute. You can bind parameters with %s
+        :param params: parameters list. First element replaces first %s and so on
+        """
+        return self._query(query, params, None)
+
     def fetch(self, query: str, params: object = ()) -> Optional[dict[str, Any]]:
         """
         Fetch a single value from db that matches given query
@@ -210,45 +332,35 @@ class DatabasePool:
         :param query: query to execute. You can bind parameters with %s
         :param params: parameters list. First element replaces first %s and so on
         """
-        cursor = None
-        worker = self.pool.getWorker()
-        if worker is None:
-            return None
-        try:
-            # Create cursor, execute the query and fetch one/all result(s)
-            cursor = worker.connection.cursor(MySQLdb.cursors.DictCursor)
-            cursor.execute(query, params)
-            log.debug(query)
-            return cursor.fetchone()
-        finally:
-            # Close the cursor and release worker's lock
-            if cursor is not None:
-                cursor.close()
-            if worker is not None:
-                self.pool.putWorker(worker)
+        return self._query(query, params, "fetchone")
 
     def fetchAll(self, query: str, params: object = ()) -> list[dict[str, Any]]:
         """
         Fetch all values from db that matche given query.
-        Calls self.fetch with all = True.
 
         :param query: query to execute. You can bind parameters with %s
         :param params: parameters list. First element replaces first %s and so on
         """
+        return self._query(query, params, "fetchall")
 
-        cursor = None
-        worker = self.pool.getWorker()
-        if worker is None:
-            return []
-        try:
-            # Create cursor, execute the query and fetch one/all result(s)
-            cursor = worker.connection.cursor(MySQLdb.cursors.DictCursor)
-            cursor.execute(query, params)
-            log.debug(query)
-            return cursor.fetchall()
-        finally:
-            # Close the cursor and release worker's lock
-            if cursor is not None:
-                cursor.close()
-            if worker is not None:
-                self.pool.putWorker(worker)
+    def executeDeferred(self, query: str, params: object = ()) -> None:
+        """
+        Executes a query on the write-behind thread, without waiting for it.
+        Deferred queries run one at a time, in the order they were queued.
+        If the queue is full, the query runs right away instead.
+
+        :param query: query to execute. You can bind parameters with %s
+        :param params: parameters list. First element replaces first %s and so on
+        """
+        self._defer(lambda: self._query(query, params, None))
+
+    def runDeferred(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        """
+        Runs a function doing several queries (eg. an audit log) on the
+        write-behind thread, in order with the deferred queries.
+
+        :param func: function to call
+        :param args: positional arguments for `func`
+        :param kwargs: keyword arguments for `func`
+        """
+        self._defer(lambda: func(*args, **kwargs))
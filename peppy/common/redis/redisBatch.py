@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+from typing import Optional
+from typing import Union
+
+import redis
+import settings
+from redis.client import Pipeline
+
+from logger import log
+from objects import glob
+
+# Seconds between two writes of the coalesced counters
+COUNTER_FLUSH_INTERVAL = 1.0
+
+# Pipeline of the current batch, in a list emptied once the batch ends: callbacks
+# scheduled on the loop during a batch inherit its context, so they still see it.
+_pipeline: ContextVar[Optional[list[Pipeline]]] = ContextVar(
+    "redis_pipeline",
+    default=None,
+)
+
+_pendingCounters: dict[str, int] = {}
+_countersLock = threading.Lock()
+_countersReady = threading.Event()
+_flushThread: Optional[threading.Thread] = None
+
+# In async mode batches are sent by this thread, in the order they were made,
+# so the event loop never waits for redis.
+_sender: Optional[ThreadPoolExecutor] = None
+
+
+@contextmanager
+def batch() -> Iterator[None]:
+    """
+    Queue every write sent through `writer()` in this block and send them
+    to redis in a single pipeline once the block ends.
+    Nested blocks join the outermost one. Can be used as a decorator too.
+
+    The block must not yield to the IOLoop, or other requests may share the pipeline.
+    In async mode the pipeline is sent in the background, as blocks end on the loop.
+    """
+    if _currentPipeline() is not None:
+        yield
+        return
+
+    pipe = glob.redis.pipeline(transaction=False)
+    current = [pipe]
+    reset = _pipeline.set(current)
+    try:
+        yield
+    finally:
+        current.clear()
+        _pipeline.reset(reset)
+        if len(pipe):
+            if settings.HTTP_ASYNC_MODE:
+                _sendLater(pipe)
+            else:
+                _send(pipe)
+
+
+def _currentPipeline() -> Optional[Pipeline]:
+    current = _pipeline.get()
+    return current[0] if current else None
+
+
+def _send(pipe: Pipeline) -> None:
+    try:
+        pipe.execute()
+    except redis.RedisError as e:
+        log.error(f"Failed to send {len(pipe)} batched redis commands: {e!r}")
+
+
+def _sendLater(pipe: Pipeline) -> None:
+    global _sender
+    with _countersLock:
+        if _sender is None:
+            _sender = ThreadPoolExecutor(1, thread_name_prefix="redis-batch")
+    _sender.submit(_send, pipe)
+
+
+def waitForBatches() -> None:
+    """
+    Wait for the batches queued in async mode to be sent. Called on shutdown.
+
+    :return:
+    """
+    with _countersLock:
+        sender = _sender
+    if sender is not None:
+        sender.shutdown(wait=True)
+
+
+def writer() -> Union[redis.Redis, Pipeline]:
+    """
+    Get the object fire and forget writes should be sent to:
+    the current `batch()` pipeline, or `glob.redis` outside of one.
+    Never use it for reads, their results are not available until the batch ends.
+
+    :return: pipeline or redis client
+    """
+    pipe = _currentPipeline()
+    return glob.redis if pipe is None else pipe
+
+
+def incrementCounter(key: str, amount: int = 1) -> None:
+    """
+    Increment (or decrement) a counter key, such as `ripple:online_users`.
+    Increments are summed up and written at most every `COUNTER_FLUSH_INTERVAL` seconds.
+    Deltas are sent with INCRBY, so other writers of the same counter are not overwritten.
+
+    :param key: redis key
+    :param amount: value to add. Default: 1
+    :return:
+    """
+    global _flushThread
+    with _countersLock:
+        _pendingCounters[key] = _pendingCounters.get(key, 0) + amount
+        if _flushThread is None:
+            _flushThread = threading.Thread(
+                target=_flushLoop,
+                name="redis-counter-flush",
+                daemon=True,
+            )
+            _flushThread.start()
+    _countersReady.set()
+
+
+def flushCounters() -> None:
+    """
+    Write the pending counters now. Called on shutdown.
+
+    :return:
+    """
+    with _countersLock:
+        counters = _pendingCounters.copy()
+        _pendingCounters.clear()
+        _countersReady.clear()
+
+    if not counters:
+        return
+
+    try:
+        pipe = glob.redis.pipeline(transaction=False)
+        for key, amount in counters.items():
+            if amount:
+                pipe.incrby(key, amount)
+        pipe.execute()
+    except redis.RedisError as e:
+        log.error(f"Failed to write redis counters: {e!r}")
+        with _countersLock:
+            for key, amount in counters.items():
+                _pendingCounters[key] = _pendingCounters.get(key, 0) + amount
+            _countersReady.set()
+
+
+def _flushLoop() -> None:
+    while True:
+        _countersReady.wait()
+        flushCounters()
+        # Let the updates of the next interval coalesce
+        time.sleep(COUNTER_FLUSH_INTERVAL)
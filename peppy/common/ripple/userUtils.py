@@ -16,10 +16,15 @@ import settings
 from common import generalUtils
 from common.constants import gameModes, mods
 from common.constants import privileges
+from common.redis import redisBatch
 from logger import log
 from common.ripple import scoreUtils
 from objects import glob
 
+# Set of the user IDs that have a `peppy:sessions:{userID}` key,
+# so they can be deleted without scanning the keyspace.
+SESSIONS_INDEX_KEY = "peppy:sessions"
+
 
 def getBeatmapTime(beatmapID):
     p = 0
@@ -392,7 +397,7 @@ def getID(username):
             return 0
 
         # Otherwise, save it in redis and return it
-        glob.redis.set(
+        redisBatch.writer().set(
             f"ripple:userid_cache:{usernameSafe}",
             userID,
             3600,
@@ -1703,7 +1708,9 @@ def saveBanchoSession(userID, ip):
     :param ip: IP address
     :return:
     """
-    glob.redis.sadd(f"peppy:sessions:{userID}", ip)
+    pipe = redisBatch.writer()
+    pipe.sadd(f"peppy:sessions:{userID}", ip)
+    pipe.sadd(SESSIONS_INDEX_KEY, userID)
 
 
 def deleteBanchoSessions(userID, ip):
@@ -1714,7 +1721,7 @@ def deleteBanchoSessions(userID, ip):
     :param ip: IP address
     :return:
     """
-    glob.redis.srem(f"peppy:sessions:{userID}", ip)
+    redisBatch.writer().srem(f"peppy:sessions:{userID}", ip)
 
 
 def setPrivileges(userID, priv):
@@ -1788,6 +1795,21 @@ def isInAnyPrivilegeGroup(userID, groups):
     )
 
 
+def validHardware(user_id: int, hashes: list[str]) -> bool:
+    """
+    Check whether a client data structure (see `logHardware`) has all the
+    hashes needed for multiaccount detection.
+
+    :param user_id: user id
+    :param hashes: client data, already split
+    :return: True if no hash is missing
+    """
+    if len(hashes) != 5 or not all(hashes[2:5]):
+        log.warning(f"User {user_id} has sent an empty hwid hash set {hashes}.")
+        return False
+    return True
+
+
 def logHardware(
     user_id: int,
     hashes: list[str],
@@ -1811,8 +1833,7 @@ def logHardware(
     :return: True if hw is not banned, otherwise false
     """
     # Make sure the strings are not empty
-    if len(hashes) != 5 or not all(hashes[2:5]):
-        log.warning(f"User {user_id} has sent an empty hwid hash set {hashes}.")
+    if not validHardware(user_id, hashes):
         return False
 
     if not is_restricted:
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import functools
+from typing import Any
+from typing import Callable
 from typing import Optional
 
 import settings
 import tornado.gen
 import tornado.web
+from common.redis import redisBatch
 from logger import log
 from objects import glob
 from tornado.ioloop import IOLoop
@@ -16,32 +20,43 @@ class asyncRequestHandler(tornado.web.RequestHandler):
     create a class that extends this one (requestHelper.asyncRequestHandler)
     use asyncGet() and asyncPost() instead of get() and post().
     Done. I'm not kidding.
+
+    With `HTTP_ASYNC_MODE` enabled, asyncGet() and asyncPost() run on the
+    event loop itself (they may be coroutines), which owns the in-memory state.
+    They must push any blocking work through `runBlocking` or `runDetached`.
+    Otherwise they run on the thread pool.
     """
 
-    @tornado.web.asynchronous
-    @tornado.gen.engine
+    @tornado.gen.coroutine
     def get(self, *args, **kwargs):
         try:
-            yield tornado.gen.Task(
-                runBackground,
-                (self.asyncGet, tuple(args), dict(kwargs)),
-            )
+            yield self._dispatch(self.asyncGet, args, kwargs)
         finally:
             if not self._finished:
                 self.finish()
 
-    @tornado.web.asynchronous
-    @tornado.gen.engine
+    @tornado.gen.coroutine
     def post(self, *args, **kwargs):
         try:
-            yield tornado.gen.Task(
-                runBackground,
-                (self.asyncPost, tuple(args), dict(kwargs)),
-            )
+            yield self._dispatch(self.asyncPost, args, kwargs)
         finally:
             if not self._finished:
                 self.finish()
 
+    @tornado.gen.coroutine
+    def _dispatch(self, func, args, kwargs):
+        if settings.HTTP_ASYNC_MODE:
+            result = func(*args, **kwargs)
+        else:
+            result = yield tornado.gen.Task(
+                runBackground,
+                (func, tuple(args), dict(kwargs)),
+            )
+
+        # Coroutine handlers hand back a future (already resolved in threaded mode)
+        if result is not None:
+            yield tornado.gen.convert_yielded(result)
+
     def asyncGet(self, *args, **kwargs) -> None:
         self.send_error(405)
 
@@ -83,6 +98,89 @@ def runBackground(data, callback):
     glob.pool.apply_async(func, args, kwargs, _callback)
 
 
+def runBlocking(func: Callable[..., Any], *args, **kwargs):
+    """
+    Run a blocking function (MySQL, redis, HTTP...) without stalling the event loop.
+    In async mode it's sent to the bounded executor, otherwise the request is
+    already on a pool thread so it's called right away.
+    Yield the result from a coroutine.
+
+    :param func: function to call
+    :return: future resolving to `func`'s return value
+    """
+    if glob.executor is None:
+        return tornado.gen.maybe_future(func(*args, **kwargs))
+
+    return glob.executor.submit(func, *args, **kwargs)
+
+
+def runDetached(
+    func: Callable[..., Any],
+    *args,
+    callback: Optional[Callable[[Any], None]] = None,
+) -> None:
+    """
+    Run a blocking function without waiting for it, for code that can't yield
+    (packet handlers, token methods...). In async mode it's sent to the executor
+    and `callback` is called with its result on the event loop once it returns.
+    Otherwise both are called right away. Errors are logged.
+
+    :param func: function to call
+    :param callback: optional function to call with `func`'s return value
+    :return:
+    """
+    if glob.executor is None:
+        try:
+            result = func(*args)
+        except Exception as e:
+            log.error(f"Blocking call {func.__qualname__} failed: {e!r}")
+            return
+
+        if callback is not None:
+            callback(result)
+        return
+
+    future = glob.executor.submit(func, *args)
+    IOLoop.instance().add_future(
+        future,
+        functools.partial(_detachedDone, func, callback),
+    )
+
+
+def _detachedDone(func, callback, future) -> None:
+    try:
+        result = future.result()
+    except Exception as e:
+        log.error(f"Blocking call {func.__qualname__} failed: {e!r}")
+        return
+
+    if callback is not None:
+        _runBatched(callback, (result,))
+
+
+def runOnLoop(func: Callable[..., Any], *args) -> None:
+    """
+    Call a function from a background thread (pubsub listener, scheduler,
+    bot command threads...) on the event loop. In async mode the loop owns the
+    in-memory state (tokens, streams, matches...), so that's the only place it
+    may be changed from. Otherwise it's called right away.
+
+    :param func: function to call
+    :return:
+    """
+    if glob.executor is None:
+        func(*args)
+        return
+
+    IOLoop.instance().add_callback(_runBatched, func, args)
+
+
+def _runBatched(func, args) -> None:
+    # Redis writes made on the loop are never sent from it, see `redisBatch.batch`
+    with redisBatch.batch():
+        func(*args)
+
+
 def checkArguments(arguments, requiredArguments):
     """
     Check that every requiredArguments elements are in arguments
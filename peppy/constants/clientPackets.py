@@ -4,82 +4,132 @@ from constants import dataTypes
 from constants import slotStatuses
 from helpers import packetHelper
 
+# Precompiled layouts of the packets with a fixed structure.
+_USER_ACTION_CHANGE = packetHelper.PacketReader(
+    [
+        ["actionID", dataTypes.BYTE],
+        ["actionText", dataTypes.STRING],
+        ["actionMd5", dataTypes.STRING],
+        ["actionMods", dataTypes.UINT32],
+        ["gameMode", dataTypes.BYTE],
+        ["beatmapID", dataTypes.SINT32],
+    ],
+)
+_USER_STATS_REQUEST = packetHelper.PacketReader([["users", dataTypes.INT_LIST]])
+_USER_PANEL_REQUEST = packetHelper.PacketReader([["users", dataTypes.INT_LIST]])
+_SEND_PUBLIC_MESSAGE = packetHelper.PacketReader(
+    [
+        ["unknown", dataTypes.STRING],
+        ["message", dataTypes.STRING],
+        ["to", dataTypes.STRING],
+    ],
+)
+_SEND_PRIVATE_MESSAGE = packetHelper.PacketReader(
+    [
+        ["unknown", dataTypes.STRING],
+        ["message", dataTypes.STRING],
+        ["to", dataTypes.STRING],
+        ["unknown2", dataTypes.UINT32],
+    ],
+)
+_SET_AWAY_MESSAGE = packetHelper.PacketReader(
+    [
+        ["unknown", dataTypes.STRING],
+        ["awayMessage", dataTypes.STRING],
+    ],
+)
+_CHANNEL_JOIN = packetHelper.PacketReader([["channel", dataTypes.STRING]])
+_CHANNEL_PART = packetHelper.PacketReader([["channel", dataTypes.STRING]])
+_ADD_REMOVE_FRIEND = packetHelper.PacketReader([["friendID", dataTypes.SINT32]])
+_START_SPECTATING = packetHelper.PacketReader([["userID", dataTypes.SINT32]])
+_CHANGE_SLOT = packetHelper.PacketReader([["slotID", dataTypes.UINT32]])
+_JOIN_MATCH = packetHelper.PacketReader(
+    [
+        ["matchID", dataTypes.UINT32],
+        ["password", dataTypes.STRING],
+    ],
+)
+_CHANGE_MODS = packetHelper.PacketReader([["mods", dataTypes.UINT32]])
+_LOCK_SLOT = packetHelper.PacketReader([["slotID", dataTypes.UINT32]])
+_TRANSFER_HOST = packetHelper.PacketReader([["slotID", dataTypes.UINT32]])
+_MATCH_INVITE = packetHelper.PacketReader([["userID", dataTypes.UINT32]])
+_MATCH_FRAMES = packetHelper.PacketReader(
+    [
+        ["time", dataTypes.SINT32],
+        ["id", dataTypes.BYTE],
+        ["count300", dataTypes.UINT16],
+        ["count100", dataTypes.UINT16],
+        ["count50", dataTypes.UINT16],
+        ["countGeki", dataTypes.UINT16],
+        ["countKatu", dataTypes.UINT16],
+        ["countMiss", dataTypes.UINT16],
+        ["totalScore", dataTypes.SINT32],
+        ["maxCombo", dataTypes.UINT16],
+        ["currentCombo", dataTypes.UINT16],
+        ["perfect", dataTypes.BYTE],
+        ["currentHp", dataTypes.BYTE],
+        ["tagByte", dataTypes.BYTE],
+        ["usingScoreV2", dataTypes.BYTE],
+    ],
+)
+_TOURNAMENT_MATCH_INFO_REQUEST = packetHelper.PacketReader(
+    [["matchID", dataTypes.UINT32]],
+)
+_TOURNAMENT_JOIN_MATCH_CHANNEL = packetHelper.PacketReader(
+    [["matchID", dataTypes.UINT32]],
+)
+_TOURNAMENT_LEAVE_MATCH_CHANNEL = packetHelper.PacketReader(
+    [["matchID", dataTypes.UINT32]],
+)
+
 
 """ Users listing packets """
 
 
 def userActionChange(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [
-            ["actionID", dataTypes.BYTE],
-            ["actionText", dataTypes.STRING],
-            ["actionMd5", dataTypes.STRING],
-            ["actionMods", dataTypes.UINT32],
-            ["gameMode", dataTypes.BYTE],
-            ["beatmapID", dataTypes.SINT32],
-        ],
-    )
+    return _USER_ACTION_CHANGE.read(stream)
 
 
 def userStatsRequest(stream):
-    return packetHelper.readPacketData(stream, [["users", dataTypes.INT_LIST]])
+    return _USER_STATS_REQUEST.read(stream)
 
 
 def userPanelRequest(stream):
-    return packetHelper.readPacketData(stream, [["users", dataTypes.INT_LIST]])
+    return _USER_PANEL_REQUEST.read(stream)
 
 
 """ Client chat packets """
 
 
 def sendPublicMessage(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [
-            ["unknown", dataTypes.STRING],
-            ["message", dataTypes.STRING],
-            ["to", dataTypes.STRING],
-        ],
-    )
+    return _SEND_PUBLIC_MESSAGE.read(stream)
 
 
 def sendPrivateMessage(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [
-            ["unknown", dataTypes.STRING],
-            ["message", dataTypes.STRING],
-            ["to", dataTypes.STRING],
-            ["unknown2", dataTypes.UINT32],
-        ],
-    )
+    return _SEND_PRIVATE_MESSAGE.read(stream)
 
 
 def setAwayMessage(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [["unknown", dataTypes.STRING], ["awayMessage", dataTypes.STRING]],
-    )
+    return _SET_AWAY_MESSAGE.read(stream)
 
 
 def channelJoin(stream):
-    return packetHelper.readPacketData(stream, [["channel", dataTypes.STRING]])
+    return _CHANNEL_JOIN.read(stream)
 
 
 def channelPart(stream):
-    return packetHelper.readPacketData(stream, [["channel", dataTypes.STRING]])
+    return _CHANNEL_PART.read(stream)
 
 
 def addRemoveFriend(stream):
-    return packetHelper.readPacketData(stream, [["friendID", dataTypes.SINT32]])
+    return _ADD_REMOVE_FRIEND.read(stream)
 
 
 """ Spectator packets """
 
 
 def startSpectating(stream):
-    return packetHelper.readPacketData(stream, [["userID", dataTypes.SINT32]])
+    return _START_SPECTATING.read(stream)
 
 
 """ Multiplayer packets """
@@ -144,62 +194,40 @@ def changeMatchSettings(stream):
 
 
 def changeSlot(stream):
-    return packetHelper.readPacketData(stream, [["slotID", dataTypes.UINT32]])
+    return _CHANGE_SLOT.read(stream)
 
 
 def joinMatch(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [["matchID", dataTypes.UINT32], ["password", dataTypes.STRING]],
-    )
+    return _JOIN_MATCH.read(stream)
 
 
 def changeMods(stream):
-    return packetHelper.readPacketData(stream, [["mods", dataTypes.UINT32]])
+    return _CHANGE_MODS.read(stream)
 
 
 def lockSlot(stream):
-    return packetHelper.readPacketData(stream, [["slotID", dataTypes.UINT32]])
+    return _LOCK_SLOT.read(stream)
 
 
 def transferHost(stream):
-    return packetHelper.readPacketData(stream, [["slotID", dataTypes.UINT32]])
+    return _TRANSFER_HOST.read(stream)
 
 
 def matchInvite(stream):
-    return packetHelper.readPacketData(stream, [["userID", dataTypes.UINT32]])
+    return _MATCH_INVITE.read(stream)
 
 
 def match_frames(stream):
-    return packetHelper.readPacketData(
-        stream,
-        [
-            ["time", dataTypes.SINT32],
-            ["id", dataTypes.BYTE],
-            ["count300", dataTypes.UINT16],
-            ["count100", dataTypes.UINT16],
-            ["count50", dataTypes.UINT16],
-            ["countGeki", dataTypes.UINT16],
-            ["countKatu", dataTypes.UINT16],
-            ["countMiss", dataTypes.UINT16],
-            ["totalScore", dataTypes.SINT32],
-            ["maxCombo", dataTypes.UINT16],
-            ["currentCombo", dataTypes.UINT16],
-            ["perfect", dataTypes.BYTE],
-            ["currentHp", dataTypes.BYTE],
-            ["tagByte", dataTypes.BYTE],
-            ["usingScoreV2", dataTypes.BYTE],
-        ],
-    )
+    return _MATCH_FRAMES.read(stream)
 
 
 def tournamentMatchInfoRequest(stream):
-    return packetHelper.readPacketData(stream, [["matchID", dataTypes.UINT32]])
+    return _TOURNAMENT_MATCH_INFO_REQUEST.read(stream)
 
 
 def tournamentJoinMatchChannel(stream):
-    return packetHelper.readPacketData(stream, [["matchID", dataTypes.UINT32]])
+    return _TOURNAMENT_JOIN_MATCH_CHANNEL.read(stream)
 
 
 def tournamentLeaveMatchChannel(stream):
-    return packetHelper.readPacketData(stream, [["matchID", dataTypes.UINT32]])
+    return _TOURNAMENT_LEAVE_MATCH_CHANNEL.read(stream)
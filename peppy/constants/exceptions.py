@@ -155,3 +155,7 @@ class periodicLoopException(Exception):
 
 class botAccountException(Exception):
     pass
+
+
+class databasePoolTimeoutException(Exception):
+    pass
@@ -1,11 +1,11 @@
 from __future__ import annotations
 
+import functools
 import json
 import pprint
 import random
 import re
 import sys
-import threading
 import time
 from collections import namedtuple
 from datetime import datetime
@@ -13,7 +13,6 @@ from datetime import timedelta
 from typing import Callable
 from typing import Optional
 
-import osupyparser
 import requests
 import settings
 from common import generalUtils
@@ -34,34 +33,45 @@ from discord_webhook import DiscordWebhook
 from helpers import chatHelper as chat
 from helpers import systemHelper
 from helpers import user_helper
+from helpers.command_router import CommandRouter
 from helpers.status_helper import UserStatus
 from helpers.user_helper import username_safe
 from logger import log
 from objects import fokabot
 from objects import glob
 
-REGEX = "^{}( (.+)?)?$"
-commands = {}
+commands: dict[str, Command] = {}
+router = CommandRouter()
 
-Command = namedtuple("Command", ["trigger", "callback", "syntax", "privileges"])
+Command = namedtuple(
+    "Command",
+    ["trigger", "callback", "syntax", "privileges", "slow", "channels"],
+)
 
 
 def registerCommand(
     trigger: str,
     syntax: Optional[str] = None,
     privs: Optional[int] = None,
+    slow: bool = False,
+    channels: tuple[str, ...] = ("#",),
 ):
-    """A decorator to set commands into list."""
+    """A decorator to set commands into list.
+    Commands marked `slow` run in the background and reply once done.
+    `channels` are the prefixes of the channels the command answers in,
+    empty for commands that only answer private messages."""
     global commands
 
     def wrapper(handler: Callable) -> Callable:
-        rgx = re.compile(REGEX.format(trigger))
-        commands[rgx] = Command(
+        commands[trigger] = Command(
             trigger=trigger,
             callback=handler,
             syntax=syntax or "",
             privileges=privs or None,
+            slow=slow,
+            channels=channels,
         )
+        router.add(commands[trigger])
         return handler
 
     return wrapper
@@ -75,57 +85,48 @@ def refresh_bmap(md5: str) -> None:
 
 
 def calc_completion(bmapid, n300, n100, n50, miss):
-    bmap = osupyparser.OsuFile(
-        f"{settings.DATA_BEATMAP_DIRECTORY}/{bmapid}.osu",
-    ).parse_file()
+    bmap = glob.beatmap_cache.objects(bmapid)
 
     total_hits = int(n300 + n100 + n50 + miss)
 
-    obj_total = total_hits - 1
-    n = len(bmap.hit_objects) - 1
-
-    objs = []
-    for p in bmap.hit_objects:
-        objs.append(p.start_time)
-
-    timing = int(objs[n]) - int(objs[0])
-    p = int(objs[obj_total]) - int(objs[0])
+    objs = bmap.start_times
+    p = objs[total_hits - 1] - objs[0]
 
-    return (p / timing) * 100
+    return (p / bmap.length) * 100
 
 
 def chimuMessage(beatmapID):
-    beatmap = glob.db.fetch(
-        "SELECT song_name, beatmapset_id FROM beatmaps WHERE beatmap_id = %s LIMIT 1",
-        [beatmapID],
+    songName, beatmapSetID = glob.beatmap_cache.song(beatmapID) or (
+        "Unknown Beatmap",
+        0,
     )
     return "Download [https://chimu.moe/en/d/{} {}] from Chimu".format(
-        beatmap["beatmapset_id"],
-        "Unknown Beatmap" if beatmap is None else beatmap["song_name"],
+        beatmapSetID,
+        songName,
     )
 
 
 def beatconnectMessage(beatmapID):
-    beatmap = glob.db.fetch(
-        "SELECT song_name, beatmapset_id FROM beatmaps WHERE beatmap_id = %s LIMIT 1",
-        [beatmapID],
+    songName, beatmapSetID = glob.beatmap_cache.song(beatmapID) or (
+        "Unknown Beatmap",
+        0,
     )
     return "Download [https://beatconnect.io/b/{} {}] from Beatconnect".format(
-        beatmap["beatmapset_id"],
-        "Unknown Beatmap" if beatmap is None else beatmap["song_name"],
+        beatmapSetID,
+        songName,
     )
 
 
 def mirrorMessage(beatmapID):
-    beatmap = glob.db.fetch(
-        "SELECT song_name, beatmapset_id FROM beatmaps WHERE beatmap_id = %s LIMIT 1",
-        [beatmapID],
+    songName, beatmapSetID = glob.beatmap_cache.song(beatmapID) or (
+        "Unknown Beatmap",
+        0,
     )
     return "Download {} from [https://beatconnect.io/b/{} Beatconnect], [https://chimu.moe/en/d/{} Chimu] or [osu://dl/{} osu!direct].".format(
-        "Unknown Beatmap" if beatmap is None else beatmap["song_name"],
-        beatmap["beatmapset_id"],
-        beatmap["beatmapset_id"],
-        beatmap["beatmapset_id"],
+        songName,
+        beatmapSetID,
+        beatmapSetID,
+        beatmapSetID,
     )
 
 
@@ -239,6 +240,7 @@ TODO: Change False to None, because False doesn't make any sense
     trigger="!map",
     privs=privileges.ADMIN_MANAGE_BEATMAPS,
     syntax="<rank/love/unrank> <set/map>",
+    slow=True,
 )
 def editMap(fro: str, chan: str, message: list[str]) -> str:
     """Edit the ranked status of the last /np'ed map."""
@@ -791,7 +793,11 @@ def systemShutdown(fro, chan, message):
 
 @registerCommand(trigger="!system reload", privs=privileges.ADMIN_MANAGE_SERVERS)
 def systemReload(fro, chan, message):
-    glob.banchoConf.reload()
+    if glob.worker_bus is not None:
+        # Every worker reloads them
+        glob.redis.publish("peppy:reload_settings", "reload")
+    else:
+        glob.banchoConf.reload()
     return "Bancho settings reloaded!"
 
 
@@ -859,7 +865,7 @@ def systemStatus(fro, chan, message):
     )
 
 
-@registerCommand(trigger="\x01ACTION")
+@registerCommand(trigger="\x01ACTION", slow=True, channels=("#spect_",))
 def tillerinoNp(fro, chan, message):
     """Displays PP stats for a specific map."""
     # Mirror list trigger for #spect_
@@ -918,7 +924,7 @@ def tillerinoNp(fro, chan, message):
     return getPPMessage(userID)
 
 
-@registerCommand(trigger="!with", syntax="<mods>")
+@registerCommand(trigger="!with", syntax="<mods>", slow=True, channels=())
 def tillerinoMods(fro, chan, message):
     """Displays the PP stats for a specific map with specific mods."""
     # Run the command in PM only
@@ -981,7 +987,7 @@ def tillerinoMods(fro, chan, message):
     return getPPMessage(userID)
 
 
-@registerCommand(trigger="!acc", syntax="<accuracy>")
+@registerCommand(trigger="!acc", syntax="<accuracy>", slow=True, channels=())
 def tillerinoAcc(fro, chan, message):
     """Displays the PP stats for a specific map with a specific accuracy."""
     try:
@@ -1011,7 +1017,7 @@ def tillerinoAcc(fro, chan, message):
         return "Invalid acc value"
 
 
-@registerCommand(trigger="!last")
+@registerCommand(trigger="!last", slow=True)
 def tillerinoLast(fro, chan, message):
     token = glob.tokens.getTokenFromUsername(fro)
     if token is None:
@@ -1082,23 +1088,20 @@ def tillerinoLast(fro, chan, message):
         and data["misses_count"] == 0
         and rank != "F"
     )
-    completion = calc_completion(
-        data["bid"],
-        data["300_count"],
-        data["100_count"],
-        data["50_count"],
-        data["misses_count"],
-    )
-
-    completion_or_pp = (
-        (
-            f" | {completion:.2f}% map completed"
-            if rank == "F" and data["play_mode"] == 0
-            else ""
+    # Only parse the beatmap when the completion is shown
+    if not score_fced:
+        completion_or_pp = f" | ({oppaiData['pp'][-1]:.2f} for {fc_acc:.2f}% FC)"
+    elif rank == "F" and data["play_mode"] == 0:
+        completion = calc_completion(
+            data["bid"],
+            data["300_count"],
+            data["100_count"],
+            data["50_count"],
+            data["misses_count"],
         )
-        if score_fced
-        else f" | ({oppaiData['pp'][-1]:.2f} for {fc_acc:.2f}% FC)"
-    )
+        completion_or_pp = f" | {completion:.2f}% map completed"
+    else:
+        completion_or_pp = ""
     accuracy_expanded = f"{data['100_count']}x100 // {data['50_count']}x50 // {data['misses_count']}xMiss"
 
     response.append(
@@ -1261,7 +1264,7 @@ def mpStart(fro, chan, message):
                     chan,
                     f"Match starts in {t} seconds.",
                 )
-            threading.Timer(1.00, _decreaseTimer, [t - 1]).start()
+            glob.scheduler.schedule(1, _decreaseTimer, t - 1, name="mp start countdown")
 
     if len(message) < 2 or not message[1].isdigit():
         startTime = 0
@@ -1297,7 +1300,12 @@ def mpStart(fro, chan, message):
         return "Starting match"
     else:
         _match.isStarting = True
-        threading.Timer(1.00, _decreaseTimer, [startTime - 1]).start()
+        glob.scheduler.schedule(
+            1,
+            _decreaseTimer,
+            startTime - 1,
+            name="mp start countdown",
+        )
         return (
             f"Match starts in {startTime} seconds. The match has been locked. "
             "Please don't leave the match during the countdown "
@@ -1886,6 +1894,16 @@ def crashuser(fro, chan, message):
     return ":^)"
 
 
+@functools.cache
+def _bibleChunks() -> tuple[str, ...]:
+    # Acquire bible from file, once.
+    with open(settings.DATA_BIBLE_PATH) as stream:
+        holy_bible = stream.read()
+
+    # Split the bible into 2000 char chunks (str writer and reader limit)
+    return tuple(holy_bible[i : i + 2000] for i in range(0, len(holy_bible), 2000))
+
+
 @registerCommand(
     trigger="!bless",
     syntax="<target>",
@@ -1901,16 +1919,8 @@ def bless(fro: str, chan: str, message: str) -> str:
     if not t_user:
         return "This user is not online, and may not be blessed."
 
-    # Acquire bible from file.
-    with open(settings.DATA_BIBLE_PATH) as stream:
-        holy_bible = stream.read()
-
-    # Split the bible into 2000 char chunks (str writer and reader limit)
-    bible_split = [holy_bible[i : i + 2000] for i in range(0, len(holy_bible), 2000)]
-
-    # Use bytearray for speed
     q = bytearray()
-    for b in bible_split:
+    for b in _bibleChunks():
         q += serverPackets.message_notify("Jesus", t_user.username, b)
     t_user.enqueue(q)
     return "THEY ARE BLESSED AND ASCENDED TO HeAVeN"
@@ -2062,14 +2072,14 @@ def syntax(fro, chan, message):
     if message[0] == "!help":
         return "Syntax: !help <Optional: page number>"
 
-    for _, cmd in commands.items():
-        if cmd.trigger == " ".join(message):
-            if cmd.privileges and not cmd.privileges & token.privileges:
-                return False
-            # Return it to them.
-            return f"Syntax: {cmd.trigger} {cmd.syntax or '<No syntax>'}"
+    cmd = commands.get(" ".join(message))
+    if cmd is None:
+        return False
 
-    return False
+    if cmd.privileges and not cmd.privileges & token.privileges:
+        return False
+    # Return it to them.
+    return f"Syntax: {cmd.trigger} {cmd.syntax or '<No syntax>'}"
 
 
 @registerCommand(trigger="!status", syntax="<status>")
@@ -1,6 +1,9 @@
 """ Contains functions used to write specific server packets to byte streams """
 from __future__ import annotations
 
+from typing import Optional
+from typing import TYPE_CHECKING
+
 import settings
 from common.constants import privileges
 from common.ripple import userUtils
@@ -14,6 +17,153 @@ from constants.rosuprivs import OWNER
 from helpers import packetHelper
 from objects import glob
 
+if TYPE_CHECKING:
+    from objects.osuToken import UserToken
+
+# Precompiled layouts of the packets with a fixed structure.
+_USER_ID = packetHelper.PacketStruct(packetIDs.server_userID, (dataTypes.SINT32,))
+_SILENCE_END = packetHelper.PacketStruct(
+    packetIDs.server_silenceEnd,
+    (dataTypes.UINT32,),
+)
+_MAIN_MENU_ICON = packetHelper.PacketStruct(
+    packetIDs.server_mainMenuIcon,
+    (dataTypes.STRING,),
+)
+_SUPPORTER_GMT = packetHelper.PacketStruct(
+    packetIDs.server_supporterGMT,
+    (dataTypes.SINT32,),
+)
+_FRIENDS_LIST = packetHelper.PacketStruct(
+    packetIDs.server_friendsList,
+    (dataTypes.INT_LIST,),
+)
+_USER_LOGOUT = packetHelper.PacketStruct(
+    packetIDs.server_userLogout,
+    (dataTypes.SINT32, dataTypes.BYTE),
+)
+_USER_PANEL = packetHelper.PacketStruct(
+    packetIDs.server_userPanel,
+    (
+        dataTypes.SINT32,
+        dataTypes.STRING,
+        dataTypes.BYTE,
+        dataTypes.BYTE,
+        dataTypes.BYTE,
+        dataTypes.FFLOAT,
+        dataTypes.FFLOAT,
+        dataTypes.SINT32,
+    ),
+)
+_USER_STATS = packetHelper.PacketStruct(
+    packetIDs.server_userStats,
+    (
+        dataTypes.SINT32,
+        dataTypes.BYTE,
+        dataTypes.STRING,
+        dataTypes.STRING,
+        dataTypes.SINT32,
+        dataTypes.BYTE,
+        dataTypes.SINT32,
+        dataTypes.SINT64,
+        dataTypes.FFLOAT,
+        dataTypes.SINT32,
+        dataTypes.SINT64,
+        dataTypes.SINT32,
+        dataTypes.UINT16,
+    ),
+)
+_SEND_MESSAGE = packetHelper.PacketStruct(
+    packetIDs.server_sendMessage,
+    (dataTypes.STRING, dataTypes.STRING, dataTypes.STRING, dataTypes.SINT32),
+)
+_CHANNEL_JOIN_SUCCESS = packetHelper.PacketStruct(
+    packetIDs.server_channel_join_success,
+    (dataTypes.STRING,),
+)
+_CHANNEL_INFO = packetHelper.PacketStruct(
+    packetIDs.server_channelInfo,
+    (dataTypes.STRING, dataTypes.STRING, dataTypes.UINT16),
+)
+_CHANNEL_KICKED = packetHelper.PacketStruct(
+    packetIDs.server_channelKicked,
+    (dataTypes.STRING,),
+)
+_USER_SILENCED = packetHelper.PacketStruct(
+    packetIDs.server_userSilenced,
+    (dataTypes.SINT32,),
+)
+_SPECTATOR_JOINED = packetHelper.PacketStruct(
+    packetIDs.server_spectatorJoined,
+    (dataTypes.SINT32,),
+)
+_SPECTATOR_LEFT = packetHelper.PacketStruct(
+    packetIDs.server_spectatorLeft,
+    (dataTypes.SINT32,),
+)
+_SPECTATE_FRAMES = packetHelper.PacketStruct(
+    packetIDs.server_spectateFrames,
+    (dataTypes.BBYTES,),
+)
+_SPECTATOR_CANT_SPECTATE = packetHelper.PacketStruct(
+    packetIDs.server_spectatorCantSpectate,
+    (dataTypes.SINT32,),
+)
+_FELLOW_SPECTATOR_JOINED = packetHelper.PacketStruct(
+    packetIDs.server_fellowSpectatorJoined,
+    (dataTypes.SINT32,),
+)
+_FELLOW_SPECTATOR_LEFT = packetHelper.PacketStruct(
+    packetIDs.server_fellowSpectatorLeft,
+    (dataTypes.SINT32,),
+)
+_DISPOSE_MATCH = packetHelper.PacketStruct(
+    packetIDs.server_disposeMatch,
+    (dataTypes.SINT32,),
+)
+_MATCH_CHANGE_PASSWORD = packetHelper.PacketStruct(
+    packetIDs.server_matchChangePassword,
+    (dataTypes.STRING,),
+)
+_MATCH_PLAYER_SKIPPED = packetHelper.PacketStruct(
+    packetIDs.server_matchPlayerSkipped,
+    (dataTypes.SINT32,),
+)
+_MATCH_SCORE_UPDATE = packetHelper.PacketStruct(
+    packetIDs.server_matchScoreUpdate,
+    (
+        dataTypes.SINT32,
+        dataTypes.BYTE,
+        dataTypes.UINT16,
+        dataTypes.UINT16,
+        dataTypes.UINT16,
+        dataTypes.UINT16,
+        dataTypes.UINT16,
+        dataTypes.UINT16,
+        dataTypes.SINT32,
+        dataTypes.UINT16,
+        dataTypes.UINT16,
+        dataTypes.BYTE,
+        dataTypes.BYTE,
+        dataTypes.BYTE,
+        dataTypes.BYTE,
+    ),
+)
+_MATCH_PLAYER_FAILED = packetHelper.PacketStruct(
+    packetIDs.server_matchPlayerFailed,
+    (dataTypes.SINT32,),
+)
+_SWITCH_SERVER = packetHelper.PacketStruct(
+    packetIDs.server_switchServer,
+    (dataTypes.STRING,),
+)
+_NOTIFICATION = packetHelper.PacketStruct(
+    packetIDs.server_notification,
+    (dataTypes.STRING,),
+)
+_RESTART = packetHelper.PacketStruct(packetIDs.server_restart, (dataTypes.SINT32,))
+_RTX = packetHelper.PacketStruct(0x69, (dataTypes.STRING,))
+
 """ Login errors packets """
 
 
@@ -53,17 +203,11 @@ def verification_required():
 
 
 def login_reply(user_id: int) -> bytes:
-    return packetHelper.buildPacket(
-        packetIDs.server_userID,
-        ((user_id, dataTypes.SINT32),),
-    )
+    return _USER_ID.build(user_id)
 
 
 def silence_end_notify(seconds):
-    return packetHelper.buildPacket(
-        packetIDs.server_silenceEnd,
-        ((seconds, dataTypes.UINT32),),
-    )
+    return _SILENCE_END.build(seconds)
 
 
 def protocol_version(version=19):
@@ -73,10 +217,7 @@ def protocol_version(version=19):
 
 
 def menu_icon(icon):
-    return packetHelper.buildPacket(
-        packetIDs.server_mainMenuIcon,
-        ((icon, dataTypes.STRING),),
-    )
+    return _MAIN_MENU_ICON.build(icon)
 
 
 def bancho_priv(supporter, GMT, tournamentStaff):
@@ -87,31 +228,20 @@ def bancho_priv(supporter, GMT, tournamentStaff):
         result |= userRanks.BAT
     if tournamentStaff:
         result |= userRanks.TOURNAMENT_STAFF
-    return packetHelper.buildPacket(
-        packetIDs.server_supporterGMT,
-        ((result, dataTypes.SINT32),),
-    )
+    return _SUPPORTER_GMT.build(result)
 
 
-def friend_list(userID):
-    friends = userUtils.getFriendList(userID)
-    return packetHelper.buildPacket(
-        packetIDs.server_friendsList,
-        ((friends, dataTypes.INT_LIST),),
-    )
+def friend_list(userID, friends: Optional[list[int]] = None):
+    if friends is None:
+        friends = userUtils.getFriendList(userID)
+    return _FRIENDS_LIST.build(friends)
 
 
 """ Users packets """
 
 
 def logout_notify(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_userLogout,
-        (
-            (userID, dataTypes.SINT32),
-            (0, dataTypes.BYTE),
-        ),
-    )
+    return _USER_LOGOUT.build(userID, 0)
 
 
 def user_presence(userID, force=False):
@@ -120,7 +250,21 @@ def user_presence(userID, force=False):
     if userToken is None:
         return b""
 
+    return userToken.getPresencePacket()
+
+
+def user_presence_token(userToken: UserToken) -> bytes:
+    """Returns the user panel packet of `userToken`, reusing its cached bytes."""
+
+    return userToken.getPresencePacket()
+
+
+def build_user_presence(userToken: UserToken) -> bytes:
+    """Encodes the user panel packet of `userToken`. Use `user_presence_token`
+    unless the packet must not come from the token cache."""
+
     # Get user data
+    userID = userToken.userID
     username = userToken.username
     timezone = 24 + userToken.timeOffset
     country = userToken.country
@@ -144,18 +288,15 @@ def user_presence(userID, force=False):
     else:
         userRank |= userRanks.NORMAL
 
-    return packetHelper.buildPacket(
-        packetIDs.server_userPanel,
-        (
-            (userID, dataTypes.SINT32),
-            (username, dataTypes.STRING),
-            (timezone, dataTypes.BYTE),
-            (country, dataTypes.BYTE),
-            (userRank, dataTypes.BYTE),
-            (longitude, dataTypes.FFLOAT),
-            (latitude, dataTypes.FFLOAT),
-            (gameRank, dataTypes.SINT32),
-        ),
+    return _USER_PANEL.build(
+        userID,
+        username,
+        timezone,
+        country,
+        userRank,
+        longitude,
+        latitude,
+        gameRank,
     )
 
 
@@ -165,6 +306,19 @@ def user_stats(userID):
     if userToken is None:
         return b""
 
+    return userToken.getStatsPacket()
+
+
+def user_stats_token(userToken: UserToken) -> bytes:
+    """Returns the user stats packet of `userToken`, reusing its cached bytes."""
+
+    return userToken.getStatsPacket()
+
+
+def build_user_stats(userToken: UserToken) -> bytes:
+    """Encodes the user stats packet of `userToken`. Use `user_stats_token`
+    unless the packet must not come from the token cache."""
+
     rankedScore = userToken.rankedScore
     performancePoints = userToken.pp
 
@@ -174,23 +328,20 @@ def user_stats(userID):
         rankedScore = performancePoints
         performancePoints = 0
 
-    return packetHelper.buildPacket(
-        packetIDs.server_userStats,
-        (
-            (userID, dataTypes.SINT32),
-            (userToken.actionID, dataTypes.BYTE),
-            (userToken.actionText, dataTypes.STRING),
-            (userToken.actionMd5, dataTypes.STRING),
-            (userToken.actionMods, dataTypes.SINT32),
-            (userToken.gameMode, dataTypes.BYTE),
-            (userToken.beatmapID, dataTypes.SINT32),
-            (rankedScore, dataTypes.SINT64),
-            (userToken.accuracy, dataTypes.FFLOAT),
-            (userToken.playcount, dataTypes.SINT32),
-            (userToken.totalScore, dataTypes.SINT64),
-            (userToken.gameRank, dataTypes.SINT32),
-            (performancePoints, dataTypes.UINT16),
-        ),
+    return _USER_STATS.build(
+        userToken.userID,
+        userToken.actionID,
+        userToken.actionText,
+        userToken.actionMd5,
+        userToken.actionMods,
+        userToken.gameMode,
+        userToken.beatmapID,
+        rankedScore,
+        userToken.accuracy,
+        userToken.playcount,
+        userToken.totalScore,
+        userToken.gameRank,
+        performancePoints,
     )
 
 
@@ -198,35 +349,21 @@ def user_stats(userID):
 
 
 def message_notify(fro: str, to: str, message: str):
-    return packetHelper.buildPacket(
-        packetIDs.server_sendMessage,
-        (
-            (fro, dataTypes.STRING),
-            (message, dataTypes.STRING),
-            (to, dataTypes.STRING),
-            (userUtils.getID(fro), dataTypes.SINT32),
-        ),
-    )
+    return _SEND_MESSAGE.build(fro, message, to, userUtils.getID(fro))
 
 
 def channel_join_success(chan: str):
-    return packetHelper.buildPacket(
-        packetIDs.server_channel_join_success,
-        ((chan, dataTypes.STRING),),
-    )
+    return _CHANNEL_JOIN_SUCCESS.build(chan)
 
 
 def channel_info(chan: str):
     if chan not in glob.channels.channels:
         return b""
     channel = glob.channels.channels[chan]
-    return packetHelper.buildPacket(
-        packetIDs.server_channelInfo,
-        (
-            (channel.name, dataTypes.STRING),
-            (channel.description, dataTypes.STRING),
-            (len(glob.streams.streams[f"chat/{chan}"].clients), dataTypes.UINT16),
-        ),
+    return _CHANNEL_INFO.build(
+        channel.name,
+        channel.description,
+        len(glob.streams.streams[f"chat/{chan}"].clients),
     )
 
 
@@ -235,62 +372,38 @@ def channel_info_end():
 
 
 def channel_kicked(chan):
-    return packetHelper.buildPacket(
-        packetIDs.server_channelKicked,
-        ((chan, dataTypes.STRING),),
-    )
+    return _CHANNEL_KICKED.build(chan)
 
 
 def silenced_notify(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_userSilenced,
-        ((userID, dataTypes.SINT32),),
-    )
+    return _USER_SILENCED.build(userID)
 
 
 """ Spectator packets """
 
 
 def spectator_add(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_spectatorJoined,
-        ((userID, dataTypes.SINT32),),
-    )
+    return _SPECTATOR_JOINED.build(userID)
 
 
 def spectator_remove(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_spectatorLeft,
-        ((userID, dataTypes.SINT32),),
-    )
+    return _SPECTATOR_LEFT.build(userID)
 
 
 def spectator_frames(data):
-    return packetHelper.buildPacket(
-        packetIDs.server_spectateFrames,
-        ((data, dataTypes.BBYTES),),
-    )
+    return _SPECTATE_FRAMES.build(data)
 
 
 def spectator_song_missing(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_spectatorCantSpectate,
-        ((userID, dataTypes.SINT32),),
-    )
+    return _SPECTATOR_CANT_SPECTATE.build(userID)
 
 
 def spectator_comrade_joined(user_id: int) -> bytes:
-    return packetHelper.buildPacket(
-        packetIDs.server_fellowSpectatorJoined,
-        ((user_id, dataTypes.SINT32),),
-    )
+    return _FELLOW_SPECTATOR_JOINED.build(user_id)
 
 
 def spectator_comrade_left(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_fellowSpectatorLeft,
-        ((userID, dataTypes.SINT32),),
-    )
+    return _FELLOW_SPECTATOR_LEFT.build(userID)
 
 
 """ Multiplayer Packets """
@@ -303,11 +416,9 @@ def match_create(matchID):
 
     # Get match binary data and build packet
     match = glob.matches.matches[matchID]
-    matchData = match.getMatchData(censored=True)
-    return packetHelper.buildPacket(packetIDs.server_newMatch, matchData)
+    return match.getMatchDataPacket(packetIDs.server_newMatch, censored=True)
 
 
-# TODO: Add match object argument to save some CPU
 def match_update(matchID, censored=False):
     # Make sure the match exists
     if matchID not in glob.matches.matches:
@@ -315,10 +426,7 @@ def match_update(matchID, censored=False):
 
     # Get match binary data and build packet
     match = glob.matches.matches[matchID]
-    return packetHelper.buildPacket(
-        packetIDs.server_updateMatch,
-        match.getMatchData(censored=censored),
-    )
+    return match.getMatchDataPacket(packetIDs.server_updateMatch, censored=censored)
 
 
 def match_start(matchID: int):
@@ -328,14 +436,11 @@ def match_start(matchID: int):
 
     # Get match binary data and build packet
     match = glob.matches.matches[matchID]
-    return packetHelper.buildPacket(packetIDs.server_matchStart, match.getMatchData())
+    return match.getMatchDataPacket(packetIDs.server_matchStart)
 
 
 def match_dispose(matchID):
-    return packetHelper.buildPacket(
-        packetIDs.server_disposeMatch,
-        ((matchID, dataTypes.SINT32),),
-    )
+    return _DISPOSE_MATCH.build(matchID)
 
 
 def match_join_success(matchID):
@@ -345,11 +450,7 @@ def match_join_success(matchID):
 
     # Get match binary data and build packet
     match = glob.matches.matches[matchID]
-    data = packetHelper.buildPacket(
-        packetIDs.server_matchJoinSuccess,
-        match.getMatchData(),
-    )
-    return data
+    return match.getMatchDataPacket(packetIDs.server_matchJoinSuccess)
 
 
 def match_join_fail():
@@ -357,10 +458,7 @@ def match_join_fail():
 
 
 def match_change_password(newPassword):
-    return packetHelper.buildPacket(
-        packetIDs.server_matchChangePassword,
-        ((newPassword, dataTypes.STRING),),
-    )
+    return _MATCH_CHANGE_PASSWORD.build(newPassword)
 
 
 def match_all_players_loaded():
@@ -368,10 +466,7 @@ def match_all_players_loaded():
 
 
 def match_player_skipped(userID):
-    return packetHelper.buildPacket(
-        packetIDs.server_matchPlayerSkipped,
-        ((userID, dataTypes.SINT32),),
-    )
+    return _MATCH_PLAYER_SKIPPED.build(userID)
 
 
 def match_all_skipped():
@@ -395,25 +490,22 @@ def match_frames(
     tag_byte: int,
     using_score_v2: int,
 ) -> bytes:
-    return packetHelper.buildPacket(
-        packetIDs.server_matchScoreUpdate,
-        (
-            (time, dataTypes.SINT32),
-            (slot_id, dataTypes.BYTE),
-            (count_300, dataTypes.UINT16),
-            (count_100, dataTypes.UINT16),
-            (count_50, dataTypes.UINT16),
-            (count_geki, dataTypes.UINT16),
-            (count_katu, dataTypes.UINT16),
-            (count_miss, dataTypes.UINT16),
-            (total_score, dataTypes.SINT32),
-            (max_combo, dataTypes.UINT16),
-            (current_combo, dataTypes.UINT16),
-            (perfect, dataTypes.BYTE),
-            (current_hp, dataTypes.BYTE),
-            (tag_byte, dataTypes.BYTE),
-            (using_score_v2, dataTypes.BYTE),
-        ),
+    return _MATCH_SCORE_UPDATE.build(
+        time,
+        slot_id,
+        count_300,
+        count_100,
+        count_50,
+        count_geki,
+        count_katu,
+        count_miss,
+        total_score,
+        max_combo,
+        current_combo,
+        perfect,
+        current_hp,
+        tag_byte,
+        using_score_v2,
     )
 
 
@@ -422,10 +514,7 @@ def match_complete():
 
 
 def match_player_fail(slotID):
-    return packetHelper.buildPacket(
-        packetIDs.server_matchPlayerFailed,
-        ((slotID, dataTypes.SINT32),),
-    )
+    return _MATCH_PLAYER_FAILED.build(slotID)
 
 
 def match_new_host_notify():
@@ -440,28 +529,19 @@ def match_abort():
 
 
 def server_switch(address):
-    return packetHelper.buildPacket(
-        packetIDs.server_switchServer,
-        ((address, dataTypes.STRING),),
-    )
+    return _SWITCH_SERVER.build(address)
 
 
 def notification(message):
-    return packetHelper.buildPacket(
-        packetIDs.server_notification,
-        ((message, dataTypes.STRING),),
-    )
+    return _NOTIFICATION.build(message)
 
 
 def server_restart(msUntilReconnection):
-    return packetHelper.buildPacket(
-        packetIDs.server_restart,
-        ((msUntilReconnection, dataTypes.SINT32),),
-    )
+    return _RESTART.build(msUntilReconnection)
 
 
 def rtx(message):
-    return packetHelper.buildPacket(0x69, ((message, dataTypes.STRING),))
+    return _RTX.build(message)
 
 
 def crash():
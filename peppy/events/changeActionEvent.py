@@ -37,10 +37,7 @@ if userToken.matchID != -1 and userToken.actionID != actions.MULTIPLAYING and us
     # Update cached stats if our pp changed if we've just submitted a score or we've changed gameMode
     # if (userToken.actionID == actions.PLAYING or userToken.actionID == actions.MULTIPLAYING) or (userToken.pp != userUtils.getPP(userID, userToken.gameMode)) or (userToken.gameMode != packetData["gameMode"]):
 
-    # Update cached stats if we've changed gamemode
-    if userToken.gameMode != packetData["gameMode"]:
-        userToken.gameMode = packetData["gameMode"]
-        userToken.updateCachedStats()
+    userToken.gameMode = packetData["gameMode"]
 
     # Always update action id, text, md5 and beatmapID
     userToken.actionID = packetData["actionID"]
@@ -49,27 +46,10 @@ if userToken.matchID != -1 and userToken.actionID != actions.MULTIPLAYING and us
     userToken.beatmapID = packetData["beatmapID"]
 
     if userToken.actionID != 1:
-        if packetData["actionMods"] & 128:
-            # Only reload on mode change.
-            if not userToken.relaxing:
-                userToken.updateCachedStats()
-            userToken.relaxing = True
-            userToken.autopiloting = False
-            userToken.updateCachedStats()
-        # autopiloten
-        elif packetData["actionMods"] & 8192:
-            # Only reload on mode change.
-            if not userToken.autopiloting:
-                userToken.updateCachedStats()
-            userToken.autopiloting = True
-            userToken.relaxing = False
-            userToken.updateCachedStats()
-        else:
-            if (not userToken.autopiloting) and (not userToken.relaxing):
-                userToken.updateCachedStats()
-            userToken.relaxing = False
-            userToken.autopiloting = False
-            userToken.updateCachedStats()
+        userToken.relaxing = bool(packetData["actionMods"] & 128)
+        userToken.autopiloting = not userToken.relaxing and bool(
+            packetData["actionMods"] & 8192,
+        )
 
     prefix = "VN"
     if userToken.relaxing:
@@ -88,12 +68,24 @@ if userToken.matchID != -1 and userToken.actionID != actions.MULTIPLAYING and us
     else:
         userToken.actionText = f"[{prefix}] " + packetData["actionText"]
 
-    # Enqueue our new user panel and stats to us and our spectators
-    p = serverPackets.user_presence(userID) + serverPackets.user_stats(userID)
-    userToken.enqueue(p)
-    if userToken.spectators:
-        for i in userToken.spectators:
-            glob.tokens.tokens[i].enqueue(p)
+    def sendPresence():
+        userToken.invalidateStats()
+
+        # Enqueue our new user panel and stats to us and our spectators.
+        # Kept as separate packets so queues can coalesce them.
+        presence = serverPackets.user_presence_token(userToken)
+        stats = serverPackets.user_stats_token(userToken)
+        userToken.enqueue(presence)
+        userToken.enqueue(stats)
+        if userToken.spectators:
+            for i in userToken.spectators:
+                glob.tokens.tokens[i].enqueue(presence)
+                glob.tokens.tokens[i].enqueue(stats)
+
+    # Update cached stats for our (maybe new) game mode, relax and autopilot state,
+    # then send them. They come from the stats cache unless they're stale, and
+    # stale ones are only sent once they've been fetched.
+    userToken.updateCachedStats(callback=sendPresence)
 
     # Console output
     log.info(
@@ -3,12 +3,13 @@ from __future__ import annotations
 from common.ripple import userUtils
 from constants import clientPackets
 from logger import log
+from objects import glob
 
 
 def handle(userToken, packetData):
     # Friend add packet
     packetData = clientPackets.addRemoveFriend(packetData)
-    userUtils.addFriend(userToken.userID, packetData["friendID"])
+    glob.db.runDeferred(userUtils.addFriend, userToken.userID, packetData["friendID"])
 
     # Console output
     log.info(
@@ -3,12 +3,17 @@ from __future__ import annotations
 from common.ripple import userUtils
 from constants import clientPackets
 from logger import log
+from objects import glob
 
 
 def handle(userToken, packetData):
     # Friend remove packet
     packetData = clientPackets.addRemoveFriend(packetData)
-    userUtils.removeFriend(userToken.userID, packetData["friendID"])
+    glob.db.runDeferred(
+        userUtils.removeFriend,
+        userToken.userID,
+        packetData["friendID"],
+    )
 
     # Console output
     log.info(
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-from constants import serverPackets
 from logger import log
 from objects import glob
 
@@ -13,8 +12,9 @@ def handle(userToken, _):
     userToken.joinStream("lobby")
 
     # Send matches data
-    for key, _ in glob.matches.matches.items():
-        userToken.enqueue(serverPackets.match_create(key))
+    snapshot = glob.matches.getLobbySnapshot()
+    if snapshot:
+        userToken.enqueue(snapshot)
 
     # Console output
     log.info(f"{username} has joined multiplayer lobby")
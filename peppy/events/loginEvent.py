@@ -1,15 +1,22 @@
 from __future__ import annotations
 
+import json
 import random
 import sys
 import time
 import traceback
 from datetime import datetime
+from typing import Any
+from typing import Optional
 
 import settings
+import tornado.gen
+from common.constants import gameModes
 from common.constants import privileges
+from common.redis import redisBatch
 from common.ripple import userUtils
 from common.ripple.userUtils import restrict_with_log
+from common.web import requestsManager
 from constants import exceptions
 from constants import serverPackets
 from helpers import chatHelper as chat
@@ -43,7 +50,43 @@ BOT_ACCOUNT_RESPONSE = serverPackets.notification(
 )
 
 
+def fetchUser(safe_username: str) -> Optional[dict[str, Any]]:
+    """
+    Everything the login needs in a single query rather than many userUtils
+    calls: the user, their password hash, vanilla std stats and friends.
+    Their std game rank is added as `gameRank`.
+
+    :param safe_username: safe username of the user logging in
+    :return: the user's row, or None if they don't exist
+    """
+    user_db = glob.db.fetch(
+        "SELECT u.id, u.username, u.username_safe, u.password_md5, u.privileges, "
+        "u.silence_end, u.donor_expire, u.frozen, u.firstloginafterfrozen, "
+        "u.freezedate, u.bypass_hwid, u.country, "
+        "s.ranked_score_std AS rankedScore, s.avg_accuracy_std AS accuracy, "
+        "s.playcount_std AS playcount, s.total_score_std AS totalScore, "
+        "s.pp_std AS pp, "
+        "(SELECT JSON_ARRAYAGG(r.user2) FROM users_relationships r "
+        "WHERE r.user1 = u.id) AS friends "
+        "FROM users u LEFT JOIN users_stats s ON s.id = u.id "
+        "WHERE u.username_safe = %s LIMIT 1",
+        (safe_username,),
+    )
+    if user_db is not None:
+        user_db["gameRank"] = userUtils.getGameRank(user_db["id"], gameModes.STD)
+
+    return user_db
+
+
+@tornado.gen.coroutine
 def handle(tornadoRequest):
+    """
+    Log a client in. Queries and the password check are yielded to the
+    executor, everything else runs on the event loop (in async mode).
+
+    :param tornadoRequest: the login request's handler
+    :return: token string and response data
+    """
     # I wanna benchmark!
     t = Timer()
     t.start()
@@ -82,13 +125,7 @@ def handle(tornadoRequest):
         username = str(loginData[0])
         safe_username = username.rstrip().replace(" ", "_").lower()
 
-        # Set stuff from single query rather than many userUtils calls.
-        user_db = glob.db.fetch(
-            "SELECT id, privileges, silence_end, donor_expire, frozen, "
-            "firstloginafterfrozen, freezedate, bypass_hwid, country FROM users "
-            "WHERE username_safe = %s LIMIT 1",
-            (safe_username,),
-        )
+        user_db = yield requestsManager.runBlocking(fetchUser, safe_username)
 
         if not user_db:
             # Invalid username
@@ -107,7 +144,13 @@ def handle(tornadoRequest):
         if priv & privileges.USER_BOT and osuVersion != "bot_account":
             raise exceptions.botAccountException()
 
-        if not verify_password(userID, loginData[1]):
+        validPassword = yield requestsManager.runBlocking(
+            verify_password,
+            userID,
+            loginData[1],
+            user_db["password_md5"],
+        )
+        if not validPassword:
             # Invalid password
             log.error(f"Login failed for user {username} (invalid password)!")
             responseData += serverPackets.notification(
@@ -127,7 +170,12 @@ def handle(tornadoRequest):
             & privileges.USER_PENDING_VERIFICATION
             # or not userUtils.hasVerifiedHardware(userID)
         ):
-            if userUtils.verifyUser(userID, clientData):
+            verified = yield requestsManager.runBlocking(
+                userUtils.verifyUser,
+                userID,
+                clientData,
+            )
+            if verified:
                 # Valid account
                 log.info(f"Account {userID} verified successfully!")
                 firstLogin = True
@@ -144,7 +192,18 @@ def handle(tornadoRequest):
 
         # Save HWID in db for multiaccount detection
         if not priv & privileges.USER_BOT:
-            hwAllowed = userUtils.logHardware(
+            # Only an empty HWID denies access. If the HWID is banned, we get
+            # restricted by the (deferred) hardware log so there's no need to wait for it.
+            validHardware = yield requestsManager.runBlocking(
+                userUtils.validHardware,
+                userID,
+                clientData,
+            )
+            if not validHardware:
+                raise exceptions.haxException()
+
+            glob.db.runDeferred(
+                userUtils.logHardware,
                 user_id=userID,
                 hashes=clientData,
                 is_restricted=user_restricted,
@@ -152,320 +211,338 @@ def handle(tornadoRequest):
                 bypass_restrict=user_db["bypass_hwid"],
             )
 
-            # This is false only if HWID is empty
-            # if HWID is banned, we get restricted so there's no
-            # need to deny bancho access
-            if not hwAllowed:
-                raise exceptions.haxException()
-
         # Log user IP
-        userUtils.logIP(userID, requestIP)
+        glob.db.runDeferred(userUtils.logIP, userID, requestIP)
 
         # Log user osuver
-        glob.db.execute(
+        glob.db.executeDeferred(
             "UPDATE users SET osuver = %s WHERE id = %s LIMIT 1",
             [osuVersion, userID],
         )
 
-        # Delete old tokens for that user and generate a new one
-        isTournament = "tourney" in osuVersion
-        if not isTournament:
-            glob.tokens.deleteOldTokens(userID)
-        responseToken = glob.tokens.addToken(
-            userID,
+        # Localise the user based off IP.
+        # Get location and country from IP (the API fallback is an HTTP call)
+        geolocation = yield requestsManager.runBlocking(
+            glob.geolocation_api.query_ip,
             requestIP,
-            timeOffset=timeOffset,
-            tournament=isTournament,
         )
-        responseTokenString = responseToken.token
-
-        if user_restricted:
-            responseToken.notify_restricted()
-        # responseToken.checkRestricted()
+        if geolocation is None:
+            latitude = longitude = 0
+            countryLetters = "XX"
+            is_vpn = False
+        else:
+            latitude = geolocation.latitude
+            longitude = geolocation.longitude
+            countryLetters = geolocation.country_code
+            is_vpn = geolocation.is_proxy
 
-        # Check if frozen
-        frozen = user_db["frozen"]
+        country = geo_helper.getCountryID(countryLetters)
 
-        current = datetime.now()
-        expire = datetime.utcfromtimestamp(user_db["freezedate"])
-        readabledate = expire.strftime("%d-%m-%Y %H:%M:%S")
-        passed = current > expire
-        if frozen and not passed:
-            responseToken.enqueue(
-                serverPackets.notification(
-                    f"The {settings.PS_NAME} staff team has found you suspicious and would like to request a liveplay. "
-                    f"You have until {readabledate} (UTC) to provide a liveplay to the staff team. This can be done via "
-                    f"the {settings.PS_NAME} Discord server. Failure to provide a valid liveplay will result in your account "
-                    "being automatically restricted.",
-                ),
-            )
-        elif frozen and passed:
-            responseToken.enqueue(FREEZE_RES_NOTIF)
-            restrict_with_log(
+        # Everything below only changes in-memory state, so it runs on the event loop
+        # without yielding. Its redis writes are sent in a single pipeline.
+        with redisBatch.batch():
+            # Delete old tokens for that user and generate a new one
+            isTournament = "tourney" in osuVersion
+            if not isTournament:
+                glob.tokens.deleteOldTokens(userID)
+            responseToken = glob.tokens.addToken(
                 userID,
-                "Time window for liveplay expired",
-                "The time window for the user to submit a liveplay has expired. The user has been automatically restricted.",
+                requestIP,
+                timeOffset=timeOffset,
+                tournament=isTournament,
+                userData=user_db,
             )
+            responseTokenString = responseToken.token
 
-        # we thank unfrozen people
-        if not frozen and user_db["firstloginafterfrozen"]:
-            responseToken.enqueue(UNFREEZE_NOTIF)
-            glob.db.execute(
-                f"UPDATE users SET firstloginafterfrozen = 0 WHERE id = {userID}",
-            )
+            if user_restricted:
+                responseToken.notify_restricted()
+            # responseToken.checkRestricted()
 
-        # Send message if donor expires soon
-        if responseToken.privileges & privileges.USER_DONOR:
-            if donor_expire - int(time.time()) <= 86400 * 3:
-                expireDays = round((donor_expire - int(time.time())) / 86400)
-                expireIn = (
-                    f"{expireDays} days" if expireDays > 1 else "less than 24 hours"
-                )
-                responseToken.enqueue(
-                    serverPackets.notification(
-                        f"Your supporter status expires in {expireIn}! Following this, you will lose your supporter privileges "
-                        "(such as the further profile customisation options, name changes or profile wipes) and will not "
-                        f"be able to access supporter features. If you wish to keep supporting {settings.PS_NAME} and you "
-                        "don't want to lose your donor privileges, you can donate again by clicking on 'Donate' on our website.",
-                    ),
-                )
-
-        # Get only silence remaining seconds
-        responseToken.silenceEndTime = silence_end
-        silenceSeconds = responseToken.getSilenceSecondsLeft()
-        # Get supporter/GMT
-        userGMT = False
-        userTournament = False
-        userGMT = responseToken.admin
-        userTournament = bool(
-            responseToken.privileges & privileges.USER_TOURNAMENT_STAFF,
-        )
+            # Check if frozen
+            frozen = user_db["frozen"]
 
-        # Server restarting check
-        if glob.restarting:
-            raise exceptions.banchoRestartingException()
-
-        # Maintenance check
-        if glob.banchoConf.config["banchoMaintenance"]:
-            if not userGMT:
-                # We are not mod/admin, delete token, send notification and logout
-                glob.tokens.deleteToken(responseTokenString)
-                raise exceptions.banchoMaintenanceException()
-            else:
-                # We are mod/admin, send warning notification and continue
+            current = datetime.now()
+            expire = datetime.utcfromtimestamp(user_db["freezedate"])
+            readabledate = expire.strftime("%d-%m-%Y %H:%M:%S")
+            passed = current > expire
+            if frozen and not passed:
                 responseToken.enqueue(
                     serverPackets.notification(
-                        "Bancho is in maintenance mode. Only mods/admins have full access to the server.\nType !system maintenance off in chat to turn off maintenance mode.",
+                        f"The {settings.PS_NAME} staff team has found you suspicious and would like to request a liveplay. "
+                        f"You have until {readabledate} (UTC) to provide a liveplay to the staff team. This can be done via "
+                        f"the {settings.PS_NAME} Discord server. Failure to provide a valid liveplay will result in your account "
+                        "being automatically restricted.",
                     ),
                 )
+            elif frozen and passed:
+                responseToken.enqueue(FREEZE_RES_NOTIF)
+                glob.db.runDeferred(
+                    restrict_with_log,
+                    userID,
+                    "Time window for liveplay expired",
+                    "The time window for the user to submit a liveplay has expired. The user has been automatically restricted.",
+                )
 
-        # BAN CUSTOM CHEAT CLIENTS
-        # 0Ainu = First Ainu build
-        # b20190326.2 = Ainu build 2 (MPGH PAGE 10)
-        # b20190401.22f56c084ba339eefd9c7ca4335e246f80 = Ainu Aoba's Birthday Build
-        # b20191223.3 = Unknown Ainu build? (Taken from most users osuver in cookiezi.pw)
-        # b20190226.2 = hqOsu (hq-af)
+            # we thank unfrozen people
+            if not frozen and user_db["firstloginafterfrozen"]:
+                responseToken.enqueue(UNFREEZE_NOTIF)
+                glob.db.executeDeferred(
+                    "UPDATE users SET firstloginafterfrozen = 0 WHERE id = %s",
+                    (userID,),
+                )
 
-        # TODO: Rewrite this mess
-        # Ainu Client 2020 update
-        if not priv & privileges.USER_BOT:
-            if tornadoRequest.request.headers.get("ainu"):
-                log.info(f"Account {userID} tried to use Ainu Client 2020!")
-                if user_restricted:
-                    responseToken.enqueue(serverPackets.notification("Nice try BUDDY."))
-                else:
-                    glob.tokens.deleteToken(userID)
-                    restrict_with_log(
-                        userID,
-                        "Attempted login with Ainu Client 2020",
-                        "The user has attempted to log in with a the Ainu 2020 client. "
-                        "This is a known cheating client. The user has been detected through "
-                        "the ainu header sent on login. (login gate).",
+            # Send message if donor expires soon
+            if responseToken.privileges & privileges.USER_DONOR:
+                if donor_expire - int(time.time()) <= 86400 * 3:
+                    expireDays = round((donor_expire - int(time.time())) / 86400)
+                    expireIn = (
+                        f"{expireDays} days" if expireDays > 1 else "less than 24 hours"
                     )
-                    raise exceptions.loginCheatClientsException()
-            # Ainu Client 2019
-            elif osuVersion in (
-                "0Ainu",
-                "b20190326.2",
-                "b20190401.22f56c084ba339eefd9c7ca4335e246f80",
-                "b20191223.3",
-            ):
-                log.info(f"Account {userID} tried to use Ainu Client!")
-                if user_restricted:
-                    responseToken.enqueue(serverPackets.notification("Nice try BUDDY."))
-                else:
-                    glob.tokens.deleteToken(userID)
-                    restrict_with_log(
-                        userID,
-                        "Attempted login with Ainu Client",
-                        "The user has attempted to log in with a client which has a version "
-                        f"matching known Ainu cheating client versions ({osuVersion}). "
-                        "(login gate)",
-                    )
-                    raise exceptions.loginCheatClientsException()
-            # hqOsu
-            elif osuVersion == "b20190226.2":
-                log.info(f"Account {userID} tried to use hqOsu!")
-                if user_restricted:
-                    responseToken.enqueue(serverPackets.notification("Comedian."))
-                else:
-                    glob.tokens.deleteToken(userID)
-                    restrict_with_log(
-                        userID,
-                        "Attempted login with hqOsu",
-                        "The user has attempted to log in with a client version matching "
-                        f"the default setting of the hQosu multiaccounting utility ({osuVersion}). "
-                        "(login gate)",
+                    responseToken.enqueue(
+                        serverPackets.notification(
+                            f"Your supporter status expires in {expireIn}! Following this, you will lose your supporter privileges "
+                            "(such as the further profile customisation options, name changes or profile wipes) and will not "
+                            f"be able to access supporter features. If you wish to keep supporting {settings.PS_NAME} and you "
+                            "don't want to lose your donor privileges, you can donate again by clicking on 'Donate' on our website.",
+                        ),
                     )
-                    raise exceptions.loginCheatClientsException()
 
-            # hqosu legacy
-            elif osuVersion == "b20190716.5":
-                log.info(f"Account {userID} tried to use hqOsu legacy!")
-                if user_restricted:
-                    responseToken.enqueue(serverPackets.notification("Comedian."))
-                else:
-                    glob.tokens.deleteToken(userID)
-                    restrict_with_log(
-                        userID,
-                        "Attempted login with hqOsu (legacy)",
-                        "The user has attempted to log in with a client version matching "
-                        f"the default setting of the hQosu multiaccounting utility ({osuVersion}). "
-                        "(login gate)",
-                    )
-                    raise exceptions.loginCheatClientsException()
-            # Budget Hacked client.
-            elif osuVersion.startswith("skoot"):
-                if user_restricted:
-                    responseToken.enqueue(serverPackets.notification("Comedian."))
-                else:
-                    glob.tokens.deleteToken(userID)
-                    restrict_with_log(
-                        userID,
-                        "Attempted login with Skoot client.",
-                        "The user attempted to log in with the Skoot custom client. "
-                        f"This has been detected through the osu! version sent on login ({osuVersion}). "
-                        "(login gate)",
-                    )
-                    raise exceptions.loginCheatClientsException()
+            # Get only silence remaining seconds
+            responseToken.silenceEndTime = silence_end
+            silenceSeconds = responseToken.getSilenceSecondsLeft()
+            # Get supporter/GMT
+            userGMT = False
+            userTournament = False
+            userGMT = responseToken.admin
+            userTournament = bool(
+                responseToken.privileges & privileges.USER_TOURNAMENT_STAFF,
+            )
 
-            # Blanket cover for most retard clients, force update.
-            elif osuVersion[0] != "b":
-                glob.tokens.deleteToken(userID)
-                raise exceptions.haxException()
+            # Server restarting check
+            if glob.restarting:
+                raise exceptions.banchoRestartingException()
 
-            # Special case for old fallback client
-            elif osuVersion == "20160403.6":
-                glob.tokens.deleteToken(userID)
-                responseData += FALLBACK_NOTIF
-                raise exceptions.loginFailedException
-
-            # Misc outdated client check
-            elif int(osuVersion[1:5]) < settings.PS_MINIMUM_CLIENT_YEAR:
-                glob.tokens.deleteToken(userID)
-                responseData += OLD_CLIENT_NOTIF
-                raise exceptions.loginFailedException
-
-        # Send all needed login packets
-        responseToken.enqueue(
-            bytearray(serverPackets.silence_end_notify(silenceSeconds))
-            + serverPackets.login_reply(userID)  # Fast addition
-            + serverPackets.protocol_version()
-            + serverPackets.bancho_priv(True, userGMT, userTournament)
-            + serverPackets.user_presence(userID, True)
-            + serverPackets.user_stats(userID)
-            + serverPackets.channel_info_end()
-            + serverPackets.friend_list(userID),
-        )
+            # Maintenance check
+            if glob.banchoConf.config["banchoMaintenance"]:
+                if not userGMT:
+                    # We are not mod/admin, delete token, send notification and logout
+                    glob.tokens.deleteToken(responseTokenString)
+                    raise exceptions.banchoMaintenanceException()
+                else:
+                    # We are mod/admin, send warning notification and continue
+                    responseToken.enqueue(
+                        serverPackets.notification(
+                            "Bancho is in maintenance mode. Only mods/admins have full access to the server.\nType !system maintenance off in chat to turn off maintenance mode.",
+                        ),
+                    )
 
-        # Default opened channels
-        # TODO: Configurable default channels
-        chat.joinChannel(token=responseToken, channel="#osu")
-        chat.joinChannel(token=responseToken, channel="#announce")
+            # BAN CUSTOM CHEAT CLIENTS
+            # 0Ainu = First Ainu build
+            # b20190326.2 = Ainu build 2 (MPGH PAGE 10)
+            # b20190401.22f56c084ba339eefd9c7ca4335e246f80 = Ainu Aoba's Birthday Build
+            # b20191223.3 = Unknown Ainu build? (Taken from most users osuver in cookiezi.pw)
+            # b20190226.2 = hqOsu (hq-af)
+
+            # TODO: Rewrite this mess
+            # Ainu Client 2020 update
+            if not priv & privileges.USER_BOT:
+                if tornadoRequest.request.headers.get("ainu"):
+                    log.info(f"Account {userID} tried to use Ainu Client 2020!")
+                    if user_restricted:
+                        responseToken.enqueue(
+                            serverPackets.notification("Nice try BUDDY.")
+                        )
+                    else:
+                        glob.tokens.deleteToken(userID)
+                        glob.db.runDeferred(
+                            restrict_with_log,
+                            userID,
+                            "Attempted login with Ainu Client 2020",
+                            "The user has attempted to log in with a the Ainu 2020 client. "
+                            "This is a known cheating client. The user has been detected through "
+                            "the ainu header sent on login. (login gate).",
+                        )
+                        raise exceptions.loginCheatClientsException()
+                # Ainu Client 2019
+                elif osuVersion in (
+                    "0Ainu",
+                    "b20190326.2",
+                    "b20190401.22f56c084ba339eefd9c7ca4335e246f80",
+                    "b20191223.3",
+                ):
+                    log.info(f"Account {userID} tried to use Ainu Client!")
+                    if user_restricted:
+                        responseToken.enqueue(
+                            serverPackets.notification("Nice try BUDDY.")
+                        )
+                    else:
+                        glob.tokens.deleteToken(userID)
+                        glob.db.runDeferred(
+                            restrict_with_log,
+                            userID,
+                            "Attempted login with Ainu Client",
+                            "The user has attempted to log in with a client which has a version "
+                            f"matching known Ainu cheating client versions ({osuVersion}). "
+                            "(login gate)",
+                        )
+                        raise exceptions.loginCheatClientsException()
+                # hqOsu
+                elif osuVersion == "b20190226.2":
+                    log.info(f"Account {userID} tried to use hqOsu!")
+                    if user_restricted:
+                        responseToken.enqueue(serverPackets.notification("Comedian."))
+                    else:
+                        glob.tokens.deleteToken(userID)
+                        glob.db.runDeferred(
+                            restrict_with_log,
+                            userID,
+                            "Attempted login with hqOsu",
+                            "The user has attempted to log in with a client version matching "
+                            f"the default setting of the hQosu multiaccounting utility ({osuVersion}). "
+                            "(login gate)",
+                        )
+                        raise exceptions.loginCheatClientsException()
+
+                # hqosu legacy
+                elif osuVersion == "b20190716.5":
+                    log.info(f"Account {userID} tried to use hqOsu legacy!")
+                    if user_restricted:
+                        responseToken.enqueue(serverPackets.notification("Comedian."))
+                    else:
+                        glob.tokens.deleteToken(userID)
+                        glob.db.runDeferred(
+                            restrict_with_log,
+                            userID,
+                            "Attempted login with hqOsu (legacy)",
+                            "The user has attempted to log in with a client version matching "
+                            f"the default setting of the hQosu multiaccounting utility ({osuVersion}). "
+                            "(login gate)",
+                        )
+                        raise exceptions.loginCheatClientsException()
+                # Budget Hacked client.
+                elif osuVersion.startswith("skoot"):
+                    if user_restricted:
+                        responseToken.enqueue(serverPackets.notification("Comedian."))
+                    else:
+                        glob.tokens.deleteToken(userID)
+                        glob.db.runDeferred(
+                            restrict_with_log,
+                            userID,
+                            "Attempted login with Skoot client.",
+                            "The user attempted to log in with the Skoot custom client. "
+                            f"This has been detected through the osu! version sent on login ({osuVersion}). "
+                            "(login gate)",
+                        )
+                        raise exceptions.loginCheatClientsException()
+
+                # Blanket cover for most retard clients, force update.
+                elif osuVersion[0] != "b":
+                    glob.tokens.deleteToken(userID)
+                    raise exceptions.haxException()
 
-        # Join admin channel if we are an admin
-        if responseToken.admin:
-            chat.joinChannel(token=responseToken, channel="#admin")
+                # Special case for old fallback client
+                elif osuVersion == "20160403.6":
+                    glob.tokens.deleteToken(userID)
+                    responseData += FALLBACK_NOTIF
+                    raise exceptions.loginFailedException
 
-        # Output channels info
-        for key, value in glob.channels.channels.items():
-            if value.publicRead and not value.hidden:
-                responseToken.enqueue(serverPackets.channel_info(key))
+                # Misc outdated client check
+                elif int(osuVersion[1:5]) < settings.PS_MINIMUM_CLIENT_YEAR:
+                    glob.tokens.deleteToken(userID)
+                    responseData += OLD_CLIENT_NOTIF
+                    raise exceptions.loginFailedException
 
-        # Send main menu icon
-        if glob.banchoConf.config["menuIcon"] != "":
+            # Send all needed login packets
             responseToken.enqueue(
-                serverPackets.menu_icon(glob.banchoConf.config["menuIcon"]),
+                bytearray(serverPackets.silence_end_notify(silenceSeconds))
+                + serverPackets.login_reply(userID)  # Fast addition
+                + serverPackets.protocol_version()
+                + serverPackets.bancho_priv(True, userGMT, userTournament)
+                + serverPackets.user_presence_token(responseToken)
+                + serverPackets.user_stats_token(responseToken)
+                + serverPackets.channel_info_end()
+                + serverPackets.friend_list(
+                    userID,
+                    json.loads(user_db["friends"]) if user_db["friends"] else [0],
+                ),
             )
 
-        # Send online users' panels
-        with glob.tokens:
-            for token in glob.tokens.tokens.values():
-                if not token.restricted:
-                    responseToken.enqueue(serverPackets.user_presence(token.userID))
+            # Default opened channels
+            # TODO: Configurable default channels
+            chat.joinChannel(token=responseToken, channel="#osu")
+            chat.joinChannel(token=responseToken, channel="#announce")
 
-        # Localise the user based off IP.
-        # Get location and country from IP
-        geolocation = glob.geolocation_api.query_ip(requestIP)
-        if geolocation is None:
-            latitude = longitude = 0
-            countryLetters = "XX"
-            is_vpn = False
-        else:
-            latitude = geolocation.latitude
-            longitude = geolocation.longitude
-            countryLetters = geolocation.country_code
-            is_vpn = geolocation.is_proxy
+            # Join admin channel if we are an admin
+            if responseToken.admin:
+                chat.joinChannel(token=responseToken, channel="#admin")
 
-        country = geo_helper.getCountryID(countryLetters)
+            # Output channels info
+            for key, value in glob.channels.channels.items():
+                if value.publicRead and not value.hidden:
+                    responseToken.enqueue(serverPackets.channel_info(key))
 
-        # Set location and country
-        responseToken.setLocation(latitude, longitude)
-        responseToken.country = country
+            # Send main menu icon
+            if glob.banchoConf.config["menuIcon"] != "":
+                responseToken.enqueue(
+                    serverPackets.menu_icon(glob.banchoConf.config["menuIcon"]),
+                )
 
-        # Log for country tagging feature
-        if countryLetters != "XX":
-            glob.db.execute(
-                "INSERT INTO user_country_history (user_id, country_code, is_vpn, ip_address) "
-                "VALUES (%s, %s, %s, %s)",
-                (userID, countryLetters, is_vpn, requestIP),
-            )
+            # Send online users' panels
+            with glob.tokens:
+                for token in glob.tokens.tokens.values():
+                    if not token.restricted:
+                        responseToken.enqueue(serverPackets.user_presence_token(token))
+
+            # Set location and country
+            responseToken.country = country
+            responseToken.setLocation(latitude, longitude)
+
+            # Log for country tagging feature
+            if countryLetters != "XX":
+                glob.db.executeDeferred(
+                    "INSERT INTO user_country_history (user_id, country_code, is_vpn, ip_address) "
+                    "VALUES (%s, %s, %s, %s)",
+                    (userID, countryLetters, is_vpn, requestIP),
+                )
 
-        # Set country in db if user has no country (first bancho login)
-        if user_db["country"] == "XX":
-            set_country(userID, countryLetters)
-
-        # Send to everyone our userpanel if we are not restricted or tournament
-        if not responseToken.restricted:
-            glob.streams.broadcast("main", serverPackets.user_presence(userID))
-
-        # TODO: Make quotes database based.
-        t_str = t.end_time_str()
-        online_users = len(glob.tokens.tokens)
-
-        # Wylie has his own quote he gets to enjoy only himself lmfao. UPDATE: Electro gets it too.
-        if userID in (4674, 3277):
-            quote = "I lost an S because I saw her lewd"
-        # Ced also gets his own AS HE DOESNT WANT TO CHECK FAST SPEED.
-        elif userID == 1002:
-            quote = "juSt Do iT"
-        # Me and relesto are getting one as well lmao. UPDATE: Sky and Aochi gets it too lmao.
-        elif userID in (1000, 1180, 3452, 4812):
-            quote = (
-                f"Hello I'm {settings.PS_BOT_USERNAME}! The server's official bot to assist you, "
-                "if you want to know what I can do just type !help"
-            )
-        else:
-            quote = random.choice(glob.banchoConf.config["Quotes"])
-        notif = f"""- Online Users: {online_users}\n- {quote}"""
-        if responseToken.admin:
-            notif += f"\n- Elapsed: {t_str}!"
-        responseToken.enqueue(serverPackets.notification(notif))
+            # Set country in db if user has no country (first bancho login)
+            if user_db["country"] == "XX":
+                glob.db.runDeferred(set_country, userID, countryLetters)
+
+            # Send to everyone our userpanel if we are not restricted or tournament
+            if not responseToken.restricted:
+                glob.streams.broadcast(
+                    "main",
+                    serverPackets.user_presence_token(responseToken),
+                )
 
-        log.info(f"Authentication attempt took {t_str}!")
+            # TODO: Make quotes database based.
+            t_str = t.end_time_str()
+            online_users = len(glob.tokens.tokens)
+
+            # Wylie has his own quote he gets to enjoy only himself lmfao. UPDATE: Electro gets it too.
+            if userID in (4674, 3277):
+                quote = "I lost an S because I saw her lewd"
+            # Ced also gets his own AS HE DOESNT WANT TO CHECK FAST SPEED.
+            elif userID == 1002:
+                quote = "juSt Do iT"
+            # Me and relesto are getting one as well lmao. UPDATE: Sky and Aochi gets it too lmao.
+            elif userID in (1000, 1180, 3452, 4812):
+                quote = (
+                    f"Hello I'm {settings.PS_BOT_USERNAME}! The server's official bot to assist you, "
+                    "if you want to know what I can do just type !help"
+                )
+            else:
+                quote = random.choice(glob.banchoConf.config["Quotes"])
+            notif = f"""- Online Users: {online_users}\n- {quote}"""
+            if responseToken.admin:
+                notif += f"\n- Elapsed: {t_str}!"
+            responseToken.enqueue(serverPackets.notification(notif))
 
-        # Set reponse data to right value and reset our queue
-        responseData = responseToken.fetch_queue()
+            log.info(f"Authentication attempt took {t_str}!")
+
+            # Set reponse data to right value and reset our queue
+            responseData = responseToken.fetch_queue()
     except exceptions.loginFailedException:
         # Login failed error packet
         # (we don't use enqueue because we don't have a token since login has failed)
@@ -3,18 +3,29 @@ from __future__ import annotations
 import json
 import time
 
+from common.web import requestsManager
 from constants import serverPackets
 from helpers import chatHelper as chat
 from logger import log
 from objects import glob
 
 
-def handle(userToken, _=None, deleteToken=True):
+def handle(userToken, _=None, deleteToken=True, announce=True):
     # get usertoken data
     userID = userToken.userID
     username = userToken.username
     requestToken = userToken.token
 
+    if userToken.remote:
+        # Another worker's client. The logout is announced from here, so it's
+        # ordered with whatever this worker broadcasts next.
+        if int(time.time() - userToken.loginTime) >= 5 or userToken.irc:
+            glob.streams.broadcast("main", serverPackets.logout_notify(userID))
+            glob.worker_bus.logout(userToken, deleteToken)
+            if deleteToken:
+                glob.tokens.deleteToken(requestToken)
+        return
+
     # Big client meme here. If someone logs out and logs in right after,
     # the old logout packet will still be in the queue and will be sent to
     # the server, so we accept logout packets sent at least 5 seconds after login
@@ -34,7 +45,8 @@ def handle(userToken, _=None, deleteToken=True):
         userToken.leaveAllStreams()
 
         # Enqueue our disconnection to everyone else
-        glob.streams.broadcast("main", serverPackets.logout_notify(userID))
+        if announce:
+            glob.streams.broadcast("main", serverPackets.logout_notify(userID))
 
         # Delete token
         if deleteToken:
@@ -44,15 +56,26 @@ def handle(userToken, _=None, deleteToken=True):
 
         # glob.db.execute("UPDATE users_stats SET current_status = 'Offline' WHERE id = %s", [userID])
         # Change username if needed
-        newUsername = glob.redis.get(f"ripple:change_username_pending:{userID}")
-        if newUsername is not None:
-            log.debug(f"Sending username change request for user {userID}")
-            glob.redis.publish(
-                "peppy:change_username",
-                json.dumps(
-                    {"userID": userID, "newUsername": newUsername.decode("utf-8")},
-                ),
-            )
+        requestsManager.runDetached(changePendingUsername, userID)
 
         # Console output
         log.info(f"{username} has been disconnected. (logout)")
+
+
+def changePendingUsername(userID: int) -> None:
+    """
+    Ask for the username change `userID` has been waiting for, if any.
+    Blocks on redis.
+
+    :param userID: user ID of the user who has just logged out
+    :return:
+    """
+    newUsername = glob.redis.get(f"ripple:change_username_pending:{userID}")
+    if newUsername is not None:
+        log.debug(f"Sending username change request for user {userID}")
+        glob.redis.publish(
+            "peppy:change_username",
+            json.dumps(
+                {"userID": userID, "newUsername": newUsername.decode("utf-8")},
+            ),
+        )
@@ -1,6 +1,10 @@
 from __future__ import annotations
 
+import functools
+
+from adapters.performance_service import PerformanceResult
 from common.generalUtils import calc_acc
+from common.web import requestsManager
 from constants import clientPackets
 from constants import serverPackets
 from objects import glob
@@ -47,7 +51,16 @@ def handle(userToken, packetData):
                 data["countKatu"],
                 data["countGeki"],
             )
-            performance = glob.performance_service.calculate_performance_single(
+
+            def update_pp(performance: PerformanceResult) -> None:
+                # Called later on the loop, the slot may have changed
+                with match:
+                    if match.inProgress and match.slots[slotID].user == userToken.token:
+                        match.updateScore(slotID, int(performance.pp))
+
+            # Don't wait for the performance service, frames are sent with the
+            # last known PP until the calculation comes back.
+            performance = glob.performance_service.calculate_performance_deferred(
                 beatmap_id=match.beatmapID,
                 mode=match.gameMode,
                 mods=slot_mods,
@@ -55,10 +68,11 @@ def handle(userToken, packetData):
                 accuracy=accuracy,
                 miss_count=data["countMiss"],
                 passed_objects=passed_objects,
+                callback=functools.partial(requestsManager.runOnLoop, update_pp),
             )
-
-            match.updateScore(slotID, int(performance.pp))
-            data["totalScore"] = int(performance.pp)
+            if performance is not None:
+                match.updateScore(slotID, int(performance.pp))
+            data["totalScore"] = match.slots[slotID].score
         else:
             match.updateScore(slotID, data["totalScore"])
 
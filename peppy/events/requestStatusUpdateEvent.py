@@ -5,5 +5,6 @@ from constants import serverPackets
 
 def handle(userToken, packetData):
     # Update cache and send new stats
-    userToken.updateCachedStats()
-    userToken.enqueue(serverPackets.user_stats(userToken.userID))
+    userToken.updateCachedStats(
+        callback=lambda: userToken.enqueue(serverPackets.user_stats(userToken.userID)),
+    )
@@ -15,6 +15,7 @@ def handle(userToken, packetData):
 
     # Set token away message
     userToken.awayMessage = packetData["awayMessage"]
+    userToken.shareState()
 
     # Send private message from the bot
     if packetData["awayMessage"] == "":
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from constants import serverPackets
+from constants import packetIDs
+from helpers import packetHelper
 from logger import log
 from objects import glob
 
@@ -9,12 +10,16 @@ def handle(userToken, packetData):
     # get token data
     userID = userToken.userID
 
-    # Send spectator frames to every spectator
-    streamName = f"spect/{userID}"
-    glob.streams.broadcast(streamName, serverPackets.spectator_frames(packetData[7:]))
-    log.debug(
-        "Broadcasting {}'s frames to {} clients".format(
-            userID,
-            len(glob.streams.streams[streamName].clients),
-        ),
+    # Send spectator frames to every spectator.
+    # The frames are forwarded as they are, only the packet ID changes.
+    stream = glob.streams.getStream(f"spect/{userID}")
+    if stream is None or not stream.clients:
+        return
+
+    stream.broadcast(
+        packetHelper.relayPacket(packetIDs.server_spectateFrames, packetData),
     )
+    if glob.debug:
+        log.debug(
+            f"Broadcasting {userID}'s frames to {len(stream.clients)} clients",
+        )
@@ -21,9 +21,23 @@ def handle(userToken, packetData):
         if targetToken is None:
             raise exceptions.tokenNotFoundException
 
+        if targetToken.remote:
+            # The host is on another worker, spectating only works on the hub
+            glob.worker_bus.requestToken(
+                targetToken,
+                lambda hostToken: _startSpectating(userToken, hostToken),
+            )
+            return
+
         # Start spectating new user
         userToken.startSpectating(targetToken)
     except exceptions.tokenNotFoundException:
         # Stop spectating if token not found
         log.warning("Spectator start: token not found")
         userToken.stopSpectating()
+
+
+def _startSpectating(userToken, hostToken):
+    # Unless the spectator has logged out (or moved) in the meantime
+    if glob.tokens.tokens.get(userToken.token) is userToken:
+        userToken.startSpectating(hostToken)
@@ -5,6 +5,7 @@ import json
 import tornado.gen
 import tornado.web
 from common.web import requestsManager
+from constants import fokabotCommands
 from objects import glob
 
 
@@ -18,6 +19,22 @@ class handler(requestsManager.asyncRequestHandler):
             # Get online users count
             data["result"] = -1 if glob.restarting else 1
 
+            # Chat log writer backlog
+            if glob.chat_log_writer is not None:
+                data["chat_log"] = glob.chat_log_writer.metrics()
+
+            # Messages and requests between worker processes
+            if glob.worker_bus is not None:
+                data["worker_bus"] = glob.worker_bus.metrics()
+
+            # Delayed and periodic jobs
+            data["scheduler"] = glob.scheduler.metrics()
+
+            # Bot command run times
+            data["bot_commands"] = fokabotCommands.router.metrics()
+            if glob.slow_commands is not None:
+                data["slow_bot_commands"] = glob.slow_commands.metrics()
+
             # Status code and message
             statusCode = 200
             data["message"] = "ok"
@@ -6,7 +6,7 @@ import traceback
 
 import settings
 import tornado.gen
-import tornado.web
+from common.redis import redisBatch
 from common.web import requestsManager
 from constants import exceptions
 from constants import packetIDs
@@ -55,6 +55,7 @@ from events import tournamentMatchInfoRequestEvent
 from events import userPanelRequestEvent
 from events import userStatsRequestEvent
 from helpers import packetHelper
+from helpers.worker_bus import FORWARDS_HEADER
 from logger import log
 from objects import glob
 
@@ -119,9 +120,91 @@ eventHandler = {
 }
 
 
+def handlePackets(requestTokenString: str, requestData: bytes) -> tuple[str, bytes]:
+    """
+    Handle the packets sent by a logged in client.
+    Event handlers never block nor yield: in async mode this runs on the event
+    loop, which owns every token, and blocking work is sent to the executor.
+    Otherwise it runs on a pool thread, under the token's processing lock.
+
+    :param requestTokenString: client's token string
+    :param requestData: request body
+    :return: response token string and response data
+    """
+    responseTokenString = ""
+    responseData = b""
+    userToken = None
+    try:
+        # This is not the first packet, send response based on client's request
+        # Make sure the token exists
+        # (another worker's token is only found if it couldn't be forwarded)
+        token = glob.tokens.tokens.get(requestTokenString)
+        if token is None or token.remote:
+            raise exceptions.tokenNotFoundException()
+
+        # Token exists, lock it
+        # (in async mode nothing else can run until we're done)
+        userToken = token
+        if not settings.HTTP_ASYNC_MODE:
+            userToken.processingLock.acquire()
+
+        # Read every stacked packet (as views of the request body, no copies).
+        # Their redis writes are sent in a single pipeline at the end.
+        with redisBatch.batch():
+            for packetID, packetData in packetHelper.iterPackets(requestData):
+                # Process/ignore packet
+                if packetID != 4:
+                    if packetID in eventHandler:
+                        if not userToken.restricted or (
+                            userToken.restricted and packetID in packetsRestricted
+                        ):
+                            eventHandler[packetID].handle(userToken, packetData)
+                        else:
+                            log.warning(
+                                "Ignored packet id from {} ({}) (user is restricted)".format(
+                                    requestTokenString,
+                                    packetID,
+                                ),
+                            )
+                    else:
+                        log.warning(
+                            "Unknown packet id from {} ({})".format(
+                                requestTokenString,
+                                packetID,
+                            ),
+                        )
+
+        # Token queue built, send it
+        responseTokenString = userToken.token
+        responseData = userToken.fetch_queue()
+    except exceptions.tokenNotFoundException:
+        # Token not found. Get the user to be reconnected.
+        responseData = serverPackets.server_restart(1)
+        responseData += serverPackets.notification(
+            f"You don't seem to be logged into {settings.PS_NAME} anymore... "
+            "This is common during server restarts, trying to log you back in.",
+        )
+        log.warning(
+            "Received unknown token! This is normal during server restarts. Reconnecting them.",
+        )
+    finally:
+        # Unlock token
+        if userToken is not None:
+            # Update ping time for timeout
+            userToken.updatePingTime()
+            # Release processing lock
+            if not settings.HTTP_ASYNC_MODE:
+                userToken.processingLock.release()
+            # Delete token if kicked
+            if userToken.kicked:
+                with redisBatch.batch():
+                    glob.tokens.deleteToken(userToken)
+
+    return responseTokenString, responseData
+
+
 class handler(requestsManager.asyncRequestHandler):
-    @tornado.web.asynchronous
-    @tornado.gen.engine
+    @tornado.gen.coroutine
     def asyncPost(self):
 
         # Client's token string and request data
@@ -134,81 +217,29 @@ class handler(requestsManager.asyncRequestHandler):
 
         if requestTokenString is None:
             # No token, first request. Handle login.
-            responseTokenString, responseData = loginEvent.handle(self)
+            # Its queries and the password check are yielded to the executor.
+            responseTokenString, responseData = yield loginEvent.handle(self)
         else:
-            userToken = None
-            try:
-                # This is not the first packet, send response based on client's request
-                # Packet start position, used to read stacked packets
-                pos = 0
-
-                # Make sure the token exists
-                if requestTokenString not in glob.tokens.tokens:
-                    raise exceptions.tokenNotFoundException()
-
-                # Token exists, get its object and lock it
-                userToken = glob.tokens.tokens[requestTokenString]
-                userToken.processingLock.acquire()
-
-                # Keep reading packets until everything has been read
-                while pos < len(requestData):
-                    # Get packet from stack starting from new packet
-                    leftData = requestData[pos:]
-
-                    # Get packet ID, data length and data
-                    packetID = packetHelper.readPacketID(leftData)
-                    dataLength = packetHelper.readPacketLength(leftData)
-                    packetData = requestData[pos : (pos + dataLength + 7)]
-
-                    # Process/ignore packet
-                    if packetID != 4:
-                        if packetID in eventHandler:
-                            if not userToken.restricted or (
-                                userToken.restricted and packetID in packetsRestricted
-                            ):
-                                eventHandler[packetID].handle(userToken, packetData)
-                            else:
-                                log.warning(
-                                    "Ignored packet id from {} ({}) (user is restricted)".format(
-                                        requestTokenString,
-                                        packetID,
-                                    ),
-                                )
-                        else:
-                            log.warning(
-                                "Unknown packet id from {} ({})".format(
-                                    requestTokenString,
-                                    packetID,
-                                ),
-                            )
-
-                    # Update pos so we can read the next stacked packet
-                    # +7 because we add packet ID bytes, unused byte and data length bytes
-                    pos += dataLength + 7
-
-                # Token queue built, send it
-                responseTokenString = userToken.token
-                responseData = userToken.fetch_queue()
-            except exceptions.tokenNotFoundException:
-                # Token not found. Get the user to be reconnected.
-                responseData = serverPackets.server_restart(1)
-                responseData += serverPackets.notification(
-                    f"You don't seem to be logged into {settings.PS_NAME} anymore... "
-                    "This is common during server restarts, trying to log you back in.",
+            forwarded = None
+            if glob.worker_bus is not None:
+                # Sent to the worker that owns the token, if it's not this one
+                try:
+                    forwards = int(self.request.headers.get(FORWARDS_HEADER, 0))
+                except ValueError:
+                    forwards = 0
+                forwarded = yield glob.worker_bus.routeRequest(
+                    requestTokenString,
+                    requestData,
+                    forwards,
                 )
-                log.warning(
-                    "Received unknown token! This is normal during server restarts. Reconnecting them.",
+
+            if forwarded is not None:
+                responseTokenString, responseData = forwarded
+            else:
+                responseTokenString, responseData = handlePackets(
+                    requestTokenString,
+                    requestData,
                 )
-            finally:
-                # Unlock token
-                if userToken is not None:
-                    # Update ping time for timeout
-                    userToken.updatePingTime()
-                    # Release processing lock
-                    userToken.processingLock.release()
-                    # Delete token if kicked
-                    if userToken.kicked:
-                        glob.tokens.deleteToken(userToken)
 
         # Send server's response to client
         # We don't use token object because we might not have a token (failed login)
@@ -223,8 +254,6 @@ class handler(requestsManager.asyncRequestHandler):
         self.add_header("Keep-Alive", "timeout=5, max=100")
         self.add_header("Content-Type", "text/html; charset=UTF-8")
 
-    @tornado.web.asynchronous
-    @tornado.gen.engine
     def asyncGet(self):
         # We are updating this to be full stealth
         self.write(
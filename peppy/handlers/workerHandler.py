@@ -0,0 +1,15 @@
+from __future__ import annotations
+
+import json
+
+from common.web import requestsManager
+from objects import glob
+
+
+# Tokens moved here by the other workers, see `WorkerBus.moveToHub`.
+# Only served on the private port of the worker.
+class handler(requestsManager.asyncRequestHandler):
+    def asyncPost(self):
+        data = json.loads(self.request.body)
+        glob.worker_bus.adoptToken(data["token"], data["state"])
+        self.write("ok")
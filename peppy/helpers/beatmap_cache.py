@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from logger import log
+from objects import glob
+
+# Most beatmaps kept parsed in memory, and most song names kept.
+BEATMAP_CACHE_SIZE = 512
+SONG_CACHE_SIZE = 4096
+
+# Header of the persisted hit object files: .osu mtime (ns) and object count,
+# followed by the start times as native int32s.
+_PERSISTED_HEADER = struct.Struct("<qI")
+
+
+@dataclass(frozen=True)
+class BeatmapObjects:
+    mtime_ns: int
+    start_times: array
+
+    @property
+    def object_count(self) -> int:
+        return len(self.start_times)
+
+    @property
+    def length(self) -> int:
+        """Milliseconds between the first and the last hit object."""
+
+        if not self.start_times:
+            return 0
+        return self.start_times[-1] - self.start_times[0]
+
+
+def _parse_start_times(path: str) -> array:
+    """Reads the hit object start times of an .osu file, skipping everything else."""
+
+    start_times = array("i")
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            if line.startswith("[HitObjects]"):
+                break
+
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("["):
+                break
+
+            start_times.append(int(float(line.split(",", 3)[2])))
+
+    return start_times
+
+
+class BeatmapCache:
+    """Keeps what the bot needs to know about beatmaps, so commands don't have
+    to parse .osu files or query MySQL every time.
+
+    Hit objects are keyed by beatmap ID and checked against the .osu file's
+    mtime. When `persist_directory` is set they are also saved there as raw
+    arrays, which can be loaded (or memory mapped) without parsing.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        persist_directory: Optional[str] = None,
+        size: int = BEATMAP_CACHE_SIZE,
+        song_size: int = SONG_CACHE_SIZE,
+    ) -> None:
+        self.directory = directory
+        self.persist_directory = persist_directory
+        if persist_directory is not None:
+            os.makedirs(persist_directory, exist_ok=True)
+
+        self._size = size
+        self._song_size = song_size
+        self._lock = threading.Lock()
+        self._objects: OrderedDict[int, BeatmapObjects] = OrderedDict()
+        self._songs: OrderedDict[int, tuple[str, int]] = OrderedDict()
+
+    def objects(self, beatmap_id: int) -> BeatmapObjects:
+        """Returns the hit objects of a beatmap, parsing its .osu file if needed.
+
+        Raises:
+            OSError: if the .osu file can't be read.
+        """
+
+        beatmap_id = int(beatmap_id)
+        path = f"{self.directory}/{beatmap_id}.osu"
+        mtime_ns = os.stat(path).st_mtime_ns
+
+        with self._lock:
+            cached = self._objects.get(beatmap_id)
+            if cached is not None and cached.mtime_ns == mtime_ns:
+                self._objects.move_to_end(beatmap_id)
+                return cached
+
+        beatmap = self._load_persisted(beatmap_id, mtime_ns)
+        if beatmap is None:
+            beatmap = BeatmapObjects(mtime_ns, _parse_start_times(path))
+            self._persist(beatmap_id, beatmap)
+
+        with self._lock:
+            self._objects[beatmap_id] = beatmap
+            self._objects.move_to_end(beatmap_id)
+            while len(self._objects) > self._size:
+                self._objects.popitem(last=False)
+
+        return beatmap
+
+    def song(self, beatmap_id: int) -> Optional[tuple[str, int]]:
+        """Returns the song name and beatmap set ID of a beatmap,
+        or None if it's not in the database."""
+
+        beatmap_id = int(beatmap_id)
+        with self._lock:
+            cached = self._songs.get(beatmap_id)
+            if cached is not None:
+                self._songs.move_to_end(beatmap_id)
+                return cached
+
+        beatmap = glob.db.fetch(
+            "SELECT song_name, beatmapset_id FROM beatmaps WHERE beatmap_id = %s LIMIT 1",
+            [beatmap_id],
+        )
+        if beatmap is None:
+            return None
+
+        song = (beatmap["song_name"], beatmap["beatmapset_id"])
+        with self._lock:
+            self._songs[beatmap_id] = song
+            while len(self._songs) > self._song_size:
+                self._songs.popitem(last=False)
+
+        return song
+
+    def _persisted_path(self, beatmap_id: int) -> str:
+        return f"{self.persist_directory}/{beatmap_id}.bin"
+
+    def _load_persisted(
+        self,
+        beatmap_id: int,
+        mtime_ns: int,
+    ) -> Optional[BeatmapObjects]:
+        if self.persist_directory is None:
+            return None
+
+        try:
+            with open(self._persisted_path(beatmap_id), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            persisted_mtime_ns, count = _PERSISTED_HEADER.unpack_from(data)
+            start_times = array("i")
+            start_times.frombytes(data[_PERSISTED_HEADER.size :])
+        except (struct.error, ValueError):
+            return None
+
+        if persisted_mtime_ns != mtime_ns or len(start_times) != count:
+            return None
+
+        return BeatmapObjects(mtime_ns, start_times)
+
+    def _persist(self, beatmap_id: int, beatmap: BeatmapObjects) -> None:
+        if self.persist_directory is None:
+            return
+
+        path = self._persisted_path(beatmap_id)
+        try:
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(_PERSISTED_HEADER.pack(beatmap.mtime_ns, beatmap.object_count))
+                f.write(beatmap.start_times.tobytes())
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            log.warning(
+                f"Failed to save the hit objects of beatmap {beatmap_id}: {e!r}"
+            )
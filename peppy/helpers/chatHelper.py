@@ -7,6 +7,7 @@ from typing import Union
 
 import settings
 from common.ripple import userUtils
+from common.web import requestsManager
 from constants import exceptions
 from constants import serverPackets
 from events import logoutEvent
@@ -187,7 +188,12 @@ def partChannel(
 
 
 def log_message_db(fro: UserToken, to_id: Union[int, str], content: str) -> None:
-    """Logs the message to the database."""
+    """Logs the message to the database. Queued to the chat log writer if it's
+    running, otherwise written straight away."""
+
+    if glob.chat_log_writer is not None:
+        glob.chat_log_writer.log(fro.userID, to_id, content)
+        return
 
     if isinstance(to_id, str):
         # Channel Message.
@@ -204,6 +210,15 @@ def log_message_db(fro: UserToken, to_id: Union[int, str], content: str) -> None
     redis_notify_new_msg(fro.userID, to_id, content)
 
 
+def log_offline_message(fro: UserToken, to: str, content: str) -> None:
+    """Logs a private message sent to an offline user. Looks their ID up,
+    so it blocks."""
+
+    user_id = userUtils.getID(to)
+    if user_id:
+        log_message_db(fro, user_id, content)
+
+
 def redis_notify_new_msg(fro: int, to: Union[int, str], content: str) -> None:
     """Notifies the api of a new message."""
 
@@ -310,7 +325,7 @@ def sendMessage(fro="", to="", message="", token=None, toIRC=True):
             token.addMessageInBuffer(to, message)
 
             # Everything seems fine, build recipients list and send packet
-            glob.streams.broadcast(f"chat/{to}", packet, but=[token.token])
+            glob.streams.broadcast(f"chat/{to}", packet, but={token.token})
             # Log the message to db and api.
             # These channels can overlap and overall are meant to be temporary.
             if toClient not in ("#multiplayer", "#spectator"):
@@ -320,9 +335,8 @@ def sendMessage(fro="", to="", message="", token=None, toIRC=True):
             # Make sure recipient user is connected
             recipientToken = glob.tokens.getTokenFromUsername(to)
             if recipientToken is None:
-                user_id = userUtils.getID(to)
-                if user_id:
-                    log_message_db(token, user_id, message)
+                # Still log it for when they're back, their ID is looked up off the loop
+                requestsManager.runDetached(log_offline_message, token, to, message)
                 raise exceptions.userNotFoundException()
 
             # Make sure the recipient is not a tournament client
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import json
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+from typing import Union
+
+from logger import log
+from objects import glob
+
+# Most messages waiting to be written. Past this, senders wait up to
+# `ENQUEUE_TIMEOUT` seconds for room before the message is dropped from the log.
+MAX_QUEUED_MESSAGES = 10_000
+ENQUEUE_TIMEOUT = 0.5
+
+# Pending messages are written once there are this many of them,
+# or once the oldest has waited this many seconds.
+FLUSH_ROWS = 200
+FLUSH_INTERVAL = 0.25
+
+
+@dataclass
+class ChatLogEntry:
+    user_id: int
+    target: Union[int, str]
+    content: str
+
+
+class ChatLogWriter:
+    """Writes chat logs (and their API notifications) in the background,
+    as multi-row INSERTs and one pipelined redis call per flush."""
+
+    def __init__(self) -> None:
+        self._queue: queue.Queue[ChatLogEntry] = queue.Queue(MAX_QUEUED_MESSAGES)
+        self._closing = threading.Event()
+        self._thread = threading.Thread(
+            target=self._writeLoop,
+            name="chat-log-writer",
+            daemon=True,
+        )
+
+        # Metrics
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.lastFlushTime = 0.0
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def log(self, user_id: int, target: Union[int, str], content: str) -> None:
+        """Queues a message to be logged. Channel messages have a `str` target,
+        private messages the recipient's user ID."""
+
+        try:
+            self._queue.put(
+                ChatLogEntry(user_id, target, content),
+                timeout=ENQUEUE_TIMEOUT,
+            )
+        except queue.Full:
+            self.dropped += 1
+            log.warning(
+                f"Chat log queue is full, dropped a message from user {user_id}.",
+            )
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_time": self.lastFlushTime,
+        }
+
+    def close(self, timeout: float = 10) -> None:
+        """Writes every queued message and stops the writer. Call on shutdown."""
+
+        self._closing.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _writeLoop(self) -> None:
+        while not self._closing.is_set() or not self._queue.empty():
+            batch = []
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < FLUSH_ROWS:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0 and not self._closing.is_set():
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: list[ChatLogEntry]) -> None:
+        start = time.perf_counter()
+        channelRows = [i for i in batch if isinstance(i.target, str)]
+        privateRows = [i for i in batch if not isinstance(i.target, str)]
+        try:
+            if channelRows:
+                glob.db.execute(
+                    "INSERT INTO chat_chan_logs (user_id, target_chan, content) VALUES "
+                    + ",".join(["(%s,%s,%s)"] * len(channelRows)),
+                    [v for i in channelRows for v in (i.user_id, i.target, i.content)],
+                )
+            if privateRows:
+                glob.db.execute(
+                    "INSERT INTO chat_logs (user_id, target_id, content) VALUES "
+                    + ",".join(["(%s,%s,%s)"] * len(privateRows)),
+                    [v for i in privateRows for v in (i.user_id, i.target, i.content)],
+                )
+        except Exception as e:
+            self.failed += len(batch)
+            log.error(f"Failed to write {len(batch)} chat log messages: {e!r}")
+            return
+
+        try:
+            pipe = glob.redis.pipeline(transaction=False)
+            for i in batch:
+                pipe.publish(
+                    "rosu:new_message_notify",
+                    json.dumps(
+                        {
+                            "user_id": i.user_id,
+                            "target": i.target,
+                            "content": i.content,
+                        },
+                    ),
+                )
+            pipe.execute()
+        except Exception as e:
+            log.error(f"Failed to notify the API of {len(batch)} messages: {e!r}")
+
+        self.written += len(batch)
+        self.flushes += 1
+        self.lastFlushTime = time.perf_counter() - start
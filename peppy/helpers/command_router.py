@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from typing import Callable
+from typing import Optional
+from typing import TYPE_CHECKING
+
+from logger import log
+
+if TYPE_CHECKING:
+    from constants.fokabotCommands import Command
+
+# Only messages starting with one of these can trigger a command
+COMMAND_PREFIXES = ("!", "\x01")
+
+# Threads running slow commands, and how many slow commands may be
+# running or waiting at once, in total and per user.
+SLOW_COMMAND_WORKERS = 4
+MAX_SLOW_COMMANDS = 32
+MAX_SLOW_COMMANDS_PER_USER = 1
+
+
+@dataclass
+class CommandMetrics:
+    runs: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+
+@dataclass
+class _Node:
+    command: Optional[Command] = None
+    children: dict[str, _Node] = field(default_factory=dict)
+
+
+class CommandRouter:
+    """Finds the command triggered by a chat message.
+
+    Triggers are stored as a tree of words, so `!system restart` is a child
+    of `!system`. A message is split once and its words are walked down the
+    tree; the longest trigger it starts with wins.
+    """
+
+    def __init__(self) -> None:
+        self._root: dict[str, _Node] = {}
+        self._depth = 0
+        self._metrics: dict[str, CommandMetrics] = {}
+
+    def add(self, command: Command) -> None:
+        words = command.trigger.split(" ")
+        self._depth = max(self._depth, len(words))
+
+        children = self._root
+        for word in words:
+            node = children.setdefault(word, _Node())
+            children = node.children
+
+        node.command = command
+
+    def match(self, message: str) -> Optional[Command]:
+        if not message.startswith(COMMAND_PREFIXES):
+            return None
+
+        command = None
+        children = self._root
+        # Only split as many words as the longest trigger has
+        for word in message.split(" ", self._depth)[: self._depth]:
+            node = children.get(word)
+            if node is None:
+                break
+
+            if node.command is not None:
+                command = node.command
+            children = node.children
+
+        return command
+
+    def record(self, trigger: str, elapsed: float, failed: bool = False) -> None:
+        """Records a run of the command `trigger` that took `elapsed` seconds."""
+
+        metrics = self._metrics.get(trigger)
+        if metrics is None:
+            metrics = self._metrics[trigger] = CommandMetrics()
+
+        metrics.runs += 1
+        metrics.errors += failed
+        metrics.total_time += elapsed
+        metrics.max_time = max(metrics.max_time, elapsed)
+
+    def metrics(self) -> dict[str, Any]:
+        return {trigger: asdict(i) for trigger, i in self._metrics.items()}
+
+
+class SlowCommandExecutor:
+    """Runs slow commands (HTTP calls, beatmap parsing...) on a small thread
+    pool, so they don't hold the request thread. Limits how many can be
+    running or waiting, in total and per user; past them new ones are refused.
+    """
+
+    def __init__(
+        self,
+        workers: int = SLOW_COMMAND_WORKERS,
+        max_pending: int = MAX_SLOW_COMMANDS,
+        max_pending_per_user: int = MAX_SLOW_COMMANDS_PER_USER,
+    ) -> None:
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="bot-command")
+        self._max_pending = max_pending
+        self._max_pending_per_user = max_pending_per_user
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._userPending: dict[str, int] = {}
+
+        # Metrics
+        self.rejected = 0
+
+    def submit(
+        self,
+        user: str,
+        func: Callable[..., Any],
+        *args,
+        callback: Callable[[Any], None],
+    ) -> bool:
+        """Runs `func(*args)` in the background and calls `callback` with its
+        result. Returns False if `user` or the bot are over their limit."""
+
+        with self._lock:
+            userPending = self._userPending.get(user, 0)
+            if (
+                self._pending >= self._max_pending
+                or userPending >= self._max_pending_per_user
+            ):
+                self.rejected += 1
+                return False
+
+            self._pending += 1
+            self._userPending[user] = userPending + 1
+
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda f: self._done(user, f, callback))
+        return True
+
+    def metrics(self) -> dict[str, int]:
+        return {"pending": self._pending, "rejected": self.rejected}
+
+    def _done(
+        self,
+        user: str,
+        future: Future,
+        callback: Callable[[Any], None],
+    ) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._userPending[user] -= 1
+            if not self._userPending[user]:
+                del self._userPending[user]
+
+        try:
+            callback(future.result())
+        except Exception as e:
+            log.error(f"Failed to reply to a bot command: {e!r}")
@@ -1,9 +1,37 @@
 from __future__ import annotations
 
 import struct
+from functools import lru_cache
+from typing import Any
+from typing import Iterator
+from typing import Sequence
 
 from constants import dataTypes
 
+# Struct format characters of every fixed size data type.
+_FIXED_FORMATS = {
+    dataTypes.BYTE: "B",
+    dataTypes.UINT16: "H",
+    dataTypes.SINT16: "h",
+    dataTypes.UINT32: "I",
+    dataTypes.SINT32: "i",
+    dataTypes.UINT64: "Q",
+    dataTypes.SINT64: "q",
+    dataTypes.FFLOAT: "f",
+}
+
+# Segment kind used for runs of consecutive fixed size fields.
+_FIXED_SEGMENT = -1
+
+# packet id (int16), unused byte, packet data length (int32)
+_HEADER = struct.Struct("<hxi")
+
+# Same as above, as read from client packets (unsigned).
+_CLIENT_HEADER = struct.Struct("<HxI")
+
+# Packet ID alone, to rewrite the header of relayed packets.
+_RELAY_ID = struct.Struct("<h")
+
 
 def uleb128Encode(num: int) -> bytearray:
     """
@@ -28,11 +56,12 @@ def uleb128Encode(num: int) -> bytearray:
     return arr
 
 
-def uleb128Decode(num: bytes) -> tuple[int, int]:
+def uleb128Decode(num: bytes, offset: int = 0) -> tuple[int, int]:
     """
     Decode a uleb128 to int
 
     :param num: encoded uleb128 int
+    :param offset: position of the first uleb128 byte in `num`. Default: 0
     :return: (total, length)
     """
 
@@ -41,7 +70,7 @@ def uleb128Decode(num: bytes) -> tuple[int, int]:
     length = 0
 
     while True:
-        b = num[length]
+        b = num[offset + length]
         length += 1
         value |= int(b & 127) << shift
         if b & 128 == 0:
@@ -146,35 +175,215 @@ def packData(__data, dataType: int) -> bytes:
     return data
 
 
+def encodeString(s: str) -> bytes:
+    """
+    Encode a string the way osu! expects it (0x0B + uleb128 length + utf-8 data)
+
+    :param s: string to encode
+    :return: encoded string bytes
+    """
+    if not s:
+        return b"\x00"
+
+    data = s.encode("utf-8", "ignore")
+    return b"\x0b" + uleb128Encode(len(data)) + data
+
+
+def _compileSegments(types: Sequence[int]) -> tuple[tuple[int, Any, int], ...]:
+    """
+    Group a list of data types into segments. Consecutive fixed size types are
+    merged into a single `struct.Struct`, while strings, int lists and raw bytes
+    get a segment each.
+
+    :param types: data types of the packet fields, in order
+    :return: ((kind, struct or None, field count), ...)
+    """
+    segments = []
+    fmt = ""
+    count = 0
+
+    for dataType in types:
+        code = _FIXED_FORMATS.get(dataType)
+        if code is not None:
+            fmt += code
+            count += 1
+            continue
+
+        if count:
+            segments.append((_FIXED_SEGMENT, struct.Struct("<" + fmt), count))
+            fmt = ""
+            count = 0
+
+        segments.append((dataType, None, 1))
+
+    if count:
+        segments.append((_FIXED_SEGMENT, struct.Struct("<" + fmt), count))
+
+    return tuple(segments)
+
+
+class PacketStruct:
+    """
+    A precompiled server packet layout.
+    Fixed size fields are packed with cached `struct.Struct` objects and the whole
+    packet (header included) is written into a single preallocated buffer.
+    """
+
+    __slots__ = ("packetID", "_segments", "_fixed")
+
+    def __init__(self, packetID: int, types: Sequence[int] = ()) -> None:
+        """
+        Compile a packet layout
+
+        :param packetID: packet ID
+        :param types: data types of the packet fields, in order
+        """
+        self.packetID = packetID
+        self._segments = _compileSegments(types)
+
+        # Packets made only of fixed size fields are packed in one call.
+        self._fixed = None
+        if not self._segments:
+            self._fixed = _HEADER
+        elif len(self._segments) == 1 and self._segments[0][0] == _FIXED_SEGMENT:
+            self._fixed = struct.Struct(
+                _HEADER.format + self._segments[0][1].format[1:],
+            )
+
+    def build(self, *values) -> bytes:
+        """
+        Build the packet
+
+        :param values: packet field values, in the same order as the compiled types
+        :return: packet bytes
+        """
+        if self._fixed is not None:
+            return self._fixed.pack(self.packetID, self._fixed.size - 7, *values)
+
+        # Encode variable size fields first so we know the total length.
+        parts = []
+        size = 0
+        pos = 0
+        for kind, st, count in self._segments:
+            if kind == _FIXED_SEGMENT:
+                parts.append((st, values[pos : pos + count]))
+                size += st.size
+            elif kind == dataTypes.STRING:
+                data = encodeString(values[pos])
+                parts.append((None, data))
+                size += len(data)
+            elif kind == dataTypes.INT_LIST:
+                ints = values[pos]
+                data = struct.pack(f"<H{len(ints)}i", len(ints), *ints)
+                parts.append((None, data))
+                size += len(data)
+            else:
+                # BBYTES, written as they are
+                data = values[pos]
+                parts.append((None, data))
+                size += len(data)
+            pos += count
+
+        buffer = bytearray(7 + size)
+        _HEADER.pack_into(buffer, 0, self.packetID, size)
+        offset = 7
+        for st, data in parts:
+            if st is not None:
+                st.pack_into(buffer, offset, *data)
+                offset += st.size
+            else:
+                end = offset + len(data)
+                buffer[offset:end] = data
+                offset = end
+
+        return bytes(buffer)
+
+
+class PacketReader:
+    """
+    A precompiled client packet layout.
+    Fixed size fields are read with cached `struct.Struct` objects straight from
+    the packet buffer, without slicing it.
+    """
+
+    __slots__ = ("_names", "_segments")
+
+    def __init__(self, structure: Sequence[Sequence[Any]]) -> None:
+        """
+        Compile a packet layout
+
+        :param structure: packet structure: [[name, dataType], [name, dataType], ...]
+        """
+        self._names = tuple(i[0] for i in structure)
+        self._segments = _compileSegments([i[1] for i in structure])
+
+    def read(self, stream, hasFirstBytes: bool = True) -> dict[str, Any]:
+        """
+        Read packet data from `stream`
+
+        :param stream: packet bytes
+        :param hasFirstBytes:     if True, `stream` has packetID and length bytes.
+                                if False, `stream` has only packet data. Default: True
+        :return: {name: unpackedValue, ...}
+        """
+        offset = 7 if hasFirstBytes else 0
+        values = []
+
+        for kind, st, _ in self._segments:
+            if kind == _FIXED_SEGMENT:
+                values.extend(st.unpack_from(stream, offset))
+                offset += st.size
+            elif kind == dataTypes.STRING:
+                if stream[offset] == 0:
+                    # Empty string
+                    values.append("")
+                    offset += 1
+                else:
+                    length, lengthSize = uleb128Decode(stream, offset + 1)
+                    start = offset + 1 + lengthSize
+                    offset = start + length
+                    values.append(str(stream[start:offset], "utf-8"))
+            elif kind == dataTypes.INT_LIST:
+                length = struct.unpack_from("<H", stream, offset)[0]
+                values.append(
+                    list(struct.unpack_from(f"<{length}i", stream, offset + 2)),
+                )
+                offset += 2 + 4 * length
+            else:
+                # BBYTES, everything left
+                values.append(stream[offset:])
+                offset = len(stream)
+
+        return dict(zip(self._names, values))
+
+
+@lru_cache(maxsize=512)
+def _getPacketStruct(packetID: int, types: tuple[int, ...]) -> PacketStruct:
+    return PacketStruct(packetID, types)
+
+
+@lru_cache(maxsize=512)
+def _getPacketReader(structure: tuple[tuple[str, int], ...]) -> PacketReader:
+    return PacketReader(structure)
+
+
 def buildPacket(__packet: int, __packetData=None) -> bytes:
     """
-    Builds a packet
+    Builds a packet.
+    The layout is compiled once and cached, prefer a module level `PacketStruct`
+    for packets with a fixed layout.
 
     :param __packet: packet ID
     :param __packetData: packet structure [[data, dataType], [data, dataType], ...]
     :return: packet bytes
     """
     # Default argument
-    if __packetData is None:
-        __packetData = []
-    # Set some variables
-    packetData = b""
-    packetLength = 0
-    packetBytes = b""
-
-    # Pack packet data
-    for i in __packetData:
-        packetData += packData(i[0], i[1])
+    if not __packetData:
+        return _getPacketStruct(__packet, ()).build()
 
-    # Set packet length
-    packetLength = len(packetData)
-
-    # Return packet as bytes
-    packetBytes += struct.pack("<h", __packet)  # packet id (int16)
-    packetBytes += b"\x00"  # unused byte
-    packetBytes += struct.pack("<l", packetLength)  # packet lenght (iint32)
-    packetBytes += packetData  # packet data
-    return packetBytes
+    return _getPacketStruct(__packet, tuple(i[1] for i in __packetData)).build(
+        *(i[0] for i in __packetData),
+    )
 
 
 def readPacketID(stream: bytes) -> int:
@@ -197,9 +406,44 @@ def readPacketLength(stream: bytes) -> int:
     return unpackData(stream[3:7], dataTypes.UINT32)
 
 
+def iterPackets(data) -> Iterator[tuple[int, memoryview]]:
+    """
+    Iterate over the stacked packets of a request body without copying it.
+    Every yielded view spans a whole packet, header included, so it can be
+    passed to the `clientPackets` readers as it is.
+
+    :param data: request body
+    :return: iterator of (packetID, packet view)
+    """
+    view = memoryview(data)
+    pos = 0
+    end = len(view)
+
+    while pos < end:
+        packetID, dataLength = _CLIENT_HEADER.unpack_from(view, pos)
+        packetEnd = pos + dataLength + 7
+        yield packetID, view[pos:packetEnd]
+        pos = packetEnd
+
+
+def relayPacket(packetID: int, packet: memoryview) -> bytes:
+    """
+    Build a server packet carrying the payload of a client packet as it is.
+    Only the packet ID is rewritten, the length and payload are copied once.
+
+    :param packetID: server packet ID
+    :param packet: whole client packet, header included (see `iterPackets`)
+    :return: packet bytes
+    """
+    return b"".join((_RELAY_ID.pack(packetID), b"\x00", packet[3:]))
+
+
 def readPacketData(stream: bytes, structure=None, hasFirstBytes=True):
     """
-    Read packet data from `stream` according to `structure`
+    Read packet data from `stream` according to `structure`.
+    The layout is compiled once and cached, prefer a module level `PacketReader`
+    for packets with a fixed layout.
+
     :param stream: packet bytes
     :param structure: packet structure: [[name, dataType], [name, dataType], ...]
     :param hasFirstBytes:     if True, `stream` has packetID and length bytes.
@@ -207,72 +451,8 @@ def readPacketData(stream: bytes, structure=None, hasFirstBytes=True):
     :return: {name: unpackedValue, ...}
     """
     # Default list argument
-    if structure is None:
-        structure = []
+    if not structure:
+        return {}
 
-    # Read packet ID (first 2 bytes)
-    data = {}
-
-    # Skip packet ID and packet length if needed
-    if hasFirstBytes:
-        end = 7
-        start = 7
-    else:
-        end = 0
-        start = 0
-
-    # Read packet
-    for i in structure:
-        start = end
-        unpack = True
-        if i[1] == dataTypes.INT_LIST:
-            # sInt32 list.
-            # Unpack manually with for loop
-            unpack = False
-
-            # Read length (uInt16)
-            length = unpackData(stream[start : start + 2], dataTypes.UINT16)
-
-            # Read all int inside list
-            data[i[0]] = []
-            for j in range(0, length):
-                data[i[0]].append(
-                    unpackData(
-                        stream[start + 2 + (4 * j) : start + 2 + (4 * (j + 1))],
-                        dataTypes.SINT32,
-                    ),
-                )
-
-            # Update end
-            end = start + 2 + (4 * length)
-        elif i[1] == dataTypes.STRING:
-            # String, don't unpack
-            unpack = False
-
-            # Check empty string
-            if stream[start] == 0:
-                # Empty string
-                data[i[0]] = ""
-                end = start + 1
-            else:
-                # Non empty string
-                # Read length and calculate end
-                length = uleb128Decode(stream[start + 1 :])
-                end = start + length[0] + length[1] + 1
-
-                # Read bytes
-                data[i[0]] = stream[start + 1 + length[1] : end].decode()
-        elif i[1] == dataTypes.BYTE:
-            end = start + 1
-        elif i[1] in (dataTypes.UINT16, dataTypes.SINT16):
-            end = start + 2
-        elif i[1] in (dataTypes.UINT32, dataTypes.SINT32, dataTypes.FFLOAT):
-            end = start + 4
-        elif i[1] in (dataTypes.UINT64, dataTypes.SINT64):
-            end = start + 8
-
-        # Unpack if needed
-        if unpack:
-            data[i[0]] = unpackData(stream[start:end], i[1])
-
-    return data
+    reader = _getPacketReader(tuple((i[0], i[1]) for i in structure))
+    return reader.read(stream, hasFirstBytes)
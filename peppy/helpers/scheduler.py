@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from logger import log
+
+
+@dataclass
+class JobMetrics:
+    runs: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    last_time: float = 0.0
+    max_time: float = 0.0
+
+
+class ScheduledJob:
+    """A call waiting in a `Scheduler`. Periodic jobs have an `interval`."""
+
+    __slots__ = ("name", "func", "args", "interval", "deadline", "cancelled")
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        args: tuple,
+        interval: Optional[float],
+        deadline: float,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.args = args
+        self.interval = interval
+        self.deadline = deadline
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """Stops the job from running (again). Cancelled jobs are dropped
+        from the scheduler once their deadline is reached."""
+
+        self.cancelled = True
+
+
+class Scheduler:
+    """Runs delayed and periodic jobs on a single thread, in deadline order.
+
+    Jobs are kept in a heap, so the thread only wakes up when one is due.
+    Jobs should be short, as they delay every job due after them. Run times
+    are recorded per job name, see `metrics`. Due jobs can be handed to
+    another thread instead, see `runJobsWith`.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, ScheduledJob]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(
+            target=self._runLoop,
+            name="scheduler",
+            daemon=True,
+        )
+        self._metrics: dict[str, JobMetrics] = {}
+        self._runner: Optional[Callable[..., None]] = None
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def runJobsWith(self, runner: Callable[..., None]) -> None:
+        """Hands due jobs to `runner(func, *args)` rather than running them on
+        the scheduler thread, eg. `requestsManager.runOnLoop` in async mode."""
+
+        self._runner = runner
+
+    def schedule(
+        self,
+        delay: float,
+        func: Callable[..., Any],
+        *args,
+        name: Optional[str] = None,
+    ) -> ScheduledJob:
+        """Calls `func(*args)` once, in `delay` seconds."""
+
+        job = ScheduledJob(
+            name or func.__qualname__,
+            func,
+            args,
+            None,
+            time.monotonic() + delay,
+        )
+        self._push(job)
+        return job
+
+    def every(
+        self,
+        interval: float,
+        func: Callable[..., Any],
+        *args,
+        name: Optional[str] = None,
+    ) -> ScheduledJob:
+        """Calls `func(*args)` every `interval` seconds, the first time in
+        `interval` seconds. Exceptions are logged and don't stop the job."""
+
+        job = ScheduledJob(
+            name or func.__qualname__,
+            func,
+            args,
+            interval,
+            time.monotonic() + interval,
+        )
+        self._push(job)
+        return job
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "queued": len(self._heap),
+            "jobs": {name: asdict(i) for name, i in self._metrics.items()},
+        }
+
+    def close(self) -> None:
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+
+    def _push(self, job: ScheduledJob) -> None:
+        with self._condition:
+            heapq.heappush(self._heap, (job.deadline, next(self._sequence), job))
+            # Wake the thread up if this job is now the first one due
+            if self._heap[0][2] is job:
+                self._condition.notify()
+
+    def _runLoop(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._closing:
+                        return
+
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+
+                    remaining = self._heap[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        job = heapq.heappop(self._heap)[2]
+                        break
+
+                    self._condition.wait(remaining)
+
+            if job.cancelled:
+                continue
+
+            if self._runner is None:
+                self._run(job)
+            else:
+                self._runner(self._run, job)
+
+            if job.interval is not None and not job.cancelled:
+                job.deadline = max(job.deadline + job.interval, time.monotonic())
+                self._push(job)
+
+    def _run(self, job: ScheduledJob) -> None:
+        metrics = self._metrics.get(job.name)
+        if metrics is None:
+            metrics = self._metrics[job.name] = JobMetrics()
+
+        start = time.perf_counter()
+        try:
+            job.func(*job.args)
+        except Exception as e:
+            metrics.errors += 1
+            log.error(f"Scheduled job {job.name} failed: {e!r}")
+
+        elapsed = time.perf_counter() - start
+        metrics.runs += 1
+        metrics.total_time += elapsed
+        metrics.last_time = elapsed
+        metrics.max_time = max(metrics.max_time, elapsed)
@@ -4,15 +4,18 @@ import math
 import os
 import signal
 import sys
-import threading
 import time
 
 import psutil
+from common.redis import redisBatch
 from constants import serverPackets
 from helpers import consoleHelper
 from logger import log
 from objects import glob
 
+# Exit code of the workers that exit to restart pep.py, see `forkWorkers`
+WORKER_RESTART_EXIT_CODE = 75
+
 
 def dispose():
     """
@@ -21,6 +24,24 @@ def dispose():
     :return:
     """
     print("> Disposing server... ")
+
+    # Write the chat logs that are still queued
+    if glob.chat_log_writer is not None:
+        glob.chat_log_writer.close()
+
+    # Run the deferred database writes (login audit logs...).
+    # `glob.db` isn't set if the server failed to connect.
+    db = getattr(glob, "db", None)
+    if db is not None:
+        db.close()
+
+    # Send the redis batches still queued (async mode) and the pending counter increments
+    redisBatch.waitForBatches()
+    redisBatch.flushCounters()
+
+    # Stop running delayed and periodic jobs
+    glob.scheduler.close()
+
     log.info(f"Server closing! Bye!")
 
 
@@ -57,21 +78,31 @@ def scheduleShutdown(sendRestartTime, restart, message="", delay=20):
         glob.streams.broadcast("main", serverPackets.notification(message))
 
     # Schedule server restart packet
-    threading.Timer(
+    glob.scheduler.schedule(
         sendRestartTime,
         glob.streams.broadcast,
-        ["main", serverPackets.server_restart(delay * 2 * 1000)],
-    ).start()
-    glob.restarting = True
-
-    # Restart/shutdown
-    if restart:
-        action = restartServer
-    else:
-        action = shutdownServer
+        "main",
+        serverPackets.server_restart(delay * 2 * 1000),
+        name="server restart packet",
+    )
 
     # Schedule actual server shutdown/restart some seconds after server restart packet, so everyone gets it
-    threading.Timer(sendRestartTime + delay, action).start()
+    scheduleStop(sendRestartTime + delay, restart)
+    if glob.worker_bus is not None:
+        glob.worker_bus.scheduleShutdown(sendRestartTime + delay, restart)
+
+
+def scheduleStop(delay, restart):
+    """
+    Stop or restart this process in `delay` seconds, without warning anyone
+
+    :param delay: delay in seconds
+    :param restart: if True, server will restart. if False, server will shudown
+    :return:
+    """
+    glob.restarting = True
+    action = restartServer if restart else shutdownServer
+    glob.scheduler.schedule(delay, action, name="server restart")
 
 
 def restartServer():
@@ -82,6 +113,9 @@ def restartServer():
     """
     log.info("Restarting pep.py...")
     dispose()
+    if glob.worker_bus is not None:
+        # The supervisor restarts pep.py once every worker has exited
+        os._exit(WORKER_RESTART_EXIT_CODE)
     os.execv(sys.executable, [sys.executable] + sys.argv)
 
 
@@ -93,10 +127,73 @@ def shutdownServer():
     """
     log.info("Shutting down pep.py...")
     dispose()
+    if glob.worker_bus is not None:
+        os._exit(0)
     sig = signal.SIGKILL if runningUnderUnix() else signal.CTRL_C_EVENT
     os.kill(os.getpid(), sig)
 
 
+def forkWorkers(count):
+    """
+    Fork `count` worker processes, and supervise them until they have all
+    exited. Workers that crash are forked again, with the same ID.
+    Only the workers return from this. The supervisor restarts pep.py if
+    a worker exited to restart it (see `restartServer`), or exits.
+
+    :param count: number of workers
+    :return: ID of the worker, from 0 to `count` - 1
+    """
+    workers = {}
+    stopping = False
+
+    def fork(workerID):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            return True
+        workers[pid] = workerID
+        return False
+
+    def stop(signum, _):
+        nonlocal stopping
+        stopping = True
+        for pid in tuple(workers):
+            os.kill(pid, signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    for workerID in range(count):
+        if fork(workerID):
+            return workerID
+
+    restart = False
+    while workers:
+        try:
+            pid, status = os.wait()
+        except KeyboardInterrupt:
+            # The workers got it too
+            stopping = True
+            continue
+
+        workerID = workers.pop(pid, None)
+        if workerID is None:
+            continue
+
+        exitCode = os.waitstatus_to_exitcode(status)
+        if exitCode == WORKER_RESTART_EXIT_CODE:
+            restart = stopping = True
+        elif exitCode == 0:
+            stopping = True
+        elif not stopping:
+            log.error(f"Worker {workerID} exited with {exitCode}, restarting it")
+            if fork(workerID):
+                return workerID
+
+    if restart:
+        log.info("Restarting pep.py...")
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+    sys.exit(0)
+
+
 def getSystemInfo():
     """
     Get a dictionary with some system/server info
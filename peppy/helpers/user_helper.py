@@ -1,8 +1,31 @@
 from __future__ import annotations
 
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
 import bcrypt
 from objects import glob
 
+# Successful verifications are cached by bcrypt hash, for at most this many
+# users and this many seconds.
+PASSWORD_CACHE_SIZE = 4096
+PASSWORD_CACHE_TTL = 60 * 60
+
+# The cache stores keyed digests of the MD5s, never the MD5s themselves.
+# The key lives only in this process, so the digests are useless elsewhere.
+_password_digest_key = secrets.token_bytes(32)
+_password_cache: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+_password_cache_lock = threading.Lock()
+
+
+def _password_digest(password: str) -> bytes:
+    return hmac.digest(_password_digest_key, password.encode(), hashlib.sha256)
+
 
 def username_safe(s: str) -> str:
     """Returns safe to use username."""
@@ -10,9 +33,14 @@ def username_safe(s: str) -> str:
     return s.lower().strip().replace(" ", "_")
 
 
-def verify_password(user_id: int, password: str) -> bool:
+def verify_password(
+    user_id: int,
+    password: str,
+    password_hash: Optional[str] = None,
+) -> bool:
     """Verifies if the provided username + password combination is correct,
-    providing a cache to ensure speed with bcrypt.
+    providing a bounded, expiring cache to ensure speed with bcrypt.
+    Uncached checks run on `glob.bcrypt_pool` when there is one.
 
     Note:
         This only supports Ripple Password v2 (MD5 + BCrypt) as no one in
@@ -21,21 +49,43 @@ def verify_password(user_id: int, password: str) -> bool:
     Args:
         user_id (int): The ID of the user within the database.
         password (str): The user's password hashed with MD5.
+        password_hash (str, optional): The user's stored bcrypt hash, if
+            already fetched. Fetched from the database if not provided.
     """
 
-    passw_db = glob.db.fetch(
-        "SELECT password_md5 FROM users WHERE id = %s LIMIT 1",
-        (user_id,),
-    )["password_md5"]
+    passw_db = password_hash
+    if passw_db is None:
+        passw_db = glob.db.fetch(
+            "SELECT password_md5 FROM users WHERE id = %s LIMIT 1",
+            (user_id,),
+        )["password_md5"]
 
     # Check if we already cached them, for speed benefit.
-    if passw_db in glob.cached_passwords:
-        return glob.cached_passwords[passw_db] == password
+    digest = _password_digest(password)
+    with _password_cache_lock:
+        cached = _password_cache.get(passw_db)
+        if cached is not None:
+            if cached[1] > time.monotonic():
+                _password_cache.move_to_end(passw_db)
+                return hmac.compare_digest(cached[0], digest)
+            del _password_cache[passw_db]
+
+    if glob.bcrypt_pool is not None:
+        res = glob.bcrypt_pool.submit(
+            bcrypt.checkpw,
+            password.encode(),
+            passw_db.encode(),
+        ).result()
+    else:
+        res = bcrypt.checkpw(password.encode(), passw_db.encode())
 
-    res = bcrypt.checkpw(password.encode(), passw_db.encode())
     # Cache it for later
     if res:
-        glob.cached_passwords[passw_db] = password
+        with _password_cache_lock:
+            _password_cache[passw_db] = (digest, time.monotonic() + PASSWORD_CACHE_TTL)
+            _password_cache.move_to_end(passw_db)
+            while len(_password_cache) > PASSWORD_CACHE_SIZE:
+                _password_cache.popitem(last=False)
 
     return res
 
@@ -0,0 +1,550 @@
+from __future__ import annotations
+
+import base64
+import json
+import threading
+from collections.abc import Iterable
+from typing import Any
+from typing import Callable
+from typing import Optional
+from typing import TYPE_CHECKING
+
+import settings
+import tornado.concurrent
+import tornado.gen
+import tornado.httpclient
+from common.redis import redisBatch
+from common.web import requestsManager
+from constants import clientPackets
+from constants import packetIDs
+from events import logoutEvent
+from helpers import packetHelper
+from helpers import systemHelper
+from logger import log
+from objects import glob
+from tornado.ioloop import IOLoop
+
+if TYPE_CHECKING:
+    from objects.osuToken import UserToken
+    from objects.remoteToken import RemoteToken
+
+BUS_CHANNEL = "peppy:worker_bus"
+
+# The worker owning every match, lobby member and spectator stream
+HUB_WORKER_ID = 0
+
+# Header with the number of times a client request has been forwarded
+FORWARDS_HEADER = "peppy-forwards"
+
+# A token may have moved again while a request (or call) was on its way to it,
+# so those can be forwarded once more, but no further.
+MAX_FORWARDS = 2
+
+# Seconds a forwarded request or a moved token may take to reach its worker
+FORWARD_TIMEOUT = 10
+
+# Seconds the hub waits for a token it asked for, see `WorkerBus.requestToken`
+MOVE_TIMEOUT = 10
+
+# Packets only the hub can handle, as they use matches, the lobby or spectating
+_HUB_PACKETS = frozenset(
+    (
+        packetIDs.client_startSpectating,
+        packetIDs.client_joinLobby,
+        packetIDs.client_createMatch,
+        packetIDs.client_joinMatch,
+        packetIDs.client_tournamentMatchInfoRequest,
+        packetIDs.client_tournamentJoinMatchChannel,
+    ),
+)
+
+# `UserToken` methods the other workers may call on the tokens of this one
+_TOKEN_CALLS = frozenset(
+    (
+        "kick",
+        "silence",
+        "setSilence",
+        "spamProtection",
+        "notify_restricted",
+        "notify_unrestricted",
+    ),
+)
+
+
+def isSharedStream(name: str) -> bool:
+    """Whether clients of every worker may be in the stream, so its broadcasts
+    are relayed to the other workers. The lobby, match and spectator streams
+    (and channels) only have clients on the hub."""
+
+    if name == "main":
+        return True
+    return name.startswith("chat/#") and not name.startswith(
+        ("chat/#multi_", "chat/#spect_"),
+    )
+
+
+def needsHub(requestData: bytes) -> bool:
+    """Whether a client request has packets only the hub can handle, including
+    the !mp bot commands."""
+
+    for packetID, packetData in packetHelper.iterPackets(requestData):
+        if packetID in _HUB_PACKETS:
+            return True
+
+        if packetID == packetIDs.client_sendPublicMessage:
+            message = clientPackets.sendPublicMessage(packetData)["message"]
+        elif packetID == packetIDs.client_sendPrivateMessage:
+            message = clientPackets.sendPrivateMessage(packetData)["message"]
+        else:
+            continue
+        if message.startswith("!mp"):
+            return True
+
+    return False
+
+
+class WorkerBus:
+    """Links the worker processes started with `HTTP_WORKER_COUNT` > 1.
+
+    Each token is owned by one worker, the others keep a `RemoteToken` copy
+    of it in `glob.tokens`, so every lookup finds every online user. Token
+    strings start with the ID of the worker that created them, so requests
+    are forwarded to the owner (found through the copies, or that prefix)
+    on its private port.
+
+    The workers talk through redis pubsub: owners share the state of their
+    tokens, calls on copies (enqueue, kick, silence...) are sent to owners,
+    and broadcasts of shared streams are relayed to everyone.
+
+    Matches, the lobby and spectating stay in one process, the hub. The token
+    of a user who needs them (see `needsHub`) is moved there for good.
+    """
+
+    def __init__(self, workerID: int) -> None:
+        self.workerID = workerID
+        self.tokenPrefix = f"w{workerID}."
+
+        self._http = tornado.httpclient.AsyncHTTPClient()
+        self._pubsub = glob.redis.pubsub(ignore_subscribe_messages=True)
+        self._thread = threading.Thread(
+            target=self._listen,
+            name="worker-bus",
+            daemon=True,
+        )
+
+        # Tokens whose state changed since it was last shared
+        self._changedTokens: dict[str, UserToken] = {}
+        self._changedLock = threading.Lock()
+
+        # Futures of the tokens being moved to the hub, by token string
+        self._moving: dict[str, tornado.concurrent.Future] = {}
+
+        # Hub only, callbacks waiting for the tokens it asked for
+        self._awaitedTokens: dict[str, list[Callable[[UserToken], None]]] = {}
+
+        # Metrics
+        self.sent = 0
+        self.received = 0
+        self.forwarded = 0
+        self.moved = 0
+
+    @property
+    def isHub(self) -> bool:
+        return self.workerID == HUB_WORKER_ID
+
+    def start(self) -> None:
+        """Starts listening, and asks the other workers for their tokens."""
+
+        self._pubsub.subscribe(BUS_CHANNEL, f"{BUS_CHANNEL}:{self.workerID}")
+        self._thread.start()
+        self._publish({"type": "hello"})
+
+    def newToken(self, token: str) -> str:
+        return self.tokenPrefix + token
+
+    def metrics(self) -> dict[str, int]:
+        return {
+            "worker_id": self.workerID,
+            "remote_tokens": sum(1 for i in glob.tokens.tokens.values() if i.remote),
+            "sent": self.sent,
+            "received": self.received,
+            "forwarded": self.forwarded,
+            "moved": self.moved,
+        }
+
+    # Token state
+
+    def shareToken(self, token: UserToken) -> None:
+        """Sends the shared state of a local token to the other workers.
+        Changes made in the same loop iteration are sent together."""
+
+        if token.userID == settings.PS_BOT_USER_ID:
+            # Every worker has its own bot
+            return
+
+        with self._changedLock:
+            scheduled = bool(self._changedTokens)
+            self._changedTokens[token.token] = token
+        if not scheduled:
+            IOLoop.instance().add_callback(self._sendChangedTokens)
+
+    def _sendChangedTokens(self) -> None:
+        with self._changedLock:
+            changed = self._changedTokens
+            self._changedTokens = {}
+
+        # Tokens being moved are shared by the hub once they're there
+        states = {
+            key: token.getSharedState()
+            for key, token in changed.items()
+            if glob.tokens.tokens.get(key) is token and key not in self._moving
+        }
+        if states:
+            self._publish({"type": "tokens", "tokens": states})
+
+    def tokenDeleted(self, token: UserToken) -> None:
+        """Deletes the copies of a local token that has just been deleted."""
+
+        if token.userID != settings.PS_BOT_USER_ID:
+            self._publish({"type": "forget", "token": token.token})
+
+    # Calls on remote tokens
+
+    def enqueue(self, token: RemoteToken, data: bytes, forwards: int = 0) -> None:
+        self._publish(
+            {
+                "type": "enqueue",
+                "token": token.token,
+                "data": base64.b64encode(data).decode(),
+                "forwards": forwards,
+            },
+            to=token.owner,
+        )
+
+    def call(self, token: RemoteToken, method: str, *args, forwards: int = 0) -> None:
+        """Calls one of `_TOKEN_CALLS` on a token, on the worker that owns it."""
+
+        self._publish(
+            {
+                "type": "call",
+                "token": token.token,
+                "method": method,
+                "args": args,
+                "forwards": forwards,
+            },
+            to=token.owner,
+        )
+
+    def logout(
+        self,
+        token: RemoteToken,
+        deleteToken: bool = True,
+        forwards: int = 0,
+    ) -> None:
+        """Logs a token out on the worker that owns it, without announcing it
+        (the caller does, see `logoutEvent.handle`)."""
+
+        self._publish(
+            {
+                "type": "logout",
+                "token": token.token,
+                "delete_token": deleteToken,
+                "forwards": forwards,
+            },
+            to=token.owner,
+        )
+
+    def broadcast(
+        self,
+        streamName: str,
+        data: bytes,
+        but: Optional[Iterable[str]] = None,
+    ) -> None:
+        """Relays a broadcast of a shared stream to the other workers."""
+
+        if not isSharedStream(streamName):
+            return
+
+        self._publish(
+            {
+                "type": "broadcast",
+                "stream": streamName,
+                "data": base64.b64encode(data).decode(),
+                "but": list(but) if but else [],
+            },
+        )
+
+    def scheduleShutdown(self, delay: float, restart: bool) -> None:
+        """Stops (or restarts) the other workers in `delay` seconds."""
+
+        self._publish({"type": "shutdown", "delay": delay, "restart": restart})
+
+    # Requests and moving tokens
+
+    @tornado.gen.coroutine
+    def routeRequest(self, token: str, requestData: bytes, forwards: int):
+        """
+        Forwards a client request to the worker that owns its token. Local
+        tokens are moved to the hub first if the request needs it.
+
+        :param token: client's token string
+        :param requestData: request body
+        :param forwards: times the request has been forwarded already
+        :return: the response token string and data, or None if this worker
+                        handles the request
+        """
+        moving = self._moving.get(token)
+        if moving is not None:
+            yield moving
+
+        userToken = glob.tokens.tokens.get(token)
+        if userToken is not None and not userToken.remote:
+            if self.isHub or userToken.kicked or not needsHub(requestData):
+                return None
+
+            yield self.moveToHub(userToken)
+            userToken = glob.tokens.tokens.get(token)
+            if userToken is None or not userToken.remote:
+                # Logged out, or it couldn't move. Handle it here.
+                return None
+
+        if userToken is not None:
+            owner = userToken.owner
+        else:
+            owner = self._creatorOf(token)
+        if owner is None or owner == self.workerID or forwards >= MAX_FORWARDS:
+            # Unknown token
+            return None
+
+        try:
+            response = yield self._http.fetch(
+                tornado.httpclient.HTTPRequest(
+                    f"http://127.0.0.1:{settings.HTTP_WORKER_PORT + owner}/",
+                    method="POST",
+                    body=requestData,
+                    headers={"osu-token": token, FORWARDS_HEADER: str(forwards + 1)},
+                    request_timeout=FORWARD_TIMEOUT,
+                ),
+            )
+        except Exception as e:
+            log.error(f"Failed to forward a request to worker {owner}: {e!r}")
+            return None
+
+        self.forwarded += 1
+        return response.headers.get("cho-token", ""), response.body
+
+    def _creatorOf(self, token: str) -> Optional[int]:
+        try:
+            workerID = int(token[1 : token.index(".")])
+        except ValueError:
+            return None
+
+        if not 0 <= workerID < settings.HTTP_WORKER_COUNT:
+            return None
+        return workerID
+
+    @tornado.gen.coroutine
+    def moveToHub(self, token: UserToken):
+        """
+        Moves a local token to the hub, leaving a copy of it here.
+        Requests for it wait until it has moved, and are then forwarded.
+
+        :param token: token to move
+        :return:
+        """
+        moving = self._moving.get(token.token)
+        if moving is not None:
+            yield moving
+            return
+
+        moving = self._moving[token.token] = tornado.concurrent.Future()
+        try:
+            try:
+                yield self._http.fetch(
+                    tornado.httpclient.HTTPRequest(
+                        f"http://127.0.0.1:{settings.HTTP_WORKER_PORT + HUB_WORKER_ID}/tokens",
+                        method="POST",
+                        body=json.dumps(
+                            {"token": token.token, "state": token.getState()}
+                        ),
+                        request_timeout=FORWARD_TIMEOUT,
+                    ),
+                )
+            except Exception as e:
+                log.error(f"Failed to move {token.username}'s token to the hub: {e!r}")
+                return
+
+            self.moved += 1
+            log.info(f"Moved {token.username}'s token to the hub")
+            with redisBatch.batch():
+                if glob.tokens.tokens.get(token.token) is not token:
+                    # Logged out while it was moving
+                    self._publish(
+                        {
+                            "type": "logout",
+                            "token": token.token,
+                            "delete_token": True,
+                            "forwards": 0,
+                        },
+                        to=HUB_WORKER_ID,
+                    )
+                    return
+
+                # What was queued until now is sent along
+                remoteToken = glob.tokens.releaseToken(token, HUB_WORKER_ID)
+                queued = token.fetch_queue()
+                if queued:
+                    remoteToken.enqueue(queued)
+        finally:
+            del self._moving[token.token]
+            moving.set_result(None)
+
+    def adoptToken(self, token: str, state: dict[str, Any]) -> None:
+        """Hub only, adds a token moved here by `moveToHub`."""
+
+        with redisBatch.batch():
+            userToken = glob.tokens.adoptToken(token, state)
+            self.shareToken(userToken)
+            for callback in self._awaitedTokens.pop(token, ()):
+                callback(userToken)
+
+    def _forgetAwaitedToken(self, token: str, callbacks: list) -> None:
+        # Unless it has come (and was asked for again) in the meantime
+        if self._awaitedTokens.get(token) is callbacks:
+            del self._awaitedTokens[token]
+            log.warning(f"Token {token} didn't move to the hub in time")
+
+    def requestToken(
+        self,
+        token: RemoteToken,
+        callback: Callable[[UserToken], None],
+    ) -> None:
+        """
+        Hub only, asks the owner of a token to move it here.
+        Nothing is called if it doesn't come in `MOVE_TIMEOUT` seconds.
+
+        :param token: token to move here
+        :param callback: called with the moved token
+        :return:
+        """
+        callbacks = self._awaitedTokens.get(token.token)
+        if callbacks is not None:
+            callbacks.append(callback)
+            return
+
+        callbacks = self._awaitedTokens[token.token] = [callback]
+        self._publish({"type": "move", "token": token.token}, to=token.owner)
+        IOLoop.instance().call_later(
+            MOVE_TIMEOUT,
+            self._forgetAwaitedToken,
+            token.token,
+            callbacks,
+        )
+
+    # Messages
+
+    def _publish(self, message: dict[str, Any], to: Optional[int] = None) -> None:
+        message["worker"] = self.workerID
+        channel = BUS_CHANNEL if to is None else f"{BUS_CHANNEL}:{to}"
+        # Sent with the other redis writes of the request, never from the loop
+        with redisBatch.batch():
+            redisBatch.writer().publish(channel, json.dumps(message))
+        self.sent += 1
+
+    def _listen(self) -> None:
+        for item in self._pubsub.listen():
+            try:
+                message = json.loads(item["data"])
+            except ValueError as e:
+                log.error(f"Received an invalid worker bus message: {e!r}")
+                continue
+
+            if message["worker"] != self.workerID:
+                self.received += 1
+                requestsManager.runOnLoop(self._handle, message)
+
+    def _handle(self, message: dict[str, Any]) -> None:
+        try:
+            getattr(self, f"_on_{message['type']}")(message)
+        except Exception as e:
+            log.error(f"Failed to handle a worker bus message: {e!r}")
+
+    def _on_hello(self, message: dict[str, Any]) -> None:
+        # The worker (re)started, the tokens it had are gone
+        glob.tokens.deleteRemoteTokens(message["worker"])
+
+        states = {
+            key: token.getSharedState()
+            for key, token in tuple(glob.tokens.tokens.items())
+            if not token.remote and token.userID != settings.PS_BOT_USER_ID
+        }
+        if states:
+            self._publish({"type": "tokens", "tokens": states}, to=message["worker"])
+
+    def _on_tokens(self, message: dict[str, Any]) -> None:
+        for key, state in message["tokens"].items():
+            glob.tokens.addRemoteToken(key, message["worker"], state)
+
+    def _on_forget(self, message: dict[str, Any]) -> None:
+        glob.tokens.deleteRemoteToken(message["token"])
+
+    def _on_broadcast(self, message: dict[str, Any]) -> None:
+        glob.streams.broadcast(
+            message["stream"],
+            base64.b64decode(message["data"]),
+            message["but"],
+            local=True,
+        )
+
+    def _on_enqueue(self, message: dict[str, Any]) -> None:
+        token = glob.tokens.tokens.get(message["token"])
+        if token is None:
+            return
+
+        data = base64.b64decode(message["data"])
+        if not token.remote:
+            token.enqueue(data)
+        elif message["forwards"] < MAX_FORWARDS:
+            # It has moved since
+            self.enqueue(token, data, message["forwards"] + 1)
+
+    def _on_call(self, message: dict[str, Any]) -> None:
+        if message["method"] not in _TOKEN_CALLS:
+            log.warning(f"Ignored call of {message['method']} from the worker bus")
+            return
+
+        token = glob.tokens.tokens.get(message["token"])
+        if token is None:
+            return
+
+        if not token.remote:
+            getattr(token, message["method"])(*message["args"])
+        elif message["forwards"] < MAX_FORWARDS:
+            self.call(
+                token,
+                message["method"],
+                *message["args"],
+                forwards=message["forwards"] + 1,
+            )
+
+    def _on_logout(self, message: dict[str, Any]) -> None:
+        token = glob.tokens.tokens.get(message["token"])
+        if token is None:
+            return
+
+        if not token.remote:
+            logoutEvent.handle(
+                token,
+                deleteToken=message["delete_token"],
+                announce=False,
+            )
+        elif message["forwards"] < MAX_FORWARDS:
+            self.logout(token, message["delete_token"], message["forwards"] + 1)
+
+    def _on_move(self, message: dict[str, Any]) -> None:
+        token = glob.tokens.tokens.get(message["token"])
+        if token is not None and not token.remote and not token.kicked:
+            IOLoop.instance().spawn_callback(self.moveToHub, token)
+
+    def _on_shutdown(self, message: dict[str, Any]) -> None:
+        systemHelper.scheduleStop(message["delay"], message["restart"])
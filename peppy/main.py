@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import multiprocessing
 import os
 import sys
 import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing.pool import ThreadPool
 
 #import ddtrace
@@ -11,17 +14,25 @@ import settings
 import tornado.gen
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
 import tornado.web
+from adapters import Ip2LocationDatabase
 from common.db import dbConnector
 from common.redis import pubSub
+from common.web import requestsManager
 from handlers import api_status
 from handlers import apiAerisThing
 from handlers import apiOnlineUsersHandler
 from handlers import apiServerStatusHandler
 from handlers import mainHandler
+from handlers import workerHandler
 from helpers import consoleHelper
 from helpers import systemHelper as system
+from helpers.beatmap_cache import BeatmapCache
+from helpers.chat_log_writer import ChatLogWriter
+from helpers.command_router import SlowCommandExecutor
 from helpers.status_helper import StatusManager
+from helpers.worker_bus import WorkerBus
 from logger import DEBUG
 from logger import log
 from objects import banchoConfig
@@ -34,6 +45,7 @@ from redis_handlers import notificationHandler
 from redis_handlers import refreshPrivsHandler
 from redis_handlers import updateSilenceHandler
 from redis_handlers import updateStatsHandler
+from tornado.platform.asyncio import AsyncIOMainLoop
 
 
 def make_app():
@@ -49,6 +61,15 @@ def make_app():
     )
 
 
+def make_worker_app():
+    return tornado.web.Application(
+        [
+            (r"/", mainHandler.handler),
+            (r"/tokens", workerHandler.handler),
+        ],
+    )
+
+
 def main():
     #ddtrace.patch_all()
     try:
@@ -63,7 +84,66 @@ def main():
                 os.makedirs(i, 0o770)
         log.info("Complete!")
 
-        # Connect to db and redis
+        # The workers share their state through the event loop of each one
+        if settings.HTTP_WORKER_COUNT > 1 and not settings.HTTP_ASYNC_MODE:
+            log.error("HTTP_WORKER_COUNT can only be more than 1 with HTTP_ASYNC_MODE.")
+            raise SystemExit(1)
+
+        # Connect to redis
+        try:
+            log.info("Connecting to redis... ")
+            # One pool shared by every thread. The pubsub listener keeps one
+            # connection for itself, the others wait for a free one when it's exhausted.
+            glob.redis = redis.Redis(
+                connection_pool=redis.BlockingConnectionPool(
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    password=settings.REDIS_PASSWORD,
+                    db=settings.REDIS_DB,
+                    max_connections=settings.REDIS_POOL_SIZE,
+                    timeout=5,
+                ),
+            )
+            glob.redis.ping()
+        except Exception:
+            # Exception while connecting to redis
+            log.error(
+                "Error while connection to database and redis. Please ensure your config and try again.",
+            )
+            raise
+
+        # Reset the online users counter. Old bancho sessions, the only other
+        # peppy:* keys, are deleted below.
+        glob.redis.set("ripple:online_users", 0)
+
+        # Save peppy version in redis
+        glob.redis.set("peppy:version", glob.__version__)
+
+        # Delete old bancho sessions
+        log.info("Deleting cached bancho sessions from DB... ")
+        deleted = glob.tokens.deleteBanchoSessions()
+        log.info(f"Deleted {deleted} bancho sessions!")
+
+        # Load the local geolocation database, the ip2location API is kept as a fallback.
+        # Loaded before forking the workers, so they share its memory.
+        if settings.DATA_GEOLOCATION_DATABASE_PATH:
+            log.info("Loading geolocation database...")
+            glob.geolocation_api = Ip2LocationDatabase(
+                settings.DATA_GEOLOCATION_DATABASE_PATH,
+                fallback=glob.geolocation_api,
+            )
+            log.info(f"Loaded {len(glob.geolocation_api)} IP ranges!")
+
+        # Fork the workers. Everything from here on runs in each of them,
+        # nothing started above may have a thread or an open connection.
+        workerID = 0
+        if settings.HTTP_WORKER_COUNT > 1:
+            log.info(f"Starting {settings.HTTP_WORKER_COUNT} workers...")
+            glob.redis.connection_pool.disconnect()
+            workerID = system.forkWorkers(settings.HTTP_WORKER_COUNT)
+            log.info(f"Worker {workerID} started!")
+
+        # Connect to db
         try:
             log.info("Connecting to MySQL database... ")
             glob.db = dbConnector.DatabasePool(
@@ -74,15 +154,6 @@ def main():
                 database=settings.MYSQL_DATABASE,
                 initialSize=settings.MYSQL_POOL_SIZE,
             )
-
-            log.info("Connecting to redis... ")
-            glob.redis = redis.Redis(
-                host=settings.REDIS_HOST,
-                port=settings.REDIS_PORT,
-                password=settings.REDIS_PASSWORD,
-                db=settings.REDIS_DB,
-            )
-            glob.redis.ping()
         except Exception:
             # Exception while connecting to db
             log.error(
@@ -90,21 +161,6 @@ def main():
             )
             raise
 
-        # Empty redis cache
-        try:
-            glob.redis.set("ripple:online_users", 0)
-            glob.redis.eval(
-                "return redis.call('del', unpack(redis.call('keys', ARGV[1])))",
-                0,
-                "peppy:*",
-            )
-        except redis.exceptions.ResponseError:
-            # Script returns error if there are no keys starting with peppy:*
-            pass
-
-        # Save peppy version in redis
-        glob.redis.set("peppy:version", glob.__version__)
-
         # Load bancho_settings
         try:
             log.info("Loading bancho settings from DB... ")
@@ -116,15 +172,45 @@ def main():
             )
             raise
 
-        # Delete old bancho sessions
-        log.info("Deleting cached bancho sessions from DB... ")
-        glob.tokens.deleteBanchoSessions()
+        # Password checks are CPU bound, run them in other processes so they don't
+        # hold the GIL of the request threads. Other threads are running by now
+        # (MySQL reconnects, write-behind...), so the workers are spawned, not forked:
+        # a forked child could inherit a lock held by one of them and deadlock.
+        log.info("Creating bcrypt process pool...")
+        glob.bcrypt_pool = ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context("spawn"),
+        )
         log.info("Complete!")
 
-        # Create thread pool
-        log.info("Creating thread pool...")
-        glob.pool = ThreadPool(settings.HTTP_THREAD_COUNT)
-        log.info("Complete!")
+        if settings.HTTP_ASYNC_MODE:
+            # Requests are served on the asyncio loop, which owns every token,
+            # stream, channel and match. Threads only run blocking calls.
+            log.info("Creating blocking call executor...")
+            AsyncIOMainLoop().install()
+            glob.executor = ThreadPoolExecutor(
+                settings.HTTP_THREAD_COUNT,
+                thread_name_prefix="peppy-blocking",
+            )
+            glob.scheduler.runJobsWith(requestsManager.runOnLoop)
+            log.info("Complete!")
+
+            # Links the workers, started once everything else is
+            if settings.HTTP_WORKER_COUNT > 1:
+                glob.worker_bus = WorkerBus(workerID)
+        else:
+            # Create thread pool
+            log.info("Creating thread pool...")
+            glob.pool = ThreadPool(settings.HTTP_THREAD_COUNT)
+            log.info("Complete!")
+
+        # Parsed beatmaps and song names for the bot
+        glob.beatmap_cache = BeatmapCache(
+            settings.DATA_BEATMAP_DIRECTORY,
+            persist_directory=".data/beatmaps",
+        )
+
+        # Slow bot commands run in the background
+        glob.slow_commands = SlowCommandExecutor()
 
         # Start fokabot
         log.info("Connecting RealistikBot...")
@@ -142,19 +228,25 @@ def main():
         glob.streams.add("lobby")
         log.info("Complete!")
 
-        # Initialize user timeout check loop
-        log.info("Initializing user timeout check loop... ")
-        glob.tokens.usersTimeoutCheckLoop()
+        # Start writing chat logs in the background
+        log.info("Starting chat log writer... ")
+        glob.chat_log_writer = ChatLogWriter()
+        glob.chat_log_writer.start()
         log.info("Complete!")
 
-        # Initialize spam protection reset loop
-        log.info("Initializing spam protection reset loop... ")
-        glob.tokens.spamProtectionResetLoop()
-        log.info("Complete!")
-
-        # Initialize multiplayer cleanup loop
-        log.info("Initializing multiplayer cleanup loop... ")
-        glob.matches.cleanupLoop()
+        # Start the scheduler. Clients are timed out by it too, see TokenList.addToken
+        log.info("Starting scheduler... ")
+        glob.scheduler.every(
+            10,
+            glob.tokens.resetSpamProtection,
+            name="spam protection reset",
+        )
+        glob.scheduler.every(
+            30,
+            glob.matches.cleanupEmptyMatches,
+            name="multiplayer cleanup",
+        )
+        glob.scheduler.start()
         log.info("Complete!")
 
         try:
@@ -204,7 +296,27 @@ def main():
         }
 
         # Start tornado
-        glob.application.listen(port=settings.HTTP_PORT, address=settings.HTTP_ADDRESS)
+        if glob.worker_bus is None:
+            glob.application.listen(
+                port=settings.HTTP_PORT,
+                address=settings.HTTP_ADDRESS,
+            )
+        else:
+            # Every worker accepts the clients' connections on the same port, and
+            # the requests the other workers forward on its own private port
+            glob.worker_bus.start()
+            server = tornado.httpserver.HTTPServer(glob.application)
+            server.add_sockets(
+                tornado.netutil.bind_sockets(
+                    settings.HTTP_PORT,
+                    address=settings.HTTP_ADDRESS,
+                    reuse_port=True,
+                ),
+            )
+            make_worker_app().listen(
+                port=settings.HTTP_WORKER_PORT + workerID,
+                address="127.0.0.1",
+            )
         tornado.ioloop.IOLoop.instance().start()
     finally:
         system.dispose()
@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 from common import generalUtils
+from common.web import requestsManager
 from constants import serverPackets
 from logger import log
 from objects import glob
@@ -82,20 +83,37 @@ class banchoConfig:
             "UPDATE bancho_settings SET value_int = %s WHERE name = 'bancho_maintenance'",
             [int(maintenance)],
         )
+        if glob.worker_bus is not None:
+            # The other workers reload it
+            glob.redis.publish("peppy:reload_settings", "reload")
 
     def reload(self):
+        """
+        Reload settings and channels from db and send them to everyone.
+        The queries run on the calling thread, the changes on the event loop.
+        """
         # Reload settings from bancho_settings
         glob.banchoConf.loadSettings()
 
         # Reload channels too
-        glob.channels.loadChannels()
+        channels = glob.db.fetchAll("SELECT * FROM bancho_channels")
+        requestsManager.runOnLoop(self._sendSettings, channels)
+
+    def _sendSettings(self, channels):
+        glob.channels.loadChannels(channels)
 
-        # Send new channels and new bottom icon to everyone
+        # Send new channels and new bottom icon to everyone.
+        # Every worker reloads them, and sends them to its own clients.
         glob.streams.broadcast(
             "main",
             serverPackets.menu_icon(glob.banchoConf.config["menuIcon"]),
+            local=True,
         )
-        glob.streams.broadcast("main", serverPackets.channel_info_end())
+        glob.streams.broadcast("main", serverPackets.channel_info_end(), local=True)
         for key, value in glob.channels.channels.items():
             if value.publicRead and not value.hidden:
-                glob.streams.broadcast("main", serverPackets.channel_info(key))
+                glob.streams.broadcast(
+                    "main",
+                    serverPackets.channel_info(key),
+                    local=True,
+                )
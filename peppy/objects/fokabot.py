@@ -1,6 +1,7 @@
 """FokaBot related functions"""
 from __future__ import annotations
 
+import functools
 import time
 import traceback
 from importlib import reload
@@ -8,8 +9,11 @@ from importlib import reload
 import settings
 from common.constants import actions
 from common.ripple import userUtils
+from common.web import requestsManager
 from constants import fokabotCommands
 from constants import serverPackets
+from helpers import chatHelper as chat
+from helpers.command_router import COMMAND_PREFIXES
 from logger import log
 from objects import glob
 
@@ -31,8 +35,15 @@ def connect():
     token.timeOffset = 0
     token.country = 2  # this is retared, fuck it im keeping it as europe, couldnt find the uk as its ordered stupidly
     token.location = (39.01955903386848, 125.75276158057767)  # Pyongyang red square
-    glob.streams.broadcast("main", serverPackets.user_presence(settings.PS_BOT_USER_ID))
-    glob.streams.broadcast("main", serverPackets.user_stats(settings.PS_BOT_USER_ID))
+    token.invalidatePresence()
+    token.invalidateStats()
+    # Every worker has its own bot, and announces it to its own clients
+    glob.streams.broadcast(
+        "main",
+        serverPackets.user_presence_token(token),
+        local=True,
+    )
+    glob.streams.broadcast("main", serverPackets.user_stats_token(token), local=True)
 
 
 def reload_commands():
@@ -71,43 +82,97 @@ def fokabotResponse(fro, chan, message):
     user = glob.tokens.getTokenFromUsername(fro)
     assert len(message) > 0
 
-    if message[0] not in ("!", "\x01") and not chan.startswith("#"):
-        return DEFAULT_RESPONSE
+    isChannel = chan.startswith("#")
+    if message[0] not in COMMAND_PREFIXES:
+        return DEFAULT_RESPONSE if not isChannel else False
 
-    for regex, cmd in fokabotCommands.commands.items():
-        if not regex.match(message):
-            continue
+    cmd = fokabotCommands.router.match(message)
+    if cmd is None:
+        return False
 
-        args = message.removeprefix(cmd.trigger).strip().split(" ")
-        if cmd.privileges and not user.privileges & cmd.privileges:
-            return False
+    if isChannel and not chan.startswith(cmd.channels):
+        return False
 
-        if cmd.syntax and not len(args) >= len(cmd.syntax.split(" ")):
-            return f"Wrong syntax: {cmd.trigger} {cmd.syntax}"
-
-        try:
-            # Now we're executing command callback.
-            if not (resp := cmd.callback(fro, chan, args)):
-                return False
-
-            resp = [resp]
-            if user.admin:  # I'm addicted to benchmarking lmao -len4ee
-                resp.append(f"Elapsed: {(time.perf_counter_ns() - start) / 1e6:.2f}ms")
-
-            return " | ".join(resp)
-        except Exception:
-            # If exception happens, handle it well.
-            tb = traceback.format_exc()
-            log.error(
-                f"There was an issue while running '{cmd.trigger}' command. \nTraceback: {tb}",
-            )
-            resp = [
-                f"There was issue while processing your command, please report this to {settings.PS_NAME} developer!",
-            ]
-            # Debugging for staff
-            if user.admin:
-                resp.append(tb)
-                resp.append(f"Elasped: {(time.perf_counter_ns() - start) / 1e6:.2f}ms")
-            return "\n".join(resp)
+    args = message.removeprefix(cmd.trigger).strip().split(" ")
+    if cmd.privileges and not user.privileges & cmd.privileges:
+        return False
 
+    if cmd.syntax and not len(args) >= len(cmd.syntax.split(" ")):
+        return f"Wrong syntax: {cmd.trigger} {cmd.syntax}"
+
+    if not cmd.slow or glob.slow_commands is None:
+        return runCommand(cmd, user, fro, chan, args, start)
+
+    # Slow commands reply by themselves once done, from the event loop
+    target = chan if isChannel else fro
+
+    def reply(resp):
+        if resp:
+            chat.sendMessage(glob.BOT_NAME, target, resp)
+
+    if not glob.slow_commands.submit(
+        fro,
+        runCommand,
+        cmd,
+        user,
+        fro,
+        chan,
+        args,
+        start,
+        callback=functools.partial(requestsManager.runOnLoop, reply),
+    ):
+        # Only tell the sender, not the whole channel
+        chat.sendMessage(
+            glob.BOT_NAME,
+            fro,
+            "I'm still busy with your last command, please try again in a few seconds.",
+        )
     return False
+
+
+def runCommand(cmd, user, fro, chan, args, start):
+    """
+    Run a command's callback and format its response
+
+    :param cmd: triggered command
+    :param user: sender's token
+    :param fro: sender username
+    :param chan: channel name (or receiver username)
+    :param args: command arguments
+    :param start: `time.perf_counter_ns()` when the message was received
+    :return: FokaBot's response or False if no response
+    """
+    try:
+        # Now we're executing command callback.
+        resp = cmd.callback(fro, chan, args)
+        fokabotCommands.router.record(
+            cmd.trigger,
+            (time.perf_counter_ns() - start) / 1e9,
+        )
+        if not resp:
+            return False
+
+        resp = [resp]
+        if user.admin:  # I'm addicted to benchmarking lmao -len4ee
+            resp.append(f"Elapsed: {(time.perf_counter_ns() - start) / 1e6:.2f}ms")
+
+        return " | ".join(resp)
+    except Exception:
+        fokabotCommands.router.record(
+            cmd.trigger,
+            (time.perf_counter_ns() - start) / 1e9,
+            failed=True,
+        )
+        # If exception happens, handle it well.
+        tb = traceback.format_exc()
+        log.error(
+            f"There was an issue while running '{cmd.trigger}' command. \nTraceback: {tb}",
+        )
+        resp = [
+            f"There was issue while processing your command, please report this to {settings.PS_NAME} developer!",
+        ]
+        # Debugging for staff
+        if user.admin:
+            resp.append(tb)
+            resp.append(f"Elasped: {(time.perf_counter_ns() - start) / 1e6:.2f}ms")
+        return "\n".join(resp)
@@ -1,22 +1,31 @@
 from __future__ import annotations
 
 import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing.pool import ThreadPool
+from typing import Optional
 from typing import TYPE_CHECKING
 
 import settings
 from adapters import Ip2LocationApi
+from adapters import Ip2LocationDatabase
 from adapters import PerformanceServiceApi
 from collection.channels import ChannelList
 from collection.matches import MatchList
 from collection.streams import StreamList
 from collection.tokens import TokenList
 from common.db.dbConnector import DatabasePool
+from helpers.scheduler import Scheduler
 from objects.banchoConfig import banchoConfig
 from redis import Redis
 
 if TYPE_CHECKING:
+    from helpers.beatmap_cache import BeatmapCache
+    from helpers.chat_log_writer import ChatLogWriter
+    from helpers.command_router import SlowCommandExecutor
     from helpers.status_helper import StatusManager
+    from helpers.worker_bus import WorkerBus
 
 # Consts.
 BOT_NAME = settings.PS_BOT_USERNAME
@@ -27,14 +36,20 @@ application = None
 db: DatabasePool
 redis: Redis
 banchoConf: banchoConfig
+beatmap_cache: BeatmapCache
 namespace = {}
 streams = StreamList()
 tokens = TokenList()
 channels = ChannelList()
 matches = MatchList()
-cached_passwords: dict[str, str] = {}
+scheduler = Scheduler()
 chatFilters = None
 pool: ThreadPool
+executor: Optional[ThreadPoolExecutor] = None
+bcrypt_pool: Optional[ProcessPoolExecutor] = None
+chat_log_writer: Optional[ChatLogWriter] = None
+slow_commands: Optional[SlowCommandExecutor] = None
+worker_bus: Optional[WorkerBus] = None
 busyThreads = 0
 
 debug = False
@@ -42,7 +57,7 @@ restarting = False
 
 startTime = int(time.time())
 user_statuses: StatusManager
-geolocation_api = Ip2LocationApi(
+geolocation_api: Ip2LocationApi | Ip2LocationDatabase = Ip2LocationApi(
     settings.IP2LOCATION_API_KEY,
     silent_fail=True,
 )
@@ -8,14 +8,17 @@ from typing import Optional
 from typing import TYPE_CHECKING
 
 import settings
+from common.redis import redisBatch
 from constants import dataTypes
 from constants import matchModModes
 from constants import matchScoringTypes
 from constants import matchTeams
 from constants import matchTeamTypes
+from constants import packetIDs
 from constants import serverPackets
 from constants import slotStatuses
 from helpers import chatHelper as chat
+from helpers import packetHelper
 from logger import log
 from objects import glob
 
@@ -80,6 +83,10 @@ class Match:
         self.matchModMode = matchModModes.NORMAL  # default value
         self.seed = 0
         self.matchDataCache = b""
+
+        # Encoded match data packets, keyed by (packet ID, censored). Swapped for
+        # an empty dict by `invalidateMatchData` whenever the match changes.
+        self._dataPackets: dict[tuple[int, bool], bytes] = {}
         self.isTourney = isTourney
         self.isLocked = (
             False  # if True, users can't change slots/teams. Used in tourney matches
@@ -179,6 +186,34 @@ class Match:
 
         return struct
 
+    def getMatchDataPacket(self, packetID: int, censored: bool = False) -> bytes:
+        """
+        Returns a packet carrying this match's data, encoding it only once per
+        variant until the match changes.
+
+        :param packetID: packet ID (update, new match, start, join success...)
+        :param censored: whether to hide the match password
+        :return: packet bytes
+        """
+        # Keep a reference to this version's dict. If the match is invalidated
+        # while we encode, the packet lands in the discarded dict.
+        packets = self._dataPackets
+        packet = packets.get((packetID, censored))
+        if packet is None:
+            packet = packetHelper.buildPacket(
+                packetID,
+                self.getMatchData(censored=censored),
+            )
+            packets[(packetID, censored)] = packet
+        return packet
+
+    def invalidateMatchData(self) -> None:
+        """Drops the encoded match data packets. Call after changing any of
+        the match settings or slots."""
+
+        self._dataPackets = {}
+        glob.matches.invalidateLobbySnapshot()
+
     def setHost(self, newHost: int) -> bool:
         """
         Set room host to newHost and send him host packet
@@ -191,6 +226,7 @@ class Match:
             return False
         token = glob.tokens.tokens[self.slots[slotID].user]
         self.hostUserID = newHost
+        self.invalidateMatchData()
         token.enqueue(serverPackets.match_new_host_notify())
         self.sendUpdates()
         log.info(f"MPROOM{self.matchID}: {token.username} is now the host")
@@ -202,6 +238,7 @@ class Match:
         :return:
         """
         self.hostUserID = -1
+        self.invalidateMatchData()
         self.sendUpdates()
         log.info(f"MPROOM{self.matchID}: Removed host")
 
@@ -253,6 +290,8 @@ class Match:
         if complete is not None:
             self.slots[slotID].complete = complete
 
+        self.invalidateMatchData()
+
     def setSlotMods(self, slotID: int, mods: int) -> None:
         """
         Set slotID mods. Same as calling setSlot and then sendUpdate
@@ -314,7 +353,7 @@ class Match:
             and self.slots[slotID].user in glob.tokens.tokens
         ):
             glob.tokens.tokens[self.slots[slotID].user].enqueue(
-                serverPackets.match_update(self.matchID),
+                self.getMatchDataPacket(packetIDs.server_updateMatch),
             )
 
         # Set new slot status
@@ -494,7 +533,7 @@ class Match:
                 }
 
         # Send the info to the api
-        glob.redis.publish("api:mp_complete_match", json.dumps(infoToSend))
+        redisBatch.writer().publish("api:mp_complete_match", json.dumps(infoToSend))
 
         # Reset inProgress
         self.inProgress = False
@@ -536,6 +575,7 @@ class Match:
                 self.slots[i].score = 0
                 self.slots[i].failed = False
                 self.slots[i].passed = True
+        self.invalidateMatchData()
 
     def getUserSlotID(self, userID: int) -> Optional[int]:
         """
@@ -689,6 +729,7 @@ class Match:
         :return:
         """
         self.matchPassword = newPassword
+        self.invalidateMatchData()
 
         # Send password change to every user in match
         glob.streams.broadcast(
@@ -713,6 +754,7 @@ class Match:
         """
         # Set new mods and send update
         self.mods = mods
+        self.invalidateMatchData()
         self.sendUpdates()
         log.info(f"MPROOM{self.matchID}: Mods changed to {self.mods}")
 
@@ -867,18 +909,14 @@ class Match:
 
         :return:
         """
-        self.matchDataCache = serverPackets.match_update(self.matchID)
-        censoredDataCache = serverPackets.match_update(self.matchID, censored=True)
-        if self.matchDataCache is not None:
-            glob.streams.broadcast(self.streamName, self.matchDataCache)
-        if censoredDataCache is not None:
-            glob.streams.broadcast("lobby", censoredDataCache)
-        else:
-            log.error(
-                "MPROOM{}: Can't send match update packet, match data is None!!!".format(
-                    self.matchID,
-                ),
-            )
+        # Settings may have been changed directly on the match before this call
+        self.invalidateMatchData()
+        self.matchDataCache = self.getMatchDataPacket(packetIDs.server_updateMatch)
+        glob.streams.broadcast(self.streamName, self.matchDataCache)
+        glob.streams.broadcast(
+            "lobby",
+            self.getMatchDataPacket(packetIDs.server_updateMatch, censored=True),
+        )
 
     def checkTeams(self):
         """
@@ -936,6 +974,7 @@ class Match:
                 glob.tokens.tokens[self.slots[i].user].joinStream(
                     self.playingStreamName,
                 )
+        self.invalidateMatchData()
 
         # Send match start packet
         glob.streams.broadcast(
@@ -980,15 +1019,18 @@ class Match:
             # Reset teams
             for _slot in self.slots:
                 _slot.team = matchTeams.NO_TEAM
+        self.invalidateMatchData()
 
     def resetMods(self):
         for _slot in self.slots:
             _slot.mods = 0
+        self.invalidateMatchData()
 
     def resetReady(self):
         for _slot in self.slots:
             if _slot.status == slotStatuses.READY:
                 _slot.status = slotStatuses.NOT_READY
+        self.invalidateMatchData()
 
     def sendReadyStatus(self):
         chanName = f"#multi_{self.matchID}"
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import functools
 import threading
 import time
 import uuid
+from typing import Any
+from typing import Callable
 from typing import Optional
 from typing import TYPE_CHECKING
 
@@ -11,7 +14,9 @@ from common.constants import actions
 from common.constants import gameModes
 from common.constants import privileges
 from common.ripple import userUtils
+from common.web import requestsManager
 from constants import exceptions
+from constants import packetIDs
 from constants import serverPackets
 from constants.rosuprivs import ADMIN_PRIVS
 from events import logoutEvent
@@ -22,8 +27,99 @@ from objects import glob
 if TYPE_CHECKING:
     from objects.channel import Channel
 
+# How long (in seconds) cached user stats are served before being fetched again.
+# Score submissions refresh them sooner, through `peppy:update_cached_stats`.
+STATS_CACHE_TTL = 120
+
+# Packets that may be dropped from a full queue. Losing them only leaves the
+# client with stale state until the next update, unlike losing chat or match events.
+_DROPPABLE_PACKETS = frozenset(
+    (
+        packetIDs.server_spectateFrames,
+        packetIDs.server_matchScoreUpdate,
+        packetIDs.server_userPanel,
+        packetIDs.server_userStats,
+    ),
+)
+
+
+# "Latest value wins" packets, and the size of the subject (user or match ID)
+# they start with. Only the newest one per subject is kept in a queue.
+_COALESCED_PACKETS = {
+    packetIDs.server_userPanel: 4,
+    packetIDs.server_userStats: 4,
+    packetIDs.server_updateMatch: 2,
+}
+
+
+# Fields copied to the tokens of this user in the other worker processes,
+# see `objects.remoteToken`
+SHARED_FIELDS = (
+    "userID",
+    "username",
+    "safeUsername",
+    "privileges",
+    "silenceEndTime",
+    "irc",
+    "tournament",
+    "loginTime",
+    "timeOffset",
+    "country",
+    "location",
+    "awayMessage",
+    "matchID",
+    "spectating",
+    "spectatingUserID",
+    "actionID",
+    "actionText",
+    "actionMd5",
+    "actionMods",
+    "gameMode",
+    "beatmapID",
+    "rankedScore",
+    "accuracy",
+    "playcount",
+    "totalScore",
+    "gameRank",
+    "pp",
+    "relaxing",
+    "autopiloting",
+    "messagesBuffer",
+)
+
+# Fields also moved with the token when it moves to another worker process
+_MOVED_FIELDS = SHARED_FIELDS + (
+    "ip",
+    "pingTime",
+    "joinedChannels",
+    "sentAway",
+    "tillerino",
+    "spamRate",
+    "relaxAnnounce",
+    "autoAnnounce",
+)
+
+
+def _isDroppable(packet: bytes) -> bool:
+    return int.from_bytes(packet[:2], "little") in _DROPPABLE_PACKETS
+
+
+def _coalesceKey(packet: bytes) -> Optional[tuple[int, int]]:
+    """Returns the (packet ID, subject ID) key of a single coalesced packet,
+    or None if `packet` isn't one."""
+
+    packetID = int.from_bytes(packet[:2], "little")
+    subjectSize = _COALESCED_PACKETS.get(packetID)
+    if subjectSize is None or len(packet) != int.from_bytes(packet[3:7], "little") + 7:
+        return None
+
+    return packetID, int.from_bytes(packet[7 : 7 + subjectSize], "little")
+
 
 class UserToken:
+    # Tokens of users connected to another worker process are `RemoteToken`s
+    remote = False
+
     def __init__(
         self,
         userID,
@@ -32,6 +128,7 @@ class UserToken:
         irc=False,
         timeOffset=0,
         tournament=False,
+        userData: Optional[dict[str, Any]] = None,
     ):
         """
         Create a token object and set userID and token
@@ -43,15 +140,21 @@ class UserToken:
         :param irc: if True, set this token as IRC client. Default: False.
         :param timeOffset: the time offset from UTC for this user. Default: 0.
         :param tournament: if True, flag this client as a tournement client. Default: True.
+        :param userData: the user's `users` row (username, username_safe, privileges,
+                        silence_end), optionally with their vanilla std stats
+                        (rankedScore, accuracy, playcount, totalScore, pp, gameRank).
+                        If not passed, it is fetched from the db.
         """
         # Set stuff
         self.userID = userID
 
         # Using MySQL over 5 billion SQL queries
-        data_db = glob.db.fetch(
-            "SELECT `username`, `username_safe`, `privileges`, `silence_end` FROM users WHERE id = %s LIMIT 1",
-            (self.userID,),
-        )
+        data_db = userData
+        if data_db is None:
+            data_db = glob.db.fetch(
+                "SELECT `username`, `username_safe`, `privileges`, `silence_end` FROM users WHERE id = %s LIMIT 1",
+                (self.userID,),
+            )
         self.username = data_db["username"]
         self.safeUsername = data_db["username_safe"]
         self.privileges = int(data_db["privileges"])
@@ -82,7 +185,19 @@ class UserToken:
         self.matchID = -1
         self.tillerino = [0, 0, -1.0]  # beatmap, mods, acc
         self.silenceEndTime = 0
-        self.queue = bytearray()
+        self.queue: list[bytes] = []
+        self._queueSize = 0
+        self._coalescedIndexes: dict[tuple[int, int], int] = {}
+
+        # Encoded user panel and stats packets, rebuilt only after being invalidated
+        self._presencePacket: Optional[bytes] = None
+        self._statsPacket: Optional[bytes] = None
+
+        # Stats rows (with game rank) by (game mode, relaxing, autopiloting) and when
+        # they go stale. Swapped for an empty dict by `invalidateStatsCache`.
+        self._statsCache: dict[
+            tuple[int, bool, bool], tuple[dict[str, Any], float]
+        ] = {}
 
         # Spam protection
         self.spamRate = 0
@@ -114,6 +229,9 @@ class UserToken:
             self.token = token_
         else:
             self.token = str(uuid.uuid4())
+            if glob.worker_bus is not None:
+                # Tells the other workers where to forward its requests
+                self.token = glob.worker_bus.newToken(self.token)
 
         # Locks
         self.processingLock = (
@@ -121,8 +239,21 @@ class UserToken:
         )  # Acquired while there's an incoming packet from this user
         self._bufferLock = threading.Lock()  # Acquired while writing to packets buffer
         self._spectLock = threading.RLock()
-
-        # Set stats
+        self._packetCacheLock = threading.Lock()
+
+        # Set stats, from the login query if it already got them
+        if data_db.get("pp") is not None:
+            stats = {
+                key: data_db[key]
+                for key in ("rankedScore", "accuracy", "playcount", "totalScore", "pp")
+            }
+            stats["gameRank"] = data_db.get("gameRank")
+            if stats["gameRank"] is None:
+                stats["gameRank"] = userUtils.getGameRank(self.userID, self.gameMode)
+            self._statsCache[(self.gameMode, False, False)] = (
+                stats,
+                time.monotonic() + STATS_CACHE_TTL,
+            )
         self.updateCachedStats()
 
         # If we have a valid ip, save bancho session in DB so we can cache LETS logins
@@ -132,6 +263,62 @@ class UserToken:
         # Join main stream
         self.joinStream("main")
 
+    @classmethod
+    def fromState(cls, token: str, state: dict[str, Any]) -> UserToken:
+        """
+        Rebuild a token moved from another worker process, without any query
+
+        :param token: token string
+        :param state: the token's fields, see `getState`
+        :return: token object, in the main stream and its chat channels' streams
+        """
+        newToken = cls(
+            state["userID"],
+            token_=token,
+            irc=state["irc"],
+            timeOffset=state["timeOffset"],
+            tournament=state["tournament"],
+            userData={
+                "username": state["username"],
+                "username_safe": state["safeUsername"],
+                "privileges": state["privileges"],
+                "silence_end": state["silenceEndTime"],
+                "rankedScore": state["rankedScore"],
+                "accuracy": state["accuracy"] * 100,
+                "playcount": state["playcount"],
+                "totalScore": state["totalScore"],
+                "pp": state["pp"],
+                "gameRank": state["gameRank"],
+            },
+        )
+        # The stats were cached as std ones, the user may be playing another mode
+        newToken._statsCache = {}
+
+        for field in _MOVED_FIELDS:
+            setattr(newToken, field, state[field])
+        for channel in newToken.joinedChannels:
+            newToken.joinStream(f"chat/{channel}")
+        return newToken
+
+    def getState(self) -> dict[str, Any]:
+        """Returns the fields `fromState` rebuilds this token from. They can be
+        encoded as JSON. The queue isn't part of them."""
+
+        return {field: getattr(self, field) for field in _MOVED_FIELDS}
+
+    def getSharedState(self) -> dict[str, Any]:
+        """Returns the fields the other worker processes keep a copy of."""
+
+        return {field: getattr(self, field) for field in SHARED_FIELDS}
+
+    def shareState(self) -> None:
+        """Sends `SHARED_FIELDS` to the other worker processes, if any. Call after
+        changing one that isn't in the user panel or stats packets, the others
+        are sent when the packets are invalidated."""
+
+        if glob.worker_bus is not None:
+            glob.worker_bus.shareToken(self)
+
     @property
     def restricted(self) -> bool:
         """Bool corresponding to the user's restricted status."""
@@ -168,24 +355,118 @@ class UserToken:
         if self.userID == settings.PS_BOT_USER_ID:
             return
 
+        key = _coalesceKey(bytes_)
         with self._bufferLock:
-            self.queue += bytes_
+            # Check the cap first, so a rejected packet leaves the older one queued
+            if (
+                settings.PS_MAX_QUEUE_BYTES
+                and self._queueSizeWith(key, bytes_) > settings.PS_MAX_QUEUE_BYTES
+                and not self._makeQueueRoom(key, bytes_)
+            ):
+                return
+
+            # Blank out the older packet about the same subject. The new one goes at
+            # the end of the queue so it still comes after eg. a logout or dispose.
+            if (
+                key is not None
+                and (index := self._coalescedIndexes.get(key)) is not None
+            ):
+                self._queueSize -= len(self.queue[index])
+                self.queue[index] = b""
+
+            if key is not None:
+                self._coalescedIndexes[key] = len(self.queue)
+            self.queue.append(bytes_)
+            self._queueSize += len(bytes_)
+
+    def _queueSizeWith(self, key: Optional[tuple[int, int]], bytes_: bytes) -> int:
+        """Returns the size the queue would have once `bytes_` (whose coalesce
+        key is `key`) is enqueued. Must be called with `_bufferLock` held."""
+
+        size = self._queueSize + len(bytes_)
+        if key is not None and (index := self._coalescedIndexes.get(key)) is not None:
+            size -= len(self.queue[index])
+        return size
+
+    def _makeQueueRoom(self, key: Optional[tuple[int, int]], bytes_: bytes) -> bool:
+        """Drops queued low priority packets to make room for `bytes_` in a
+        full queue. Must be called with `_bufferLock` held.
+
+        :return: whether `bytes_` fits in the queue now
+        """
+
+        if _isDroppable(bytes_):
+            return False
+
+        self.queue = [i for i in self.queue if i and not _isDroppable(i)]
+        self._queueSize = sum(len(i) for i in self.queue)
+        self._coalescedIndexes = {
+            packetKey: index
+            for index, packet in enumerate(self.queue)
+            if (packetKey := _coalesceKey(packet)) is not None
+        }
+        if self._queueSizeWith(key, bytes_) <= settings.PS_MAX_QUEUE_BYTES:
+            return True
+
+        log.warning(
+            f"Packet queue of {self.username} ({self.userID}) is full, dropping packets.",
+        )
+        return False
 
     def resetQueue(self) -> None:
         """Resets the queue. Call when enqueued packets have been sent"""
 
         with self._bufferLock:
-            self.queue.clear()
+            self.queue = []
+            self._queueSize = 0
+            self._coalescedIndexes = {}
 
     def fetch_queue(self) -> bytes:
         """Manages getting all of the queued packets for the users and clearing
         the queue, alongside managing the type."""
 
         with self._bufferLock:
-            b = bytes(self.queue.copy())
-            self.queue.clear()
+            queue = self.queue
+            self.queue = []
+            self._queueSize = 0
+            self._coalescedIndexes = {}
 
-        return b
+        return b"".join(queue)
+
+    def getPresencePacket(self) -> bytes:
+        """Returns the user panel packet of this user, encoding it only if
+        the cached one has been invalidated."""
+
+        with self._packetCacheLock:
+            if self._presencePacket is None:
+                self._presencePacket = serverPackets.build_user_presence(self)
+            return self._presencePacket
+
+    def getStatsPacket(self) -> bytes:
+        """Returns the user stats packet of this user, encoding it only if
+        the cached one has been invalidated."""
+
+        with self._packetCacheLock:
+            if self._statsPacket is None:
+                self._statsPacket = serverPackets.build_user_stats(self)
+            return self._statsPacket
+
+    def invalidatePresence(self) -> None:
+        """Drops the cached user panel packet and shares the token's new state.
+        Call after changing any of the fields it is built from (location,
+        country, privileges, rank...)."""
+
+        with self._packetCacheLock:
+            self._presencePacket = None
+        self.shareState()
+
+    def invalidateStats(self) -> None:
+        """Drops the cached user stats packet and shares the token's new state.
+        Call after changing the action or the cached stats of this user."""
+
+        with self._packetCacheLock:
+            self._statsPacket = None
+        self.shareState()
 
     def joinChannel(self, channelObject: Channel):
         """
@@ -220,6 +501,7 @@ class UserToken:
         :param longitude: longitude
         """
         self.location = (latitude, longitude)
+        self.invalidatePresence()
 
     def getLatitude(self) -> float:
         """
@@ -492,8 +774,18 @@ class UserToken:
             seconds = max(0, userUtils.getSilenceEnd(self.userID) - int(time.time()))
         else:
             # Silence in db and token
-            userUtils.silence(self.userID, seconds, reason, author)
+            glob.db.runDeferred(userUtils.silence, self.userID, seconds, reason, author)
+
+        self.setSilence(seconds)
+
+    def setSilence(self, seconds: int) -> None:
+        """
+        Silences this token only (packet and token), eg. when the db already
+        has the new silence
 
+        :param seconds: silence length in seconds
+        :return:
+        """
         # Silence token
         self.silenceEndTime = int(time.time()) + seconds
 
@@ -502,6 +794,7 @@ class UserToken:
 
         # Send silenced packet to everyone else
         glob.streams.broadcast("main", serverPackets.silenced_notify(self.userID))
+        self.shareState()
 
     def spamProtection(self, increaseSpamRate=True):
         """
@@ -527,77 +820,133 @@ class UserToken:
         """
         return max(0, self.silenceEndTime - int(time.time()))
 
-    def updateCachedStats(self):
+    def updateCachedStats(self, callback: Optional[Callable[[], None]] = None) -> None:
         """
-        Update all cached stats for this token
+        Update all cached stats for this token for the current game mode and
+        relax/autopilot state. Served from the stats cache unless they are stale,
+        in which case they are fetched through `requestsManager.runDetached`.
 
+        :param callback: called once the stats are set, right away if they were cached
         :return:
         """
+        key = (self.gameMode, self.relaxing, self.autopiloting)
+        cached = self._statsCache.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            self._setCachedStats(cached[0])
+            if callback is not None:
+                callback()
+            return
 
-        if self.relaxing:
-            stats_relax = userUtils.getUserStatsRx(self.userID, self.gameMode)
+        requestsManager.runDetached(
+            self._fetchStats,
+            key,
+            callback=functools.partial(self._storeStats, key, callback),
+        )
 
-            self.gameRank = stats_relax["gameRank"]
-            self.pp = stats_relax["pp"]
-            self.rankedScore = stats_relax["rankedScore"]
-            self.accuracy = stats_relax["accuracy"] / 100
-            self.playcount = stats_relax["playcount"]
-            self.totalScore = stats_relax["totalScore"]
+    def _fetchStats(self, key: tuple[int, bool, bool]) -> dict[str, Any]:
+        gameMode, relaxing, autopiloting = key
+        if relaxing:
+            return userUtils.getUserStatsRx(self.userID, gameMode)
+        elif autopiloting:
+            return userUtils.getUserStatsAP(self.userID, gameMode)
+        return userUtils.getUserStats(self.userID, gameMode)
 
-        elif self.autopiloting:
-            stats_ap = userUtils.getUserStatsAP(self.userID, self.gameMode)
+    def _storeStats(
+        self,
+        key: tuple[int, bool, bool],
+        callback: Optional[Callable[[], None]],
+        stats: dict[str, Any],
+    ) -> None:
+        self._statsCache[key] = (stats, time.monotonic() + STATS_CACHE_TTL)
 
-            self.gameRank = stats_ap["gameRank"]
-            self.pp = stats_ap["pp"]
-            self.rankedScore = stats_ap["rankedScore"]
-            self.accuracy = stats_ap["accuracy"] / 100
-            self.playcount = stats_ap["playcount"]
-            self.totalScore = stats_ap["totalScore"]
-        else:
-            stats = userUtils.getUserStats(self.userID, self.gameMode)
+        # The user may have changed mode while they were being fetched
+        if key == (self.gameMode, self.relaxing, self.autopiloting):
+            self._setCachedStats(stats)
+            if callback is not None:
+                callback()
 
-            self.gameRank = stats["gameRank"]
-            self.pp = stats["pp"]
-            self.rankedScore = stats["rankedScore"]
-            self.accuracy = stats["accuracy"] / 100
-            self.playcount = stats["playcount"]
-            self.totalScore = stats["totalScore"]
+    def invalidateStatsCache(self) -> None:
+        """Drops every cached stats row of this user. Call when their stats
+        changed in the db (eg. a score was submitted)."""
+
+        self._statsCache = {}
 
-    def refresh_privs(self) -> None:
+    def _setCachedStats(self, stats: dict[str, Any]) -> None:
+        """
+        Set the cached stats of this token from a stats row
+
+        :param stats: dict with rankedScore, accuracy, playcount, totalScore, pp and gameRank
+        :return:
+        """
+        values = (
+            stats["pp"],
+            stats["rankedScore"],
+            stats["accuracy"] / 100,
+            stats["playcount"],
+            stats["totalScore"],
+        )
+        if stats["gameRank"] != self.gameRank:
+            # The rank is part of both packets
+            self.gameRank = stats["gameRank"]
+            self.invalidatePresence()
+            self.invalidateStats()
+
+        if values != (
+            self.pp,
+            self.rankedScore,
+            self.accuracy,
+            self.playcount,
+            self.totalScore,
+        ):
+            (
+                self.pp,
+                self.rankedScore,
+                self.accuracy,
+                self.playcount,
+                self.totalScore,
+            ) = values
+            self.invalidateStats()
+
+    def refresh_privs(self, privs: Optional[int] = None) -> None:
         """Fetches the user's privilege group directly from the db and sets
-        it in the obj."""
+        it in the obj. Callers that can't block pass the already fetched `privs`."""
 
-        self.privileges = int(
-            glob.db.fetch(
+        if privs is None:
+            privs = glob.db.fetch(
                 "SELECT privileges FROM users WHERE id = %s LIMIT 1",
                 [self.userID],
-            )["privileges"],
-        )
+            )["privileges"]
+        self.privileges = int(privs)
+        self.invalidatePresence()
 
-    def checkRestricted(self):
+    def checkRestricted(self, privs: Optional[int] = None):
         """
         Check if this token is restricted. If so, send fokabot message
 
+        :param privs: the user's privileges, if already fetched. Default: fetched from db
         :return:
         """
         oldRestricted = self.restricted
-        self.refresh_privs()
+        self.refresh_privs(privs)
 
         if self.restricted:
             self.notify_restricted()
         elif not self.restricted and oldRestricted != self.restricted:
             self.notify_unrestricted()
 
-    def checkBanned(self):
+    def checkBanned(self, banned: Optional[bool] = None):
         """
         Check if this user is banned. If so, disconnect it.
 
+        :param banned: `userUtils.isBanned`, if already fetched. Default: fetched from db
         :return:
         """
 
         # Ok so the only place where this is used is right after a priv refresh
         # from db so...
-        if userUtils.isBanned(self.userID):
+        if banned is None:
+            banned = userUtils.isBanned(self.userID)
+        if banned:
             self.enqueue(serverPackets.login_banned())
             logoutEvent.handle(self, deleteToken=False)
 
@@ -634,7 +983,7 @@ class UserToken:
         :param name: stream name
         :return:
         """
-        glob.streams.join(name, token=self.token)
+        glob.streams.join(name, client=self)
         if name not in self.streams:
             self.streams.append(name)
 
@@ -645,7 +994,7 @@ class UserToken:
         :param name: stream name
         :return:
         """
-        glob.streams.leave(name, token=self.token)
+        glob.streams.leave(name, client=self)
         if name in self.streams:
             self.streams.remove(name)
 
@@ -655,7 +1004,7 @@ class UserToken:
 
         :return:
         """
-        for i in self.streams:
+        for i in tuple(self.streams):
             self.leaveStream(i)
 
     def awayCheck(self, userID: int) -> bool:
@@ -690,6 +1039,7 @@ class UserToken:
                 message=message[:50],
             ),
         )
+        self.shareState()
 
     def getMessagesBufferString(self) -> str:
         """
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import threading
+from typing import Any
+from typing import Optional
+
+from objects import glob
+from objects.osuToken import SHARED_FIELDS
+from objects.osuToken import UserToken
+
+
+class RemoteToken:
+    """
+    Copy of the token of a user connected to another worker process, its
+    `owner` (see `helpers.worker_bus`). Copies are kept in `glob.tokens`, so
+    lookups find every online user. Their fields are kept up to date by the
+    owner, and calls acting on the user are sent to it.
+    They never join streams, broadcasts are relayed to the owner instead.
+    """
+
+    remote = True
+
+    def __init__(self, token: str, owner: int, state: dict[str, Any]) -> None:
+        """
+        Create a copy of another worker's token
+
+        :param token: token string
+        :param owner: ID of the worker that owns the token
+        :param state: the token's `SHARED_FIELDS`
+        """
+        self.token = token
+        self.kicked = False
+        self.streams = []
+        self.spectators = []
+        self.sentAway = []
+        self.spamRate = 0
+
+        # Encoded user panel and stats packets, rebuilt only after an update
+        self._presencePacket: Optional[bytes] = None
+        self._statsPacket: Optional[bytes] = None
+        self._packetCacheLock = threading.Lock()
+
+        self.update(owner, state)
+
+    def update(self, owner: int, state: dict[str, Any]) -> None:
+        """
+        Set the fields shared by the owner of the token
+
+        :param owner: ID of the worker that owns the token
+        :param state: the token's `SHARED_FIELDS`
+        """
+        self.owner = owner
+        for field in SHARED_FIELDS:
+            setattr(self, field, state[field])
+
+        with self._packetCacheLock:
+            self._presencePacket = None
+            self._statsPacket = None
+
+    # These only read the shared fields, they work the same on copies
+    restricted = UserToken.restricted
+    admin = UserToken.admin
+    banned = UserToken.banned
+    silenced = UserToken.silenced
+    getPresencePacket = UserToken.getPresencePacket
+    getStatsPacket = UserToken.getStatsPacket
+    getLatitude = UserToken.getLatitude
+    getLongitude = UserToken.getLongitude
+    getSilenceSecondsLeft = UserToken.getSilenceSecondsLeft
+    getMessagesBufferString = UserToken.getMessagesBufferString
+    awayCheck = UserToken.awayCheck
+
+    def enqueue(self, bytes_: bytes) -> None:
+        glob.worker_bus.enqueue(self, bytes_)
+
+    def kick(
+        self,
+        message="You have been kicked from the server. Please login again.",
+        reason="kick",
+    ):
+        glob.worker_bus.call(self, "kick", message, reason)
+
+    def silence(self, seconds=None, reason="", author: Optional[int] = None):
+        glob.worker_bus.call(self, "silence", seconds, reason, author)
+
+    def setSilence(self, seconds: int) -> None:
+        glob.worker_bus.call(self, "setSilence", seconds)
+
+    def spamProtection(self, increaseSpamRate=True):
+        glob.worker_bus.call(self, "spamProtection", increaseSpamRate)
+
+    def notify_restricted(self) -> None:
+        glob.worker_bus.call(self, "notify_restricted")
+
+    def notify_unrestricted(self) -> None:
+        glob.worker_bus.call(self, "notify_unrestricted")
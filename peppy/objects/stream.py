@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from collections.abc import Iterable
 from typing import Optional
 from typing import TYPE_CHECKING
 
@@ -18,7 +19,9 @@ class Stream:
         :param name: stream name
         """
         self.name = name
-        self.clients: list[str] = []
+
+        # Token string -> token object, so fan-out doesn't go through `glob.tokens`.
+        self.clients: dict[str, UserToken] = {}
 
     def addClient(
         self,
@@ -32,13 +35,16 @@ class Stream:
         :param token: client uuid string
         :return: Bool of success
         """
-        if client is None and token is None:
-            return False
-        if client is not None:
-            token = client.token
-        if token not in self.clients:
-            log.info(f"{token} has joined stream {self.name}")
-            self.clients.append(token)
+        if client is None:
+            if token is None:
+                return False
+            client = glob.tokens.tokens.get(token)
+            if client is None:
+                return False
+
+        if client.token not in self.clients:
+            log.info(f"{client.token} has joined stream {self.name}")
+            self.clients[client.token] = client
             return True
 
         return False
@@ -59,23 +65,27 @@ class Stream:
             return
         if client is not None:
             token = client.token
-        if token in self.clients:
+        if self.clients.pop(token, None) is not None:
             log.info(f"{token} has left stream {self.name}")
-            self.clients.remove(token)
 
-    def broadcast(self, data: bytes, but: Optional[list[str]] = None) -> None:
+    def broadcast(self, data: bytes, but: Optional[Iterable[str]] = None) -> None:
         """
         Send some data to all (or some) clients connected to this stream
 
-        :param data: data to send
-        :param but: array of tokens to ignore. Default: None (send to everyone)
+        :param data: data to send. The same object is enqueued to every client.
+        :param but: tokens to ignore. Default: None (send to everyone)
         :return:
         """
-        if but is None:
-            but = []
-        for token_str in self.clients:
-            token = glob.tokens.tokens.get(token_str)
-            if token and token.token not in but:
+        # Snapshot the members, clients may join or leave while we're enqueuing
+        recipients = tuple(self.clients.values())
+        if not but:
+            for token in recipients:
+                token.enqueue(data)
+            return
+
+        but = frozenset(but)
+        for token in recipients:
+            if token.token not in but:
                 token.enqueue(data)
 
     def dispose(self) -> None:
@@ -84,7 +94,5 @@ class Stream:
 
         :return:
         """
-        for i in self.clients:
-            token = glob.tokens.tokens.get(i)
-            if token:
-                token.leaveStream(self.name)
+        for token in tuple(self.clients.values()):
+            token.leaveStream(self.name)
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from common.redis import generalPubSubHandler
 from common.ripple import userUtils
+from common.web import requestsManager
 from objects import glob
 
 
@@ -15,6 +16,14 @@ class handler(generalPubSubHandler.generalPubSubHandler):
         if userID is None:
             return
         targetToken = glob.tokens.getTokenFromUserID(userID)
-        if targetToken is not None:
-            targetToken.checkBanned()
-            targetToken.checkRestricted()
+        # Every worker gets it, the one owning the token handles it
+        if targetToken is not None and not targetToken.remote:
+            # Query on this thread, change the token on the loop
+            banned = userUtils.isBanned(userID)
+            privs = userUtils.getPrivileges(userID)
+            requestsManager.runOnLoop(checkToken, targetToken, banned, privs)
+
+
+def checkToken(token, banned, privs):
+    token.checkBanned(banned)
+    token.checkRestricted(privs)
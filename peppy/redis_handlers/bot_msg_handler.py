@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from common.redis import generalPubSubHandler
+from common.web import requestsManager
 from helpers import chatHelper
 from objects import glob
 
@@ -15,8 +16,13 @@ class handler(generalPubSubHandler.generalPubSubHandler):
         if handler_data is None:
             return
 
-        chatHelper.sendMessage(
-            fro=glob.BOT_NAME,
-            to=handler_data["to"].encode("latin-1").decode("utf-8"),
-            message=handler_data["message"].encode("latin-1").decode("utf-8"),
+        # Every worker gets it, but the message must only be sent once
+        if glob.worker_bus is not None and not glob.worker_bus.isHub:
+            return
+
+        requestsManager.runOnLoop(
+            chatHelper.sendMessage,
+            glob.BOT_NAME,
+            handler_data["to"].encode("latin-1").decode("utf-8"),
+            handler_data["message"].encode("latin-1").decode("utf-8"),
         )
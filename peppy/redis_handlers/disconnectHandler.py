@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from common.redis import generalPubSubHandler
+from common.web import requestsManager
 from objects import glob
 
 
@@ -14,5 +15,6 @@ class handler(generalPubSubHandler.generalPubSubHandler):
         if data is None:
             return
         targetToken = glob.tokens.getTokenFromUserID(data["userID"])
-        if targetToken is not None:
-            targetToken.kick(data["reason"], "pubsub_kick")
+        # Every worker gets it, the one owning the token handles it
+        if targetToken is not None and not targetToken.remote:
+            requestsManager.runOnLoop(targetToken.kick, data["reason"], "pubsub_kick")
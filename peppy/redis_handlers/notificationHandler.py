@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from common.redis import generalPubSubHandler
+from common.web import requestsManager
 from constants import serverPackets
 from objects import glob
 
@@ -15,5 +16,9 @@ class handler(generalPubSubHandler.generalPubSubHandler):
         if data is None:
             return
         targetToken = glob.tokens.getTokenFromUserID(data["userID"])
-        if targetToken is not None:
-            targetToken.enqueue(serverPackets.notification(data["message"]))
+        # Every worker gets it, the one owning the token handles it
+        if targetToken is not None and not targetToken.remote:
+            requestsManager.runOnLoop(
+                targetToken.enqueue,
+                serverPackets.notification(data["message"]),
+            )
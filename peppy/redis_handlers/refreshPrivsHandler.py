@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 from common.redis import generalPubSubHandler
+from common.ripple import userUtils
+from common.web import requestsManager
 from objects import glob
 
 
@@ -16,5 +18,8 @@ class handler(generalPubSubHandler.generalPubSubHandler):
         if data is None:
             return
         targetToken = glob.tokens.getTokenFromUserID(data["user_id"])
-        if targetToken is not None:
-            targetToken.refresh_privs()
+        # Every worker gets it, the one owning the token handles it
+        if targetToken is not None and not targetToken.remote:
+            # Query on this thread, change the token on the loop
+            privs = userUtils.getPrivileges(data["user_id"])
+            requestsManager.runOnLoop(targetToken.refresh_privs, privs)
@@ -1,6 +1,10 @@
 from __future__ import annotations
 
+import time
+
 from common.redis import generalPubSubHandler
+from common.ripple import userUtils
+from common.web import requestsManager
 from objects import glob
 
 
@@ -14,5 +18,8 @@ class handler(generalPubSubHandler.generalPubSubHandler):
         if userID is None:
             return
         targetToken = glob.tokens.getTokenFromUserID(userID)
-        if targetToken is not None:
-            targetToken.silence()
+        # Every worker gets it, the one owning the token handles it
+        if targetToken is not None and not targetToken.remote:
+            # Query on this thread, change the token on the loop
+            seconds = max(0, userUtils.getSilenceEnd(userID) - int(time.time()))
+            requestsManager.runOnLoop(targetToken.setSilence, seconds)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from common.redis import generalPubSubHandler
+from common.web import requestsManager
 from objects import glob
 
 
@@ -13,6 +14,12 @@ class handler(generalPubSubHandler.generalPubSubHandler):
         userID = super().parseData(userID)
         if userID is None:
             return
-        targetToken = glob.tokens.getTokenFromUserID(userID)
-        if targetToken is not None:
-            targetToken.updateCachedStats()
+        for targetToken in glob.tokens.getTokensFromUserID(userID):
+            # Every worker gets it, the one owning the token handles it
+            if not targetToken.remote:
+                requestsManager.runOnLoop(refreshStats, targetToken)
+
+
+def refreshStats(token):
+    token.invalidateStatsCache()
+    token.updateCachedStats()
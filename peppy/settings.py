@@ -23,7 +23,10 @@ def _parse_int_list(value: str) -> list[int]:
 HTTP_PORT = int(os.environ["HTTP_PORT"])
 HTTP_ADDRESS = os.environ["HTTP_ADDRESS"]
 HTTP_THREAD_COUNT = int(os.environ["HTTP_THREAD_COUNT"])
+HTTP_ASYNC_MODE = _parse_bool(os.environ["HTTP_ASYNC_MODE"])
 HTTP_USING_CLOUDFLARE = _parse_bool(os.environ["HTTP_USING_CLOUDFLARE"])
+HTTP_WORKER_COUNT = int(os.environ["HTTP_WORKER_COUNT"])
+HTTP_WORKER_PORT = int(os.environ["HTTP_WORKER_PORT"])
 
 MYSQL_HOST = os.environ["MYSQL_HOST"]
 MYSQL_PORT = int(os.environ["MYSQL_PORT"])
@@ -36,6 +39,7 @@ REDIS_HOST = os.environ["REDIS_HOST"]
 REDIS_PORT = int(os.environ["REDIS_PORT"])
 REDIS_PASSWORD = os.environ["REDIS_PASSWORD"]
 REDIS_DB = int(os.environ["REDIS_DB"])
+REDIS_POOL_SIZE = int(os.environ["REDIS_POOL_SIZE"])
 
 PERFORMANCE_SERVICE_URL = os.environ["PERFORMANCE_SERVICE_URL"]
 USSR_URL = os.environ["USSR_URL"]
@@ -50,8 +54,10 @@ PS_BOT_USER_ID = int(os.environ["PS_BOT_USER_ID"])
 PS_MINIMUM_CLIENT_YEAR = int(os.environ["PS_MINIMUM_CLIENT_YEAR"])
 PS_ENABLE_PY_COMMAND = _parse_bool(os.environ["PS_ENABLE_PY_COMMAND"])
 PS_PY_COMMAND_WHITELIST = _parse_int_list(os.environ["PS_PY_COMMAND_WHITELIST"])
+PS_MAX_QUEUE_BYTES = int(os.environ["PS_MAX_QUEUE_BYTES"])
 
 DATA_BEATMAP_DIRECTORY = os.environ["DATA_BEATMAP_DIRECTORY"]
 DATA_BIBLE_PATH = os.environ["DATA_BIBLE_PATH"]
+DATA_GEOLOCATION_DATABASE_PATH = os.environ["DATA_GEOLOCATION_DATABASE_PATH"]
 
 IP2LOCATION_API_KEY = os.environ["IP2LOCATION_API_KEY"]